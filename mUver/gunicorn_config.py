@@ -0,0 +1,35 @@
+"""
+gunicorn settings for the web process.
+
+gevent workers switch to another request whenever one waits on a
+socket, so a worker blocked on stripe, twilio, the geocoder or postgres
+keeps serving the rest, including held SSE streams and long polls.
+"""
+import os
+
+worker_class = 'gevent'
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+# most open requests are SSE streams and long polls that have released
+# their database connection, so the client count isn't what protects
+# postgres. The Procfile runs the web dyno behind pgbouncer in session
+# mode (session mode keeps the broker's LISTEN working): at most
+# PGBOUNCER_DEFAULT_POOL_SIZE server connections, requests past that
+# wait in pgbouncer's queue until one frees up.
+#
+# connections on a hobby database, 20 in all:
+#   web          10  the pgbouncer pool, shared by a broker LISTEN
+#                    connection per worker, requests and the
+#                    GEOCODE_WORKERS job pool threads of each worker
+#   payments      5  PAYMENT_WORKERS threads and the claim query
+#   worker        1  deliver_sms
+#   spare         4  heroku run, migrations, psql
+# Raise PGBOUNCER_DEFAULT_POOL_SIZE with the database plan.
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 200))
+timeout = 30
+
+
+def post_fork(server, worker):
+    # psycopg2 is a C extension, gevent's monkey patching doesn't reach
+    # its sockets without a wait callback
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
@@ -5,9 +5,33 @@ from .settings import *
 DEBUG = False
 SECRET_KEY = os.environ['SECRET_KEY']
 
+# dev tooling stays out of the app registry, the url conf and boot time
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in DEV_APPS]
+
 DATABASES['default'] = dj_database_url.config()
 DATABASES['default']['ENGINE'] = 'django.contrib.gis.db.backends.postgis'
 
+# comma separated urls of read only followers of the primary
+REPLICA_DATABASES = []
+for index, url in enumerate(
+        filter(None, os.environ.get('REPLICA_DATABASE_URLS', '').split(','))):
+    alias = 'replica{}'.format(index)
+    DATABASES[alias] = dj_database_url.parse(url)
+    DATABASES[alias]['ENGINE'] = 'django.contrib.gis.db.backends.postgis'
+    REPLICA_DATABASES.append(alias)
+
+# the feed cache versions and replica pins must be seen by every dyno
+# and worker, the per process LocMemCache would keep them apart
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+        },
+    }
+}
+
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 
 ALLOWED_HOSTS = ['*']
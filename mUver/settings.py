@@ -38,17 +38,24 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.gis',
-    'django_extensions',
     'rest_framework',
-    'rest_framework_swagger',
     'rest_framework.authtoken',
     'corsheaders',
     'muver_api',
-    'twilio'
+]
 
+# development tooling, heroku-settings leaves these out
+DEV_APPS = [
+    'django_extensions',
+    'rest_framework_swagger',
 ]
 
+INSTALLED_APPS += DEV_APPS
+
 MIDDLEWARE_CLASSES = [
+    'muver_api.middlewares.PerformanceMiddleware',
+    'muver_api.middlewares.ReplicaRoutingMiddleware',
+    'muver_api.middlewares.DeadlineMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -97,6 +104,18 @@ DATABASES = {
     }
 }
 
+# read only copies of default, safe-method requests read from them
+REPLICA_DATABASES = []
+DATABASE_ROUTERS = ['muver_api.routers.ReplicaRouter']
+# replicas further behind than this many seconds are skipped
+REPLICA_MAX_LAG = 5
+REPLICA_LAG_CHECK_INTERVAL = 5
+# clients read from the primary this long after a write
+REPLICA_STICKY_SECONDS = 10
+# has to be shared by every process, the muver_api.E001 check fails
+# on a per process cache once REPLICA_DATABASES is set
+REPLICA_PIN_CACHE = 'default'
+
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
 
@@ -135,13 +154,24 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# records wait here for the background log thread, more are dropped
+LOG_QUEUE_SIZE = 10000
+# share of the records below WARNING kept per logger
+LOG_SAMPLE_RATES = {
+    'muver_api.performance': 0.2,
+}
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
     'filters': {
         'require_debug_false': {
             '()': 'django.utils.log.RequireDebugFalse'
-        }
+        },
+        'sampling': {
+            '()': 'muver_api.log.SamplingFilter',
+            'rates': LOG_SAMPLE_RATES,
+        },
     },
     'formatters': {
         'verbose': {
@@ -152,7 +182,10 @@ LOGGING = {
         },
         'simple': {
             'format': '%(levelname)s %(message)s'
-        }
+        },
+        'json': {
+            '()': 'muver_api.log.JSONFormatter',
+        },
     },
     'handlers': {
         'null': {
@@ -176,23 +209,35 @@ LOGGING = {
             'class': 'django.utils.log.AdminEmailHandler'
         },
         'console':{
-            'level':'ERROR',
+            'level':'INFO',
             'class':'logging.StreamHandler',
-            'stream': sys.stdout
+            'stream': sys.stdout,
+            'formatter': 'json'
+        },
+        # request threads only put records on a queue, a background
+        # thread writes them to the handlers in targets
+        'queue': {
+            'class': 'muver_api.log.BoundedQueueHandler',
+            'targets': ['console'],
+            'capacity': LOG_QUEUE_SIZE,
+            'filters': ['sampling'],
         }
     },
     'loggers': {
         'django': {
-            'handlers': ['console'],
+            'handlers': ['queue'],
+            'level': 'ERROR',
             'propagate': True,
         },
         'django.request': {
-            'handlers': ['console'],
+            'handlers': ['queue'],
             'level': 'ERROR',
-            'propagate': True,
+            'propagate': False,
         },
-        'muver_api.views': {
-            'handlers': ['console'],
+        'muver_api': {
+            'handlers': ['queue'],
+            'level': 'INFO',
+            'propagate': False,
         }
     }
     # 'loggers': {
@@ -228,7 +273,7 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 15,
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'muver_api.authentication.ProfileTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     )
 
@@ -239,4 +284,78 @@ STRIPE_SECRET_KEY = os.environ['STRIPE_SECRET_KEY']
 
 TWILIO_ACCOUNT_SID = os.environ['TWILIO_ACCOUNT_SID']
 TWILIO_AUTH_TOKEN = os.environ['TWILIO_AUTH_TOKEN']
-TWILIO_DEFAULT_CALLERID = 'mUver'
\ No newline at end of file
+TWILIO_DEFAULT_CALLERID = 'mUver'
+
+GEOCODER_BACKEND = os.environ.get('GEOCODER_BACKEND',
+                                  'muver_api.geocoding.GoogleGeocoder')
+GOOGLE_GEOCODE_KEY = os.environ.get('GOOGLE_GEOCODE_KEY')
+GEOCODE_ASYNC = True
+GEOCODE_WORKERS = 4
+GEOCODE_CACHE_SIZE = 10000
+GEOCODE_CACHE_TTL = 60 * 60 * 24 * 30
+# seconds StubGeocoder sleeps per call, to benchmark waiting on google
+GEOCODE_STUB_LATENCY = float(os.environ.get('GEOCODE_STUB_LATENCY', 0))
+
+SMS_BACKEND = 'muver_api.sms.TwilioBackend'
+SMS_BATCH_SIZE = 50
+SMS_MAX_ATTEMPTS = 8
+SMS_RETRY_DELAY = 30
+SMS_LEASE = 120
+TWILIO_FROM_NUMBER = '+17024661420'
+
+STRIPE_BACKEND = 'muver_api.payments.StripeBackend'
+PAYMENT_WORKERS = 4
+PAYMENT_BATCH_SIZE = 20
+PAYMENT_MAX_ATTEMPTS = 8
+PAYMENT_RETRY_DELAY = 10
+PAYMENT_LEASE = 120
+
+# keep-alive connection pools per external provider, sized for the
+# threads that call them (see muver_api.clients)
+HTTP_CLIENTS = {
+    'stripe': {'pool_size': PAYMENT_WORKERS, 'timeout': (3.05, 30)},
+    'twilio': {'pool_size': 2, 'timeout': (3.05, 10)},
+    'google': {'pool_size': GEOCODE_WORKERS, 'timeout': (3.05, 5)},
+}
+
+# consecutive failed calls that open a provider's breaker, and seconds
+# before a trial call is let through again
+CIRCUIT_BREAKERS = {
+    'stripe': {'failures': 5, 'reset_after': 30},
+    'twilio': {'failures': 5, 'reset_after': 60},
+    'google': {'failures': 10, 'reset_after': 30},
+}
+# seconds a request may spend on external calls, under the 30 second
+# heroku router timeout
+REQUEST_DEADLINE = 20
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+FEED_CACHE = 'default'
+FEED_CACHE_TIMEOUT = 30
+FEED_CACHE_PRECISION = 5
+FEED_REGION_PRECISION = 3
+
+
+# job events for the mover stream, PostgresBroker fans them out
+# across processes with LISTEN/NOTIFY
+BROKER_BACKEND = 'muver_api.broker.PostgresBroker'
+BROKER_QUEUE_SIZE = 100
+STREAM_TIMEOUT = 300
+STREAM_HEARTBEAT = 15
+# held job detail requests, kept under the 30 second heroku router timeout
+LONG_POLL_TIMEOUT = 25
+
+BULK_IMPORT_MAX_ROWS = 1000
+
+# milliseconds a fresh process may take to set up django and load the
+# url conf, checked by the startup_report command
+STARTUP_BUDGET_MS = 2000
+
+# share of requests timed by PerformanceMiddleware
+PERFORMANCE_SAMPLE_RATE = 0.05
+PERFORMANCE_SERVER_TIMING = True
@@ -10,4 +10,15 @@ DATABASE = {
           'HOST':     'localhost',
           'PORT':     '',
      }
-}
\ No newline at end of file
+}
+
+# a second connection to the test database, the replica tests turn on
+# routing with REPLICA_DATABASES = ['replica']
+DATABASES['replica'] = dict(DATABASES['default'],
+                            TEST={'MIRROR': 'default'})
+
+GEOCODER_BACKEND = 'muver_api.geocoding.StubGeocoder'
+SMS_BACKEND = 'muver_api.sms.LocalMemoryBackend'
+STRIPE_BACKEND = 'muver_api.payments.LocalStripeBackend'
+FEED_CACHE_TIMEOUT = 0
+BROKER_BACKEND = 'muver_api.broker.InMemoryBroker'
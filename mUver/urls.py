@@ -13,6 +13,7 @@ Including another URLconf
     1. Import the include() function: from django.conf.urls import url, include
     2. Add a URL to urlpatterns:  url(r'^blog/', include('blog.urls'))
 """
+from django.apps import apps
 from django.conf.urls import url, include
 from django.contrib import admin
 # from muver_api.views import ObtainAuthTokenWithUserID
@@ -22,5 +23,7 @@ urlpatterns = [
     url(r'^admin/', admin.site.urls),
     url(r'^api/', include('muver_api.urls')),
     url(r'^api/api-token-auth/$', obtain_auth_token),
-    url(r"^docs/", include('rest_framework_swagger.urls')),
 ]
+
+if apps.is_installed('rest_framework_swagger'):
+    urlpatterns.append(url(r"^docs/", include('rest_framework_swagger.urls')))
@@ -0,0 +1 @@
+default_app_config = 'muver_api.apps.MuverApiConfig'
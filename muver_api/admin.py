@@ -1,5 +1,6 @@
 from django.contrib import admin
-from muver_api.models import UserProfile, Job, Strike
+from muver_api.models import UserProfile, Job, Strike, GeocodedAddress, \
+    PaymentTask, TextMessage
 
 
 @admin.register(UserProfile)
@@ -16,9 +17,28 @@ class JobAdmin(admin.ModelAdmin):
                     'trip_distance', 'phone_number', 'charge_id',
                     'mover_profile', 'time_accepted', 'image_url',
                     'created_at', 'modified_at', 'status',
-                    'confirmation_user', 'confirmation_mover')
+                    'confirmation_user', 'confirmation_mover',
+                    'payment_status')
 
 
 @admin.register(Strike)
 class StrikeAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'profile', 'job', 'comment', 'created_at')
+
+
+@admin.register(GeocodedAddress)
+class GeocodedAddressAdmin(admin.ModelAdmin):
+    list_display = ('id', 'address', 'point', 'modified_at')
+
+
+@admin.register(TextMessage)
+class TextMessageAdmin(admin.ModelAdmin):
+    list_display = ('id', 'to', 'body', 'attempts', 'last_error',
+                    'next_attempt_at', 'sent_at', 'created_at')
+
+
+@admin.register(PaymentTask)
+class PaymentTaskAdmin(admin.ModelAdmin):
+    list_display = ('id', 'job', 'operation', 'charge_id', 'amount',
+                    'application_fee', 'attempts', 'last_error',
+                    'duration_ms', 'next_attempt_at', 'completed_at')
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class MuverApiConfig(AppConfig):
     name = 'muver_api'
+
+    def ready(self):
+        # registers the replica pin cache check
+        from muver_api import routers  # noqa
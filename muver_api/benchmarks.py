@@ -0,0 +1,360 @@
+import binascii
+import os
+import random
+import time
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from muver_api.bulk import reserve_job_ids
+from muver_api.geo import make_point, trip_miles
+from muver_api.models import Job, Strike, UserProfile
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory, \
+    force_authenticate
+
+CITIES = (
+    ("las vegas, nv", 36.1699, -115.1398),
+    ("henderson, nv", 36.0395, -114.9817),
+    ("reno, nv", 39.5296, -119.8138),
+    ("los angeles, ca", 34.0522, -118.2437),
+    ("phoenix, az", 33.4484, -112.0740),
+)
+
+# share of seeded jobs per state, roughly what production looks like
+STATE_WEIGHTS = (
+    (Job.OPEN, 50),
+    (Job.ACCEPTED, 15),
+    (Job.USER_CONFIRMED, 4),
+    (Job.MOVER_CONFIRMED, 4),
+    (Job.COMPLETE, 22),
+    (Job.CONFLICT, 5),
+)
+
+STATUSES = {
+    Job.OPEN: "Job needs a mover.",
+    Job.ACCEPTED: "Mover accepted job.",
+    Job.USER_CONFIRMED: "User set the job to complete. "
+                        "Waiting for mover confirmation.",
+    Job.MOVER_CONFIRMED: "Mover set the job to complete. "
+                         "Waiting for user confirmation.",
+    Job.COMPLETE: "Job complete.",
+    Job.CONFLICT: "A conflict occurred with user/mover.",
+}
+
+
+def percentile(samples, pct):
+    """
+    returns the pct percentile (0-100) of a list of samples
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = int(round((pct / 100.0) * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def summarize(samples):
+    """
+    returns p50/p95/p99/max of a list of millisecond samples
+    """
+    return {
+        'runs': len(samples),
+        'p50': round(percentile(samples, 50), 3),
+        'p95': round(percentile(samples, 95), 3),
+        'p99': round(percentile(samples, 99), 3),
+        'max': round(max(samples), 3) if samples else 0.0,
+    }
+
+
+def time_queryset(queryset, runs, page_size=15):
+    """
+    evaluates the first page of a queryset `runs` times
+    and returns the latency of each run in milliseconds
+    """
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        list(queryset.all()[:page_size])
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def explain(queryset, page_size=15):
+    """
+    returns the EXPLAIN ANALYZE output for the first page of a queryset
+    """
+    sql, params = queryset[:page_size].query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN ANALYZE ' + sql, params)
+        return "\n".join(row[0] for row in cursor.fetchall())
+
+
+def view_queryset(view_class, params, user=None):
+    """
+    builds the queryset a list view would use for a GET with `params`
+    """
+    request = APIRequestFactory().get('/', params)
+    if user is not None:
+        force_authenticate(request, user=user)
+    view = view_class(request=Request(request), format_kwarg=None,
+                      kwargs={}, args=())
+    return view.get_queryset()
+
+
+def benchmark_user(username='benchmark'):
+    user = User.objects.filter(username=username).first()
+    if user is None:
+        user = User.objects.create_user(username=username, email="",
+                                        password="benchmark")
+    return user
+
+
+def seed_jobs(user, count, latitude, longitude, spread=1.0, open_ratio=0.75,
+              batch_size=5000):
+    """
+    bulk inserts `count` jobs scattered `spread` degrees around a point.
+    roughly `open_ratio` of them are open, the rest are complete.
+    """
+    created = 0
+    while created < count:
+        size = min(batch_size, count - created)
+        jobs = []
+        for _ in range(size):
+            lat_a = latitude + random.uniform(-spread, spread)
+            lng_a = longitude + random.uniform(-spread, spread)
+            lat_b = lat_a + random.uniform(-0.2, 0.2)
+            lng_b = lng_a + random.uniform(-0.2, 0.2)
+            point_a = make_point(lat_a, lng_a)
+            point_b = make_point(lat_b, lng_b)
+            complete = random.random() > open_ratio
+            jobs.append(Job(user=user,
+                            title="benchmark job",
+                            pickup_for="benchmark",
+                            phone_number="5555555555",
+                            price=random.randint(20, 300),
+                            destination_a="las vegas, nv",
+                            destination_b="henderson, nv",
+                            point_a=point_a,
+                            point_b=point_b,
+                            trip_distance=trip_miles(point_a, point_b),
+                            complete=complete,
+                            state=Job.COMPLETE if complete else Job.OPEN,
+                            status="Job needs a mover."))
+        Job.objects.bulk_create(jobs)
+        created += size
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE muver_api_job')
+    return created
+
+
+def seed_users(count, mover_ratio=0.3, prefix='seed', batch_size=2000):
+    """
+    bulk inserts `count` users with their tokens and profiles,
+    roughly `mover_ratio` of them movers with a stripe account.
+    returns (posters, movers) as lists of profiles
+    """
+    password = make_password('seed')
+    start = User.objects.filter(username__startswith=prefix + '-').count()
+    created = 0
+    while created < count:
+        names = ['{}-{}'.format(prefix, start + created + i)
+                 for i in range(min(batch_size, count - created))]
+        User.objects.bulk_create([
+            User(username=name, email=name + '@example.com',
+                 password=password) for name in names])
+        ids = User.objects.filter(username__in=names)\
+            .values_list('id', flat=True)
+        # bulk_create skips the post_save hook that makes these
+        Token.objects.bulk_create([
+            Token(user_id=user_id,
+                  key=binascii.hexlify(os.urandom(20)).decode())
+            for user_id in ids])
+        profiles = []
+        for user_id in ids:
+            mover = random.random() < mover_ratio
+            profiles.append(UserProfile(
+                user_id=user_id, mover=mover,
+                display_name="seed {}".format(user_id),
+                phone_number="555{:07d}".format(user_id % 10000000),
+                customer_id="cus_seed{}".format(user_id),
+                stripe_account_id="acct_seed{}".format(user_id)
+                if mover else None))
+        UserProfile.objects.bulk_create(profiles)
+        created += len(names)
+    return seeded_profiles(prefix)
+
+
+def seeded_profiles(prefix='seed'):
+    """
+    returns (posters, movers) profiles made by seed_users
+    """
+    profiles = list(UserProfile.objects.filter(
+        user__username__startswith=prefix + '-').select_related('user'))
+    return ([profile for profile in profiles if not profile.mover],
+            [profile for profile in profiles if profile.mover])
+
+
+def random_state():
+    pick = random.uniform(0, sum(weight for _, weight in STATE_WEIGHTS))
+    for state, weight in STATE_WEIGHTS:
+        pick -= weight
+        if pick <= 0:
+            return state
+    return Job.OPEN
+
+
+def seeded_job(poster, mover):
+    """
+    returns an unsaved job between two random spots of a city,
+    in a random state with the flags that state implies
+    """
+    city, latitude, longitude = random.choice(CITIES)
+    point_a = make_point(latitude + random.uniform(-0.3, 0.3),
+                         longitude + random.uniform(-0.3, 0.3))
+    point_b = make_point(point_a.y + random.uniform(-0.2, 0.2),
+                         point_a.x + random.uniform(-0.2, 0.2))
+    state = random_state()
+    job = Job(user_id=poster.user_id,
+              title="seeded job",
+              pickup_for=poster.display_name,
+              phone_number=poster.phone_number,
+              price=random.randint(20, 300),
+              destination_a=city,
+              destination_b=city,
+              point_a=point_a,
+              point_b=point_b,
+              trip_distance=trip_miles(point_a, point_b),
+              state=state,
+              status=STATUSES[state])
+    if state != Job.OPEN:
+        job.mover_profile_id = mover.id
+        job.charge_id = "ch_seed"
+    job.confirmation_user = state in (Job.USER_CONFIRMED, Job.COMPLETE)
+    job.confirmation_mover = state in (Job.MOVER_CONFIRMED, Job.COMPLETE)
+    job.complete = state == Job.COMPLETE
+    job.conflict = state == Job.CONFLICT
+    return job
+
+
+def seed_marketplace(posters, movers, count, strike_ratio=0.5,
+                     batch_size=5000):
+    """
+    bulk inserts `count` jobs spread over CITIES between random posters
+    and movers. `strike_ratio` of the conflicts get a strike on the
+    mover. returns (jobs, strikes) created
+    """
+    created = strikes = 0
+    while created < count:
+        size = min(batch_size, count - created)
+        jobs = [seeded_job(random.choice(posters), random.choice(movers))
+                for _ in range(size)]
+        with transaction.atomic():
+            for job, job_id in zip(jobs, reserve_job_ids(size)):
+                job.id = job_id
+            Job.objects.bulk_create(jobs)
+            batch = [Strike(user_id=job.user_id, job_id=job.id,
+                            profile_id=job.mover_profile_id,
+                            comment="seeded strike")
+                     for job in jobs if job.state == Job.CONFLICT and
+                     random.random() < strike_ratio]
+            Strike.objects.bulk_create(batch)
+        created += size
+        strikes += len(batch)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE muver_api_job')
+        cursor.execute('ANALYZE muver_api_strike')
+    return created, strikes
+
+
+def feed_request(client, context):
+    city, latitude, longitude = random.choice(CITIES)
+    client.force_authenticate(random.choice(context['movers']).user)
+    return client.get(reverse('list_create_job'),
+                      {'lat': latitude, 'lng': longitude,
+                       'radius': random.choice((10, 25, 50))})
+
+
+def user_jobs_request(client, context):
+    client.force_authenticate(random.choice(context['profiles']).user)
+    return client.get(reverse('user_jobs'))
+
+
+def accept_request(client, context):
+    """
+    a mover accepting an open job, the PATCH that queues the charge
+    and the text message
+    """
+    if not context['open_jobs']:
+        return None
+    mover = random.choice(context['movers'])
+    client.force_authenticate(mover.user)
+    return client.patch(reverse('detail_update_delete_job',
+                                kwargs={'pk': context['open_jobs'].pop()}),
+                        {'mover_profile': mover.id}, format='json')
+
+
+WORKLOADS = {
+    'feed': feed_request,
+    'user_jobs': user_jobs_request,
+    'accept': accept_request,
+}
+
+
+def run_workload(mix, requests, posters, movers):
+    """
+    replays `requests` requests picked from `mix` ({name: weight})
+    through the full url/middleware/view stack, inside a transaction
+    that is rolled back so the data can be reused.
+    returns throughput, latency percentiles and queries per request
+    for every workload and for the whole run
+    """
+    names = [name for name, weight in mix.items() for _ in range(weight)]
+    client = APIClient()
+    open_jobs = list(Job.objects.open().order_by('-id')
+                     .values_list('id', flat=True)[:requests])
+    random.shuffle(open_jobs)
+    context = {'posters': posters, 'movers': movers,
+               'profiles': posters + movers, 'open_jobs': open_jobs}
+    samples = dict((name, []) for name in mix)
+    queries = dict((name, []) for name in mix)
+    errors = dict((name, 0) for name in mix)
+    with transaction.atomic():
+        start = time.perf_counter()
+        for _ in range(requests):
+            name = random.choice(names)
+            with CaptureQueriesContext(connection) as captured:
+                began = time.perf_counter()
+                response = WORKLOADS[name](client, context)
+                elapsed = (time.perf_counter() - began) * 1000
+            if response is None:
+                continue
+            if response.status_code >= 400:
+                errors[name] += 1
+            samples[name].append(elapsed)
+            queries[name].append(len(captured))
+        total_seconds = time.perf_counter() - start
+        transaction.set_rollback(True)
+
+    results = {}
+    for name in list(mix) + ['all']:
+        if name == 'all':
+            latency = sum(samples.values(), [])
+            counts = sum(queries.values(), [])
+            failed = sum(errors.values())
+        else:
+            latency, counts, failed = samples[name], queries[name], \
+                errors[name]
+        stats = summarize(latency)
+        stats.update({
+            'errors': failed,
+            'throughput_rps': round(len(latency) / total_seconds, 2)
+            if total_seconds else 0.0,
+            'queries_avg': round(sum(counts) / len(counts), 2)
+            if counts else 0.0,
+            'queries_max': max(counts) if counts else 0,
+        })
+        results[name] = stats
+    return results
@@ -0,0 +1,200 @@
+import json
+import logging
+import queue
+import select
+import threading
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.signals import setting_changed
+from django.db import connection, connections, transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from muver_api import metrics
+
+logger = logging.getLogger(__name__)
+
+_broker = None
+
+
+class Subscription(object):
+    """
+    a bounded queue of messages published to one channel.
+    when a slow reader lets it fill up new messages are dropped.
+    """
+
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.queue = queue.Queue(maxsize=settings.BROKER_QUEUE_SIZE)
+
+    def put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            metrics.incr('broker.dropped')
+
+    def get(self, timeout=None):
+        """
+        returns the next message or None after `timeout` seconds
+        """
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InMemoryBroker(object):
+    """
+    fans messages out to subscribers in this process
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = defaultdict(set)
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel)
+        with self.lock:
+            self.subscribers[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscribers = self.subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscribers[subscription.channel]
+
+    def publish(self, channel, message):
+        self.fan_out(channel, message)
+
+    def fan_out(self, channel, message):
+        with self.lock:
+            subscribers = list(self.subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(message)
+        metrics.incr('broker.published')
+
+
+class PostgresBroker(InMemoryBroker):
+    """
+    fans messages out across processes with LISTEN/NOTIFY.
+    publish sends a NOTIFY, one listener thread per process
+    hands the notifications to the local subscribers.
+    """
+    pg_channel = 'muver_broker'
+
+    def __init__(self):
+        super().__init__()
+        self.listener = None
+
+    def publish(self, channel, message):
+        payload = json.dumps({'channel': channel, 'message': message},
+                             cls=DjangoJSONEncoder)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)',
+                           [self.pg_channel, payload])
+
+    def subscribe(self, channel):
+        with self.lock:
+            if self.listener is None:
+                self.listener = threading.Thread(target=self.listen,
+                                                 daemon=True)
+                self.listener.start()
+        return super().subscribe(channel)
+
+    def listen(self):
+        while True:
+            try:
+                self.listen_once()
+            except Exception as e:
+                logger.warning("Broker listener failed: {}".format(e))
+                time.sleep(1)
+
+    def listen_once(self):
+        wrapper = connections['default']
+        pg = wrapper.get_new_connection(wrapper.get_connection_params())
+        pg.autocommit = True
+        try:
+            with pg.cursor() as cursor:
+                cursor.execute('LISTEN ' + self.pg_channel)
+            while True:
+                if select.select([pg], [], [], 5) == ([], [], []):
+                    continue
+                pg.poll()
+                while pg.notifies:
+                    notify = pg.notifies.pop(0)
+                    data = json.loads(notify.payload)
+                    self.fan_out(data['channel'], data['message'])
+        finally:
+            pg.close()
+
+
+def get_broker():
+    """
+    returns the broker configured by settings.BROKER_BACKEND
+    """
+    global _broker
+    if _broker is None:
+        _broker = import_string(settings.BROKER_BACKEND)()
+    return _broker
+
+
+@receiver(setting_changed)
+def reset_broker(**kwargs):
+    global _broker
+    if kwargs.get('setting', 'BROKER_BACKEND') == 'BROKER_BACKEND':
+        _broker = None
+
+
+def job_event(job):
+    """
+    returns the feed event for a saved job, or None when movers
+    don't need to hear about it
+    """
+    from muver_api.models import Job
+    if job.point_a is None:
+        return None
+    if job.state == Job.OPEN:
+        event = 'posted'
+    elif job.state == Job.ACCEPTED:
+        event = 'taken'
+    else:
+        return None
+    return {'event': event,
+            'id': job.id,
+            'title': job.title,
+            'price': job.price,
+            'trip_distance': job.trip_distance,
+            'lat': job.point_a.y,
+            'lng': job.point_a.x}
+
+
+def job_channel(job_id):
+    return 'job.{}'.format(job_id)
+
+
+def publish_job(job, event=None, announce=True):
+    """
+    once the current transaction commits, notifies waiters on the job's
+    own channel and, with `announce`, publishes it to the 'jobs' channel
+    the mover feed streams from
+    """
+    change = {'id': job.id, 'state': job.state,
+              'modified_at': job.modified_at}
+    message = job_event(job) if announce else None
+    if message is not None and event is not None:
+        message['event'] = event
+
+    def publish():
+        broker = get_broker()
+        broker.publish(job_channel(change['id']), change)
+        if message is not None:
+            broker.publish('jobs', message)
+    transaction.on_commit(publish)
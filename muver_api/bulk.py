@@ -0,0 +1,104 @@
+from collections import OrderedDict
+from django.db import connection, transaction
+from muver_api import metrics
+from muver_api.broker import publish_job
+from muver_api.caching import feed_cache
+from muver_api.geo import trip_miles
+from muver_api.geocoding import geocode_many
+from muver_api.models import Job
+from muver_api.serializers import JobImportSerializer
+from rest_framework.exceptions import ValidationError
+
+
+def validate_rows(rows):
+    """
+    returns (valid, errors) where valid is a list of (row number,
+    validated data) and errors maps row numbers to field errors
+    """
+    serializer = JobImportSerializer()
+    valid = []
+    errors = {}
+    for number, row in enumerate(rows):
+        if not isinstance(row, dict):
+            errors[number] = {'non_field_errors': ['Expected an object.']}
+            continue
+        try:
+            valid.append((number, serializer.run_validation(row)))
+        except ValidationError as e:
+            errors[number] = e.detail
+    return valid, errors
+
+
+def reserve_job_ids(count):
+    """
+    takes `count` ids from the job sequence, bulk_create doesn't
+    return primary keys on this version of django
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT nextval(pg_get_serial_sequence("
+                       "'muver_api_job', 'id')) FROM generate_series(1, %s)",
+                       [count])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def build_job(user, data, points):
+    job = Job(user=user, **data)
+    job.point_a = points[data['destination_a']]
+    job.point_b = points[data['destination_b']]
+    if job.point_a is None or job.point_b is None:
+        job.point_a = job.point_b = None
+        job.status = "Address could not be found."
+        job.state = Job.NOT_FOUND
+    else:
+        job.trip_distance = trip_miles(job.point_a, job.point_b)
+        job.status = "Job needs a mover."
+        job.state = Job.OPEN
+    return job
+
+
+def import_jobs(user, rows, batch_size=500):
+    """
+    validates and creates a batch of jobs posted by `user`.
+    addresses are geocoded once per batch, jobs are written with
+    bulk_create and the feed cache and job stream are updated by hand
+    since bulk_create skips post_save.
+    returns one result per row, in order.
+    """
+    with metrics.timer('jobs.import'):
+        valid, errors = validate_rows(rows)
+        addresses = set()
+        for _, data in valid:
+            addresses.add(data['destination_a'])
+            addresses.add(data['destination_b'])
+        points = geocode_many(addresses)
+        jobs = OrderedDict((number, build_job(user, data, points))
+                           for number, data in valid)
+
+        if jobs:
+            with transaction.atomic():
+                for job, job_id in zip(jobs.values(),
+                                       reserve_job_ids(len(jobs))):
+                    job.id = job_id
+                Job.objects.bulk_create(jobs.values(), batch_size=batch_size)
+                first = next(iter(jobs.values()))
+                profile = user.profile
+                profile.in_progress = True
+                if not profile.phone_number:
+                    profile.phone_number = first.phone_number
+                if not profile.display_name:
+                    profile.display_name = first.pickup_for
+                profile.save(update_fields=['in_progress', 'phone_number',
+                                            'display_name'])
+                for job in jobs.values():
+                    publish_job(job)
+            feed_cache.invalidate_many(jobs.values())
+
+    metrics.incr('jobs.imported', len(jobs))
+    results = []
+    for number in range(len(rows)):
+        if number in jobs:
+            results.append({'row': number, 'id': jobs[number].id,
+                            'status': jobs[number].status})
+        else:
+            results.append({'row': number, 'errors': errors[number]})
+    return results
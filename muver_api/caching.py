@@ -0,0 +1,148 @@
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from muver_api import metrics
+from muver_api.geo import geohash
+
+
+class LRUCache(object):
+    """
+    thread safe in-process cache bounded by size,
+    entries older than `ttl` seconds count as missing.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                return default
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class FeedCache(object):
+    """
+    caches serialized job feed pages in the django cache named by
+    settings.FEED_CACHE. Every page key embeds the version of the
+    regions (geohash cells) it depends on, saving or deleting a job
+    bumps the version of its region and of 'all', which orphans
+    every page that could have shown it. The bump waits for the
+    write to commit, a page read before that is cached under the
+    old version and orphaned with it.
+    """
+    version_prefix = 'feed:version:'
+    page_prefix = 'feed:page:'
+
+    @property
+    def cache(self):
+        return caches[settings.FEED_CACHE]
+
+    @property
+    def enabled(self):
+        # a page read inside a transaction can show its uncommitted
+        # writes, which haven't bumped anything yet
+        return bool(settings.FEED_CACHE_TIMEOUT) and \
+            not connection.in_atomic_block
+
+    def versions(self, regions):
+        keys = [self.version_prefix + region for region in sorted(regions)]
+        found = self.cache.get_many(keys)
+        missing = [key for key in keys if key not in found]
+        for key in missing:
+            self.cache.add(key, new_version(), None)
+        if missing:
+            found.update(self.cache.get_many(missing))
+        return [found.get(key, '') for key in keys]
+
+    def bump(self, regions):
+        versions = dict((self.version_prefix + region, new_version())
+                        for region in regions)
+        transaction.on_commit(lambda: self.cache.set_many(versions, None))
+
+    def key(self, params, regions):
+        """
+        returns the cache key of a feed page for the given query params
+        """
+        raw = json.dumps([sorted(params.items()), self.versions(regions)])
+        return self.page_prefix + hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        entry = self.cache.get(key)
+        if entry is None:
+            metrics.incr('feed_cache.misses')
+            return None
+        cached_at, data = entry
+        metrics.incr('feed_cache.hits')
+        metrics.observe('feed_cache.staleness',
+                        (time.time() - cached_at) * 1000)
+        return data
+
+    def set(self, key, data):
+        self.cache.set(key, (time.time(), data), settings.FEED_CACHE_TIMEOUT)
+
+    def invalidate(self, job):
+        self.invalidate_many([job])
+
+    def invalidate_many(self, jobs):
+        """
+        bumps the regions of a batch of jobs once, for bulk writes
+        that skip the post_save signal
+        """
+        regions = {'all'}
+        for job in jobs:
+            if job.point_a is not None:
+                regions.add(geohash(job.point_a.y, job.point_a.x,
+                                    settings.FEED_REGION_PRECISION))
+        self.bump(regions)
+
+    def stats(self):
+        count = metrics.get('feed_cache.staleness.count')
+        return {
+            'hits': metrics.get('feed_cache.hits'),
+            'misses': metrics.get('feed_cache.misses'),
+            'hit_ratio': metrics.ratio('feed_cache.hits', 'feed_cache.misses'),
+            'avg_staleness_ms': metrics.get(
+                'feed_cache.staleness.total_ms') / count if count else 0,
+            'max_staleness_ms': metrics.get('feed_cache.staleness.max_ms'),
+        }
+
+
+def new_version():
+    return uuid.uuid4().hex[:12]
+
+
+feed_cache = FeedCache()
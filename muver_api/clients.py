@@ -0,0 +1,162 @@
+import os
+import threading
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from muver_api import metrics
+from muver_api.resilience import bounded_timeout, get_breaker
+
+DEFAULTS = {
+    'pool_size': 10,
+    # seconds to connect, seconds to wait for the response
+    'timeout': (3.05, 10),
+    'retries': 0,
+}
+
+_sessions = {}
+_lock = threading.Lock()
+_pid = None
+
+
+def get_config(provider):
+    config = dict(DEFAULTS)
+    config.update(settings.HTTP_CLIENTS.get(provider, {}))
+    return config
+
+
+def _new_session(provider):
+    import requests
+    config = get_config(provider)
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=4, pool_maxsize=config['pool_size'],
+        max_retries=config['retries'])
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session(provider):
+    """
+    returns the process-wide keep-alive session of a provider,
+    sized by settings.HTTP_CLIENTS[provider]. A forked process
+    (gunicorn --preload) builds its own instead of sharing the
+    parent's sockets.
+    """
+    global _pid
+    with _lock:
+        if _pid != os.getpid():
+            _sessions.clear()
+            _pid = os.getpid()
+        session = _sessions.get(provider)
+        if session is None:
+            session = _sessions[provider] = _new_session(provider)
+        return session
+
+
+def open_connections(session):
+    """
+    returns how many connections the session's pools have opened
+    """
+    total = 0
+    # http:// and https:// are mounted on the same adapter
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        with pools.lock:
+            total += sum(pool.num_connections
+                         for pool in pools._container.values())
+    return total
+
+
+def request(provider, method, url, **kwargs):
+    """
+    sends a request on the provider's session and counts requests and
+    new connections, the difference is how often a connection was reused.
+    Fails fast with ServiceUnavailable while the provider's breaker is
+    open or once the current request's deadline has passed.
+    """
+    kwargs['timeout'] = bounded_timeout(
+        kwargs.get('timeout', get_config(provider)['timeout']))
+    breaker = get_breaker(provider)
+    breaker.check()
+    session = get_session(provider)
+    name = 'clients.' + provider
+    opened = open_connections(session)
+    try:
+        with metrics.timer(name):
+            response = session.request(method, url, **kwargs)
+    except Exception:
+        breaker.record_failure()
+        raise
+    finally:
+        metrics.incr(name + '.requests')
+        # approximate when threads share the session
+        metrics.incr(name + '.connections',
+                     open_connections(session) - opened)
+    if response.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return response
+
+
+def connection_stats():
+    """
+    returns requests, new connections and reused connections per provider
+    """
+    stats = {}
+    for provider in set(settings.HTTP_CLIENTS) | set(_sessions):
+        name = 'clients.' + provider
+        sent = metrics.get(name + '.requests')
+        opened = metrics.get(name + '.connections')
+        stats[provider] = {'requests': sent,
+                           'connections': opened,
+                           'reused': max(0, sent - opened)}
+    return stats
+
+
+def close():
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+@receiver(setting_changed)
+def reset_sessions(**kwargs):
+    if kwargs.get('setting', 'HTTP_CLIENTS') == 'HTTP_CLIENTS':
+        close()
+
+
+class StripeHTTPClient(object):
+    """
+    the http client stripe uses, on the 'stripe' session
+    instead of a new connection per api call
+    """
+    name = 'requests'
+
+    def request(self, method, url, headers, post_data=None):
+        import requests
+        import stripe
+        try:
+            response = request('stripe', method, url, headers=headers,
+                               data=post_data, verify=os.path.join(
+                                   os.path.dirname(stripe.__file__),
+                                   'data', 'ca-certificates.crt'))
+        except requests.RequestException as e:
+            raise stripe.error.APIConnectionError(
+                "Unexpected error communicating with Stripe: "
+                "{}".format(e))
+        return response.content, response.status_code, response.headers
+
+
+def get_stripe():
+    """
+    returns the stripe module with the api key set, sending
+    through the pooled 'stripe' session
+    """
+    import stripe
+    if not isinstance(stripe.default_http_client, StripeHTTPClient):
+        stripe.default_http_client = StripeHTTPClient()
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    return stripe
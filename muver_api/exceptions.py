@@ -0,0 +1,13 @@
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class JobAlreadyTaken(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'This job was already accepted by another mover.'
+
+
+class ServiceUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'A service this request needs is unavailable, ' \
+                     'try again shortly.'
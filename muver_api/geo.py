@@ -0,0 +1,140 @@
+import math
+from django.contrib.gis.geos import GEOSGeometry
+
+MILES_PER_DEGREE = 69.0
+
+
+def make_point(latitude, longitude):
+    """
+    returns a srid 4326 point for a latitude/longitude pair
+    """
+    return GEOSGeometry('POINT(' + str(longitude) + ' ' + str(latitude) + ')',
+                        srid=4326)
+
+
+def radius_degrees(latitude, miles):
+    """
+    returns a radius in degrees that covers at least `miles`
+    around `latitude`. Used for the index assisted dwithin lookup,
+    the exact distance filter is applied afterwards.
+    """
+    cos_lat = math.cos(math.radians(float(latitude)))
+    return miles / (MILES_PER_DEGREE * max(cos_lat, 0.01))
+
+
+def trip_miles(point_a, point_b):
+    """
+    returns the great circle miles between two srid 4326 points,
+    to a tenth of a mile
+    """
+    return round(haversine_miles(point_a.y, point_a.x,
+                                 point_b.y, point_b.x), 1)
+
+
+EARTH_RADIUS_MILES = 3958.8
+
+
+def haversine_miles(lat_a, lng_a, lat_b, lng_b):
+    """
+    returns the great circle distance in miles between two
+    latitude/longitude pairs
+    """
+    lat_a, lng_a, lat_b, lng_b = map(math.radians, map(float, (
+        lat_a, lng_a, lat_b, lng_b)))
+    h = math.sin((lat_b - lat_a) / 2) ** 2 + \
+        math.cos(lat_a) * math.cos(lat_b) * math.sin((lng_b - lng_a) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(min(1.0, math.sqrt(h)))
+
+
+def haversine_miles_array(lat_a, lng_a, lat_b, lng_b):
+    """
+    haversine_miles over sequences of coordinates at once,
+    returns a numpy array
+    """
+    import numpy
+    lat_a, lng_a, lat_b, lng_b = (
+        numpy.radians(numpy.asarray(values, dtype=float))
+        for values in (lat_a, lng_a, lat_b, lng_b))
+    h = numpy.sin((lat_b - lat_a) / 2) ** 2 + \
+        numpy.cos(lat_a) * numpy.cos(lat_b) * \
+        numpy.sin((lng_b - lng_a) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * numpy.arcsin(
+        numpy.minimum(1.0, numpy.sqrt(h)))
+
+
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash(latitude, longitude, precision):
+    """
+    returns the geohash of a point with `precision` characters
+    """
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            value, bounds = float(longitude), lng_range
+        else:
+            value, bounds = float(latitude), lat_range
+        middle = (bounds[0] + bounds[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            bounds[0] = middle
+        else:
+            bounds[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def geohash_cell_size(precision):
+    """
+    returns the (latitude, longitude) size in degrees of a geohash cell
+    """
+    lat_bits = precision * 5 // 2
+    lng_bits = precision * 5 - lat_bits
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def geohash_center(latitude, longitude, precision):
+    """
+    returns the center of the geohash cell containing a point
+    """
+    lat_size, lng_size = geohash_cell_size(precision)
+    lat = (math.floor((float(latitude) + 90) / lat_size) + 0.5) * lat_size
+    lng = (math.floor((float(longitude) + 180) / lng_size) + 0.5) * lng_size
+    return lat - 90, lng - 180
+
+
+def geohashes_covering(latitude, longitude, miles, precision):
+    """
+    returns the geohashes of every cell within `miles` of a point
+    (over-approximated by its bounding box)
+    """
+    latitude = float(latitude)
+    longitude = float(longitude)
+    lat_size, lng_size = geohash_cell_size(precision)
+    lat_radius = miles / MILES_PER_DEGREE
+    lng_radius = radius_degrees(latitude, miles)
+    cells = set()
+    lat = max(latitude - lat_radius, -90.0)
+    while True:
+        lng = longitude - lng_radius
+        while True:
+            cells.add(geohash(lat, (lng + 180) % 360 - 180, precision))
+            if lng >= longitude + lng_radius:
+                break
+            lng = min(lng + lng_size, longitude + lng_radius)
+        if lat >= min(latitude + lat_radius, 89.999999):
+            break
+        lat = min(lat + lat_size, latitude + lat_radius, 89.999999)
+    return cells
@@ -0,0 +1,403 @@
+import datetime
+import functools
+import hashlib
+import logging
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import IntegrityError, connection, transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from muver_api import clients, metrics
+from muver_api.caching import LRUCache
+from muver_api.exceptions import ServiceUnavailable
+from muver_api.geo import make_point
+from muver_api.instrumentation import track
+from muver_api.resilience import clear_deadline, get_deadline, \
+    set_deadline
+
+logger = logging.getLogger(__name__)
+
+_backend = None
+_pool = None
+_lookup_pool = None
+_memory = None
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+class GoogleGeocoder(object):
+    """
+    geocodes addresses with the google maps api
+    on the pooled 'google' session
+    """
+    url = "https://maps.googleapis.com/maps/api/geocode/json"
+
+    def geocode(self, address):
+        params = {'address': address}
+        if settings.GOOGLE_GEOCODE_KEY:
+            params['key'] = settings.GOOGLE_GEOCODE_KEY
+        response = clients.request('google', 'GET', self.url,
+                                   params=params)
+        response.raise_for_status()
+        result = response.json()
+        if result['status'] != 'OK':
+            if result['status'] != 'ZERO_RESULTS':
+                logger.warning("Google geocoding {!r} answered {}".format(
+                    address, result['status']))
+            return None
+        location = result['results'][0]['geometry']['location']
+        return location['lat'], location['lng']
+
+
+class StubGeocoder(object):
+    """
+    offline geocoder for tests and local development.
+    known addresses resolve to their real location, anything else
+    resolves to a stable made up point inside the continental US.
+    """
+    known = {
+        "las vegas, nv": (36.1699, -115.1398),
+        "henderson, nv": (36.0395, -114.9817),
+        "reno, nv": (39.5296, -119.8138),
+    }
+
+    def geocode(self, address):
+        address = address.strip().lower()
+        if not address:
+            return None
+        if settings.GEOCODE_STUB_LATENCY:
+            # stands in for the google round trip in benchmarks
+            time.sleep(settings.GEOCODE_STUB_LATENCY)
+        if address in self.known:
+            return self.known[address]
+        digest = hashlib.md5(address.encode('utf-8')).hexdigest()
+        lat = 25 + int(digest[:8], 16) % 2300 / 100.0
+        lng = -124 + int(digest[8:16], 16) % 5600 / 100.0
+        return lat, lng
+
+
+def get_geocoder():
+    """
+    returns the backend configured by settings.GEOCODER_BACKEND
+    """
+    global _backend
+    if _backend is None:
+        _backend = import_string(settings.GEOCODER_BACKEND)()
+    return _backend
+
+
+@receiver(setting_changed)
+def reset_geocoder(**kwargs):
+    global _backend
+    global _memory
+    setting = kwargs.get('setting', 'GEOCODER_BACKEND')
+    if setting == 'GEOCODER_BACKEND':
+        _backend = None
+    if setting in ('GEOCODER_BACKEND', 'GEOCODE_CACHE_SIZE',
+                   'GEOCODE_CACHE_TTL'):
+        _memory = None
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=settings.GEOCODE_WORKERS)
+    return _pool
+
+
+def get_lookup_pool():
+    """
+    threads that only make geocoder calls. Kept apart from the job
+    pool so a job waiting on its lookups can't starve them.
+    """
+    global _lookup_pool
+    if _lookup_pool is None:
+        _lookup_pool = ThreadPoolExecutor(
+            max_workers=settings.GEOCODE_WORKERS)
+    return _lookup_pool
+
+
+def normalize_address(address):
+    """
+    lowercases an address and collapses punctuation and whitespace
+    so "Las Vegas,NV " and "las vegas, nv" share a cache entry
+    """
+    address = re.sub(r"[^\w\s,#-]", " ", address.lower())
+    parts = [" ".join(part.split()) for part in address.split(",")]
+    return ", ".join(part for part in parts if part)
+
+
+def get_memory_cache():
+    global _memory
+    if _memory is None:
+        _memory = LRUCache(settings.GEOCODE_CACHE_SIZE,
+                           settings.GEOCODE_CACHE_TTL)
+    return _memory
+
+
+def cache_stats():
+    """
+    returns the geocode cache counters and hit ratio
+    """
+    stats = metrics.snapshot('geocode.')
+    hits = stats.get('geocode.memory_hits', 0) + \
+        stats.get('geocode.db_hits', 0)
+    lookups = hits + stats.get('geocode.misses', 0)
+    stats['geocode.hit_ratio'] = hits / float(lookups) if lookups else 0.0
+    return stats
+
+
+def _from_db(address):
+    from muver_api.models import GeocodedAddress
+    fresh = timezone.now() - datetime.timedelta(
+        seconds=settings.GEOCODE_CACHE_TTL)
+    cached = GeocodedAddress.objects.filter(address=address,
+                                            modified_at__gte=fresh).first()
+    return cached.point if cached else None
+
+
+def _to_db(address, point):
+    from muver_api.models import GeocodedAddress
+    try:
+        with transaction.atomic():
+            GeocodedAddress.objects.update_or_create(
+                address=address, defaults={'point': point})
+    except IntegrityError:
+        # another worker stored the same address first
+        pass
+
+
+def _call_geocoder(address):
+    with track('geocoder'):
+        latlng = get_geocoder().geocode(address)
+    metrics.incr('geocode.external_calls')
+    if latlng is None:
+        return None
+    return make_point(latlng[0], latlng[1])
+
+
+def _lookup(address):
+    point = _call_geocoder(address)
+    if point is not None:
+        _to_db(address, point)
+    return point
+
+
+def _lookup_quietly(address, deadline=None):
+    # runs on the lookup pool, under the deadline of the request
+    # that asked for it
+    set_deadline(deadline)
+    try:
+        return _call_geocoder(address)
+    except ServiceUnavailable:
+        raise
+    except Exception as e:
+        logger.warning("Geocoding {!r} failed: {}".format(address, e))
+        return None
+    finally:
+        clear_deadline()
+
+
+def geocode(address):
+    """
+    returns a srid 4326 point for an address or None.
+    looks in the in-process LRU, then the GeocodedAddress table,
+    then the geocoder. Concurrent misses for the same address
+    wait on a single geocoder call.
+    """
+    address = normalize_address(address)
+    if not address:
+        return None
+    memory = get_memory_cache()
+    point = memory.get(address)
+    if point is not None:
+        metrics.incr('geocode.memory_hits')
+        return point
+    point = _from_db(address)
+    if point is not None:
+        metrics.incr('geocode.db_hits')
+        memory.set(address, point)
+        return point
+
+    with _inflight_lock:
+        future = _inflight.get(address)
+        leader = future is None
+        if leader:
+            future = _inflight[address] = Future()
+    if not leader:
+        metrics.incr('geocode.coalesced')
+        return future.result()
+
+    metrics.incr('geocode.misses')
+    try:
+        point = _lookup(address)
+        future.set_result(point)
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[address]
+    if point is not None:
+        memory.set(address, point)
+    return point
+
+
+def geocode_many(addresses):
+    """
+    returns {address: point or None} for a batch of addresses.
+    Every distinct address is resolved once: from the in-process LRU,
+    then one GeocodedAddress query, then concurrent geocoder calls on
+    the lookup pool. New points are stored with one bulk insert.
+    Addresses already being looked up by geocode() or another batch
+    wait on that call instead.
+    """
+    from muver_api.models import GeocodedAddress
+    normalized = dict((address, normalize_address(address))
+                      for address in addresses)
+    memory = get_memory_cache()
+    points = {'': None}
+    missing = set()
+    for address in set(normalized.values()) - {''}:
+        point = memory.get(address)
+        if point is None:
+            missing.add(address)
+        else:
+            metrics.incr('geocode.memory_hits')
+            points[address] = point
+
+    if missing:
+        fresh = timezone.now() - datetime.timedelta(
+            seconds=settings.GEOCODE_CACHE_TTL)
+        cached = GeocodedAddress.objects.filter(address__in=missing,
+                                                modified_at__gte=fresh)
+        for row in cached:
+            metrics.incr('geocode.db_hits')
+            points[row.address] = row.point
+            memory.set(row.address, row.point)
+            missing.discard(row.address)
+
+    if missing:
+        # addresses another thread is already looking up are waited on,
+        # the rest are led by this batch
+        led, waiting = {}, {}
+        with _inflight_lock:
+            for address in sorted(missing):
+                future = _inflight.get(address)
+                if future is None:
+                    _inflight[address] = led[address] = Future()
+                else:
+                    waiting[address] = future
+        metrics.incr('geocode.misses', len(led))
+        metrics.incr('geocode.coalesced', len(waiting))
+        try:
+            points.update(_lookup_many(list(led)))
+        except Exception as e:
+            for future in led.values():
+                future.set_exception(e)
+            raise
+        else:
+            for address, future in led.items():
+                future.set_result(points[address])
+        finally:
+            with _inflight_lock:
+                for address in led:
+                    del _inflight[address]
+        for address, future in waiting.items():
+            try:
+                points[address] = future.result()
+            except ServiceUnavailable:
+                raise
+            except Exception:
+                points[address] = None
+
+    return dict((address, points[key])
+                for address, key in normalized.items())
+
+
+def _lookup_many(addresses):
+    """
+    geocodes addresses concurrently on the lookup pool and stores the
+    new points with one bulk insert, returns {address: point or None}
+    """
+    from muver_api.models import GeocodedAddress
+    if not addresses:
+        return {}
+    lookup = functools.partial(_lookup_quietly, deadline=get_deadline())
+    with track('geocoder'):
+        looked_up = list(get_lookup_pool().map(lookup, addresses))
+    memory = get_memory_cache()
+    found = []
+    for address, point in zip(addresses, looked_up):
+        if point is not None:
+            memory.set(address, point)
+            found.append(GeocodedAddress(address=address, point=point))
+    _bulk_to_db(found)
+    return dict(zip(addresses, looked_up))
+
+
+def _bulk_to_db(rows):
+    from muver_api.models import GeocodedAddress
+    if not rows:
+        return
+    try:
+        with transaction.atomic():
+            # expired entries still hold the unique address
+            GeocodedAddress.objects.filter(
+                address__in=[row.address for row in rows]).delete()
+            GeocodedAddress.objects.bulk_create(rows)
+    except IntegrityError:
+        for row in rows:
+            _to_db(row.address, row.point)
+
+
+def geocode_job(job_id):
+    """
+    resolves point_a/point_b/trip_distance of a pending job
+    """
+    from muver_api.models import Job
+    job = Job.objects.select_related('user__profile').get(pk=job_id)
+    try:
+        # two misses cost one geocoder round trip instead of two
+        points = geocode_many([job.destination_a, job.destination_b])
+        point_a = points[job.destination_a]
+        point_b = points[job.destination_b]
+    except ServiceUnavailable as e:
+        # the job stays pending, geocode_jobs picks it up later
+        logger.warning("Geocoding job {} deferred: {}".format(job_id, e))
+        return job
+    except Exception as e:
+        logger.warning("Geocoding job {} failed: {}".format(job_id, e))
+        point_a = point_b = None
+    if point_a is None or point_b is None:
+        job.geocode_failed()
+    else:
+        job.geocoded(point_a, point_b)
+    return job
+
+
+def _run_in_pool(job_id):
+    try:
+        return geocode_job(job_id)
+    except Exception:
+        logger.exception("Geocoding job {} crashed".format(job_id))
+    finally:
+        # pool threads open their own connection, don't leak it
+        connection.close()
+
+
+def schedule_geocode(job):
+    """
+    geocodes a job in the background once the current transaction
+    commits, or right away when settings.GEOCODE_ASYNC is off.
+    jobs lost by a restart are picked up by the geocode_jobs command.
+    """
+    if not settings.GEOCODE_ASYNC:
+        return geocode_job(job.id)
+    job_id = job.id
+    transaction.on_commit(lambda: get_pool().submit(_run_in_pool, job_id))
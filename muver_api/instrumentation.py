@@ -0,0 +1,68 @@
+import threading
+import time
+from contextlib import contextmanager
+
+_local = threading.local()
+
+
+class RequestTimings(object):
+    """
+    time spent per span name during one sampled request
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.active = set()
+
+    def add(self, name, milliseconds):
+        count, total = self.spans.get(name, (0, 0.0))
+        self.spans[name] = (count + 1, total + milliseconds)
+
+    def elapsed(self):
+        return (time.perf_counter() - self.started) * 1000
+
+
+def start():
+    _local.timings = RequestTimings()
+    return _local.timings
+
+
+def current():
+    return getattr(_local, 'timings', None)
+
+
+def finish():
+    timings = current()
+    _local.timings = None
+    return timings
+
+
+@contextmanager
+def track(name):
+    """
+    adds the time spent in the block to span `name` of the current
+    request. A no-op outside a sampled request, and nested blocks of
+    the same name are only counted once.
+    """
+    timings = current()
+    if timings is None or name in timings.active:
+        yield
+        return
+    timings.active.add(name)
+    began = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.active.discard(name)
+        timings.add(name, (time.perf_counter() - began) * 1000)
+
+
+class TimedSerializerMixin(object):
+    """
+    counts serializer output towards the 'serialize' span
+    """
+
+    def to_representation(self, instance):
+        with track('serialize'):
+            return super().to_representation(instance)
@@ -0,0 +1,139 @@
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+from muver_api import metrics
+
+# attributes every LogRecord has, anything else came in through extra=
+RECORD_ATTRIBUTES = set(logging.LogRecord(
+    '', logging.INFO, '', 0, '', (), None).__dict__) | {'message', 'asctime'}
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    formats a record as one JSON object per line,
+    fields passed with extra= are kept as top level keys
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.utcfromtimestamp(
+                record.created).isoformat() + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'pid': record.process,
+            'message': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES and key not in entry:
+                entry[key] = value
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    keeps `rates[name]` (0-1) of the records below WARNING from a logger
+    and its children, records from other loggers pass through
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = sorted((rates or {}).items(),
+                            key=lambda item: -len(item[0]))
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        for name, rate in self.rates:
+            if record.name == name or record.name.startswith(name + '.'):
+                if random.random() < rate:
+                    return True
+                metrics.incr('logging.sampled_out')
+                return False
+        return True
+
+
+class QueueListener(logging.handlers.QueueListener):
+
+    def enqueue_sentinel(self):
+        # wait for room on a full queue instead of failing to stop
+        self.queue.put(self._sentinel)
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    hands records to a bounded queue that a background listener drains
+    into the `targets` handlers, so logging never waits on I/O.
+    when the queue is full records are dropped and counted in the
+    logging.dropped metric.
+
+    targets are handlers or names of handlers from the LOGGING config,
+    dictConfig sets handlers up in name order so they must sort before
+    this one. the listener starts on first use in each process, so it
+    survives gunicorn forking the workers.
+    """
+
+    def __init__(self, targets=(), capacity=10000):
+        super().__init__(queue.Queue(maxsize=capacity))
+        self.targets = [self.resolve(target) for target in targets]
+        self.listener = None
+        self.pid = None
+        self.listener_lock = threading.Lock()
+
+    def resolve(self, target):
+        if not isinstance(target, str):
+            return target
+        # dictConfig registers configured handlers by name here
+        handler = logging._handlers.get(target)
+        if handler is None:
+            raise ValueError("Unknown log handler {!r}".format(target))
+        return handler
+
+    def start(self):
+        with self.listener_lock:
+            if self.pid == os.getpid():
+                return
+            self.listener = QueueListener(
+                self.queue, *self.targets, respect_handler_level=True)
+            self.listener.start()
+            self.pid = os.getpid()
+            atexit.register(self.stop)
+
+    def stop(self):
+        with self.listener_lock:
+            if self.listener is not None and self.pid == os.getpid():
+                self.listener.stop()
+            self.listener = None
+            self.pid = None
+
+    def prepare(self, record):
+        # render the message and traceback now, args and exc_info
+        # may not survive until the listener gets to the record
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(
+                    record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.incr('logging.dropped')
+
+    def emit(self, record):
+        if self.pid != os.getpid():
+            self.start()
+        super().emit(record)
@@ -0,0 +1,60 @@
+import time
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db import connection
+from muver_api.caching import feed_cache
+from muver_api.geo import geohash, haversine_miles_array
+from muver_api.models import Job
+
+
+class Command(BaseCommand):
+    help = "Recomputes trip_distance of geocoded jobs as great circle " \
+           "miles, a chunk of rows at a time."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10000)
+        parser.add_argument('--missing', action='store_true', default=False,
+                            help="only jobs without a trip distance")
+
+    def handle(self, *args, **options):
+        import numpy
+        start = time.perf_counter()
+        jobs = Job.objects.exclude(point_a=None).exclude(point_b=None)
+        if options['missing']:
+            jobs = jobs.filter(trip_distance=None)
+        jobs = jobs.extra(select={'lat_a': 'ST_Y(point_a)',
+                                  'lng_a': 'ST_X(point_a)',
+                                  'lat_b': 'ST_Y(point_b)',
+                                  'lng_b': 'ST_X(point_b)'})\
+            .order_by('id')
+
+        last_id = 0
+        updated = 0
+        regions = {'all'}
+        while True:
+            rows = list(jobs.filter(id__gt=last_id).values_list(
+                'id', 'lat_a', 'lng_a', 'lat_b', 'lng_b')[
+                :options['chunk_size']])
+            if not rows:
+                break
+            ids, lat_a, lng_a, lat_b, lng_b = zip(*rows)
+            miles = numpy.round(
+                haversine_miles_array(lat_a, lng_a, lat_b, lng_b), 1)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "UPDATE muver_api_job SET trip_distance = v.miles "
+                    "FROM unnest(%s::integer[], %s::double precision[]) "
+                    "AS v(id, miles) WHERE muver_api_job.id = v.id",
+                    [list(ids), miles.tolist()])
+            # the update skips post_save, bump the feed regions by hand
+            regions.update(geohash(lat, lng, settings.FEED_REGION_PRECISION)
+                           for lat, lng in zip(lat_a, lng_a))
+            last_id = ids[-1]
+            updated += len(ids)
+            self.stdout.write("{} jobs updated".format(updated))
+
+        feed_cache.bump(regions)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE muver_api_job')
+        self.stdout.write("Backfilled {} jobs in {:.1f}s".format(
+            updated, time.perf_counter() - start))
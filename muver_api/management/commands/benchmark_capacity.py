@@ -0,0 +1,101 @@
+import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from django.core.management import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from muver_api.benchmarks import summarize
+
+
+def feed_request(session, base_url):
+    return session.get(base_url + reverse('list_create_job'),
+                       params={'lat': 36.1699, 'lng': -115.1398,
+                               'radius': 25})
+
+
+def import_request(session, base_url):
+    """
+    posts a job with addresses nobody geocoded yet, the request waits
+    on the geocoder for both of them
+    """
+    tag = uuid.uuid4().hex[:12]
+    return session.post(base_url + reverse('bulk_create_job'), json=[{
+        'title': "capacity job", 'price': 50, 'pickup_for': "benchmark",
+        'phone_number': "5555555555",
+        'destination_a': "{} a street, las vegas, nv".format(tag),
+        'destination_b': "{} b street, las vegas, nv".format(tag)}])
+
+
+WORKLOADS = {
+    'feed': feed_request,
+    'import': import_request,
+}
+
+
+class Command(BaseCommand):
+    help = "Sends requests to a running server at increasing concurrency " \
+           "and reports throughput and latency per level. Start one " \
+           "worker, e.g. `GEOCODER_BACKEND=muver_api.geocoding." \
+           "StubGeocoder GEOCODE_STUB_LATENCY=0.2 gunicorn mUver.wsgi " \
+           "-w 1 [-k gevent]`, and compare the worker classes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--token', required=True,
+                            help="api token of the posting user")
+        parser.add_argument('--workload', default='import',
+                            choices=sorted(WORKLOADS))
+        parser.add_argument('--concurrency', default='1,5,10,25,50')
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--output', default=None)
+
+    def handle(self, *args, **options):
+        try:
+            levels = [int(level)
+                      for level in options['concurrency'].split(',')]
+        except ValueError:
+            raise CommandError("--concurrency takes numbers like 1,10,50")
+        workload = WORKLOADS[options['workload']]
+        base_url = options['url'].rstrip('/')
+        headers = {'Authorization': 'Token ' + options['token']}
+
+        def timed(session):
+            start = time.perf_counter()
+            try:
+                ok = workload(session, base_url).status_code < 400
+            except requests.RequestException:
+                ok = False
+            return ok, (time.perf_counter() - start) * 1000
+
+        report = {}
+        for level in levels:
+            # one keep-alive connection per client
+            sessions = []
+            for _ in range(level):
+                session = requests.Session()
+                session.headers.update(headers)
+                sessions.append(session)
+            with ThreadPoolExecutor(level) as pool:
+                start = time.perf_counter()
+                results = list(pool.map(
+                    timed, (sessions[i % level]
+                            for i in range(options['requests']))))
+                seconds = time.perf_counter() - start
+            for session in sessions:
+                session.close()
+            stats = summarize([ms for ok, ms in results])
+            stats['errors'] = sum(1 for ok, ms in results if not ok)
+            stats['throughput_rps'] = round(len(results) / seconds, 2)
+            report[level] = stats
+            self.stdout.write(
+                "{:>4} clients  {:>8.2f} req/s  p50 {:>8.1f}ms  "
+                "p95 {:>8.1f}ms  {} errors".format(
+                    level, stats['throughput_rps'], stats['p50'],
+                    stats['p95'], stats['errors']))
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({'workload': options['workload'],
+                           'url': base_url, 'levels': report},
+                          output, indent=2, sort_keys=True)
@@ -0,0 +1,105 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management import BaseCommand
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.db.models import Count, Max
+from django.test import override_settings
+from muver_api.benchmarks import benchmark_user, seed_users, summarize
+from muver_api.geo import make_point
+from muver_api.models import Job, PaymentTask, TextMessage
+from rest_framework.test import APIClient
+
+
+def accept(job, mover, barrier):
+    """
+    one mover trying to accept the job, returns (status, milliseconds)
+    """
+    try:
+        client = APIClient()
+        client.force_authenticate(mover.user)
+        url = reverse('detail_update_delete_job', kwargs={'pk': job.id})
+        barrier.wait()
+        start = time.perf_counter()
+        response = client.patch(url, {'mover_profile': mover.id},
+                                format='json')
+        return response.status_code, (time.perf_counter() - start) * 1000
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = "Has many movers accept the same job at once, over several " \
+           "jobs, and reports claims/sec, loser latency and duplicate " \
+           "charges (which should be zero)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jobs', type=int, default=50)
+        parser.add_argument('--movers', type=int, default=20)
+
+    def handle(self, *args, **options):
+        poster = benchmark_user()
+        poster.profile.customer_id = "cus_benchmark"
+        poster.profile.save()
+        _, movers = seed_users(0, prefix='claims')
+        if len(movers) < options['movers']:
+            _, movers = seed_users(options['movers'] - len(movers),
+                                   mover_ratio=1.0, prefix='claims')
+        movers = movers[:options['movers']]
+
+        stubs = {
+            'ALLOWED_HOSTS': ['testserver'],
+            'SMS_BACKEND': 'muver_api.sms.LocalMemoryBackend',
+            'STRIPE_BACKEND': 'muver_api.payments.LocalStripeBackend',
+        }
+        last_text = TextMessage.objects.aggregate(last=Max('id'))['last']
+        statuses = {}
+        won, lost = [], []
+        jobs = []
+        with override_settings(**stubs), \
+                ThreadPoolExecutor(len(movers)) as pool:
+            start = time.perf_counter()
+            for _ in range(options['jobs']):
+                job = Job.objects.create(
+                    user=poster, price=80, title="contested job",
+                    pickup_for="benchmark", phone_number="5555555555",
+                    destination_a="las vegas, nv",
+                    destination_b="henderson, nv",
+                    point_a=make_point(36.1699, -115.1398),
+                    point_b=make_point(36.0395, -114.9817),
+                    trip_distance=12.1, status="Job needs a mover.",
+                    state=Job.OPEN)
+                jobs.append(job)
+                barrier = threading.Barrier(len(movers))
+                for status, milliseconds in pool.map(
+                        lambda mover: accept(job, mover, barrier), movers):
+                    statuses[status] = statuses.get(status, 0) + 1
+                    (won if status == 200 else lost).append(milliseconds)
+            elapsed = time.perf_counter() - start
+
+        charges = PaymentTask.objects.filter(job__in=jobs,
+                                             operation='charge')\
+            .values('job').annotate(count=Count('id'))
+        duplicates = sum(row['count'] - 1 for row in charges
+                         if row['count'] > 1)
+        uncharged = len(jobs) - len(charges)
+        # the outbox rows are real, deliver_sms would send them
+        PaymentTask.objects.filter(job__in=jobs).delete()
+        TextMessage.objects.filter(
+            id__gt=last_text or 0,
+            body__in=["A mover accepted your job. {}: {}".format(
+                mover.display_name, mover.phone_number)
+                for mover in movers]).delete()
+        Job.objects.filter(pk__in=[job.id for job in jobs]).delete()
+
+        self.stdout.write("jobs: {} movers per job: {} statuses: {}".format(
+            len(jobs), len(movers), statuses))
+        self.stdout.write("claims/sec: {:.1f} attempts/sec: {:.1f}".format(
+            len(won) / elapsed, (len(won) + len(lost)) / elapsed))
+        self.stdout.write("winner latency: p50 {p50}ms p99 {p99}ms".format(
+            **summarize(won)))
+        self.stdout.write("loser latency: p50 {p50}ms p99 {p99}ms".format(
+            **summarize(lost)))
+        self.stdout.write("duplicate charges: {} jobs without a charge: "
+                          "{}".format(duplicates, uncharged))
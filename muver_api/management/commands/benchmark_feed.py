@@ -0,0 +1,49 @@
+from django.contrib.gis.db.models.functions import Distance
+from django.core.management import BaseCommand
+from muver_api.benchmarks import benchmark_user, explain, seed_jobs, \
+    summarize, time_queryset, view_queryset
+from muver_api.geo import make_point
+from muver_api.models import Job
+from muver_api.views import ListCreateJob
+
+
+class Command(BaseCommand):
+    help = "Seeds jobs and compares the nearby job feed query plans " \
+           "and latency before/after the radius bounded feed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jobs', type=int, default=1000000)
+        parser.add_argument('--runs', type=int, default=200)
+        parser.add_argument('--lat', type=float, default=36.1699)
+        parser.add_argument('--lng', type=float, default=-115.1398)
+        parser.add_argument('--radius', type=float, default=10)
+        parser.add_argument('--no-seed', action='store_true', default=False)
+
+    def handle(self, *args, **options):
+        latitude = options['lat']
+        longitude = options['lng']
+
+        if not options['no_seed']:
+            missing = options['jobs'] - Job.objects.count()
+            if missing > 0:
+                self.stdout.write("Seeding {} jobs...".format(missing))
+                seed_jobs(benchmark_user(), missing, latitude, longitude)
+
+        pnt = make_point(latitude, longitude)
+        # the feed query as it was before the spatial indexes and radius
+        before = Job.objects.filter(mover_profile=None).annotate(
+            distance=Distance('point_a', pnt)).filter(complete=False)\
+            .exclude(conflict=True).order_by('distance')
+        knn = view_queryset(ListCreateJob, {'lat': latitude,
+                                            'lng': longitude})
+        bounded = view_queryset(ListCreateJob, {'lat': latitude,
+                                                'lng': longitude,
+                                                'radius': options['radius']})
+
+        for name, queryset in (('before', before), ('knn', knn),
+                               ('radius', bounded)):
+            self.stdout.write("== {} ==".format(name))
+            self.stdout.write(explain(queryset))
+            stats = summarize(time_queryset(queryset, options['runs']))
+            self.stdout.write("p50: {p50}ms p99: {p99}ms "
+                              "max: {max}ms runs: {runs}\n".format(**stats))
@@ -0,0 +1,90 @@
+import json
+import subprocess
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.test import override_settings
+from django.utils import timezone
+from muver_api.benchmarks import WORKLOADS, run_workload, seeded_profiles
+
+
+def parse_mix(value):
+    """
+    parses "feed=6,user_jobs=3,accept=1" into {name: weight}
+    """
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in WORKLOADS or not weight.isdigit():
+            raise CommandError("Unknown workload {!r}, choose from "
+                               "{}".format(part, ", ".join(sorted(WORKLOADS))))
+        mix[name] = int(weight)
+    return mix
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = "Replays a mix of feed, user jobs and accept requests against " \
+           "the seed_data users with stubbed stripe, twilio and geocoder " \
+           "and writes throughput, latency and queries per request as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--mix', default='feed=6,user_jobs=3,accept=1')
+        parser.add_argument('--prefix', default='seed')
+        parser.add_argument('--output', default='benchmark-results.json')
+        parser.add_argument('--baseline', default=None,
+                            help="an earlier output file to compare with")
+        parser.add_argument('--no-feed-cache', action='store_true',
+                            default=False)
+
+    def handle(self, *args, **options):
+        mix = parse_mix(options['mix'])
+        posters, movers = seeded_profiles(options['prefix'])
+        if not posters or not movers:
+            raise CommandError("No seeded users, run seed_data first.")
+
+        stubs = {
+            'ALLOWED_HOSTS': ['testserver'],
+            'GEOCODER_BACKEND': 'muver_api.geocoding.StubGeocoder',
+            'GEOCODE_ASYNC': False,
+            'SMS_BACKEND': 'muver_api.sms.LocalMemoryBackend',
+            'STRIPE_BACKEND': 'muver_api.payments.LocalStripeBackend',
+        }
+        if options['no_feed_cache']:
+            stubs['FEED_CACHE_TIMEOUT'] = 0
+        with override_settings(**stubs):
+            results = run_workload(mix, options['requests'], posters, movers)
+
+        report = {
+            'commit': current_commit(),
+            'created_at': timezone.now().isoformat(),
+            'requests': options['requests'],
+            'mix': mix,
+            'feed_cache': not options['no_feed_cache'],
+            'results': results,
+        }
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as previous:
+                baseline = json.load(previous)['results']
+        for name, stats in sorted(results.items()):
+            line = "{}: {throughput_rps} req/s p50: {p50}ms p95: {p95}ms " \
+                   "p99: {p99}ms queries: {queries_avg} errors: " \
+                   "{errors}".format(name, **stats)
+            if baseline and name in baseline:
+                line += " (p95 {:+.1f}ms, queries {:+.2f})".format(
+                    stats['p95'] - baseline[name]['p95'],
+                    stats['queries_avg'] - baseline[name]['queries_avg'])
+            self.stdout.write(line)
+        self.stdout.write("Wrote {}".format(options['output']))
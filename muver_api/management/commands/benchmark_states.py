@@ -0,0 +1,50 @@
+from django.core.management import BaseCommand
+from muver_api.benchmarks import benchmark_user, explain, seed_jobs, \
+    summarize, time_queryset, view_queryset
+from muver_api.models import Job
+from muver_api.views import CompletedJobsByUser, JobsByUser, ListCreateJob
+
+
+class Command(BaseCommand):
+    help = "Seeds jobs and compares query plans and latency of the " \
+           "boolean filter chains against the indexed job state."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jobs', type=int, default=1000000)
+        parser.add_argument('--runs', type=int, default=200)
+        parser.add_argument('--no-seed', action='store_true', default=False)
+
+    def handle(self, *args, **options):
+        user = benchmark_user()
+        if not options['no_seed']:
+            missing = options['jobs'] - Job.objects.count()
+            if missing > 0:
+                self.stdout.write("Seeding {} jobs...".format(missing))
+                seed_jobs(user, missing, 36.1699, -115.1398)
+
+        # the filter chains the views used before the state column
+        before = {
+            'feed': Job.objects.filter(mover_profile=None)
+            .filter(complete=False).exclude(conflict=True)
+            .order_by('-created_at'),
+            'active': Job.objects.filter(user=user)
+            .filter(confirmation_user=False).exclude(conflict=True)
+            .order_by('-modified_at'),
+            'completed': Job.objects.filter(user=user)
+            .filter(confirmation_user=True).exclude(conflict=True)
+            .order_by('-modified_at'),
+        }
+        after = {
+            'feed': view_queryset(ListCreateJob, {}),
+            'active': view_queryset(JobsByUser, {}, user=user),
+            'completed': view_queryset(CompletedJobsByUser, {}, user=user),
+        }
+
+        for name in ('feed', 'active', 'completed'):
+            for label, queryset in (('before', before[name]),
+                                    ('after', after[name])):
+                self.stdout.write("== {} {} ==".format(name, label))
+                self.stdout.write(explain(queryset))
+                stats = summarize(time_queryset(queryset, options['runs']))
+                self.stdout.write("p50: {p50}ms p99: {p99}ms "
+                                  "max: {max}ms runs: {runs}\n".format(**stats))
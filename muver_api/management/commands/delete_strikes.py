@@ -1,13 +1,39 @@
 import datetime
-from django.utils import timezone
+import time
 from django.core.management import BaseCommand
+from django.db import transaction
+from django.utils import timezone
 from muver_api.models import Strike
 
 
 class Command(BaseCommand):
+    help = "Deletes strikes older than --days in batches."
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=60)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--dry-run', action='store_true', default=False)
+
     def handle(self, *args, **options):
-        two_months = timezone.now() - datetime.timedelta(
-            days=60)
-        for strike in Strike.objects.all().filter(created_at__lt=two_months):
-            strike.delete()
-            print("Deleted strike for mover: {}".format(strike.profile))
\ No newline at end of file
+        start = time.perf_counter()
+        cutoff = timezone.now() - datetime.timedelta(days=options['days'])
+        expired = Strike.objects.filter(created_at__lt=cutoff)
+
+        if options['dry_run']:
+            self.stdout.write(
+                "Would delete {} strikes older than {} days".format(
+                    expired.count(), options['days']))
+            return
+
+        deleted = 0
+        while True:
+            ids = list(expired.order_by('id').values_list(
+                'id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            with transaction.atomic():
+                Strike.objects.filter(id__in=ids).delete()
+            deleted += len(ids)
+        self.stdout.write("Deleted {} strikes in {:.2f}s".format(
+            deleted, time.perf_counter() - start))
@@ -0,0 +1,24 @@
+import time
+from django.conf import settings
+from django.core.management import BaseCommand
+from muver_api.sms import deliver_pending
+
+
+class Command(BaseCommand):
+    help = "Sends queued text messages, runs until stopped " \
+           "unless --once is given."
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', default=False)
+        parser.add_argument('--interval', type=float, default=1.0)
+
+    def handle(self, *args, **options):
+        while True:
+            sent = deliver_pending()
+            if sent:
+                print("Sent {} texts".format(sent))
+            if options['once']:
+                return
+            if sent < settings.SMS_BATCH_SIZE:
+                time.sleep(options['interval'])
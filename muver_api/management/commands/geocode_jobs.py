@@ -0,0 +1,17 @@
+from django.core.management import BaseCommand
+from muver_api.geocoding import geocode_job
+from muver_api.models import Job
+
+
+class Command(BaseCommand):
+    help = "Geocodes jobs still waiting on the geocoding workers, " \
+           "e.g. after a restart dropped the in-memory queue."
+    requires_system_checks = False
+
+    def handle(self, *args, **options):
+        pending = Job.objects.filter(state=Job.GEOCODING)\
+            .values_list('id', flat=True)
+        for job_id in pending:
+            job = geocode_job(job_id)
+            self.stdout.write("Geocoded job {}: {}".format(job.id,
+                                                           job.status))
@@ -0,0 +1,27 @@
+import time
+from django.conf import settings
+from django.core.management import BaseCommand
+from muver_api.payments import latency_stats, process_pending
+
+
+class Command(BaseCommand):
+    help = "Runs queued stripe charges, captures and refunds, " \
+           "runs until stopped unless --once is given."
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', default=False)
+        parser.add_argument('--interval', type=float, default=1.0)
+        parser.add_argument('--workers', type=int,
+                            default=settings.PAYMENT_WORKERS)
+
+    def handle(self, *args, **options):
+        while True:
+            done = process_pending(workers=options['workers'])
+            if done:
+                print("Processed {} payment tasks {}".format(
+                    done, latency_stats()))
+            if options['once']:
+                return
+            if done < settings.PAYMENT_BATCH_SIZE:
+                time.sleep(options['interval'])
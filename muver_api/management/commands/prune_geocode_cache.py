@@ -0,0 +1,17 @@
+import datetime
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.utils import timezone
+from muver_api.models import GeocodedAddress
+
+
+class Command(BaseCommand):
+    help = "Deletes cached geocoder results older than GEOCODE_CACHE_TTL."
+    requires_system_checks = False
+
+    def handle(self, *args, **options):
+        expired = timezone.now() - datetime.timedelta(
+            seconds=settings.GEOCODE_CACHE_TTL)
+        deleted, _ = GeocodedAddress.objects.filter(
+            modified_at__lt=expired).delete()
+        print("Deleted {} cached addresses".format(deleted))
@@ -0,0 +1,32 @@
+import time
+from django.core.management import BaseCommand, CommandError
+from muver_api.benchmarks import seed_marketplace, seed_users
+
+
+class Command(BaseCommand):
+    help = "Generates users, profiles, geolocated jobs and strikes " \
+           "for benchmarking."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--jobs', type=int, default=100000)
+        parser.add_argument('--mover-ratio', type=float, default=0.3)
+        parser.add_argument('--strike-ratio', type=float, default=0.5)
+        parser.add_argument('--prefix', default='seed')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        posters, movers = seed_users(options['users'],
+                                     mover_ratio=options['mover_ratio'],
+                                     prefix=options['prefix'])
+        if not posters or not movers:
+            raise CommandError("Need at least one poster and one mover, "
+                               "seed more users or change --mover-ratio.")
+        jobs, strikes = seed_marketplace(posters, movers, options['jobs'],
+                                         strike_ratio=options['strike_ratio'],
+                                         batch_size=options['batch_size'])
+        self.stdout.write("Seeded {} posters, {} movers, {} jobs and {} "
+                          "strikes in {:.1f}s".format(
+                              len(posters), len(movers), jobs, strikes,
+                              time.perf_counter() - start))
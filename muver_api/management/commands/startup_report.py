@@ -0,0 +1,88 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+# third party clients that should only load on first use
+LAZY_MODULES = ('stripe', 'twilio', 'requests', 'numpy')
+
+# runs in a fresh interpreter, times django.setup() and each module
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+stages = [['setup', (time.perf_counter() - start) * 1000]]
+for name in sys.argv[1:]:
+    began = time.perf_counter()
+    __import__(name)
+    stages.append([name, (time.perf_counter() - began) * 1000])
+print(json.dumps({'stages': stages, 'modules': sorted(sys.modules)}))
+"""
+
+
+def probe(modules, settings_module):
+    """
+    imports `modules` after django.setup() in a new process, returns
+    (milliseconds per stage, process milliseconds, loaded module names)
+    """
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module)
+    start = time.perf_counter()
+    output = subprocess.check_output([sys.executable, '-c', PROBE] +
+                                     list(modules),
+                                     cwd=settings.BASE_DIR, env=env)
+    elapsed = (time.perf_counter() - start) * 1000
+    result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+    return result['stages'], elapsed, result['modules']
+
+
+class Command(BaseCommand):
+    help = "Times a cold start (interpreter, django.setup() and the url " \
+           "conf) in fresh processes and fails when it goes over " \
+           "settings.STARTUP_BUDGET_MS or loads a client that should " \
+           "be lazy."
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('modules', nargs='*',
+                            help="modules to import after setup, "
+                                 "the url conf by default")
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--budget-ms', type=float, default=None)
+        parser.add_argument('--settings-module', default=None,
+                            help="e.g. mUver.heroku-settings, the current "
+                                 "settings by default")
+
+    def handle(self, *args, **options):
+        modules = options['modules'] or [settings.ROOT_URLCONF]
+        budget = options['budget_ms'] or settings.STARTUP_BUDGET_MS
+        settings_module = options['settings_module'] or \
+            settings.SETTINGS_MODULE
+
+        stages, totals, loaded = {}, [], set()
+        for _ in range(options['runs']):
+            timed, elapsed, names = probe(modules, settings_module)
+            for name, milliseconds in timed:
+                stages.setdefault(name, []).append(milliseconds)
+            totals.append(elapsed)
+            loaded.update(names)
+
+        # medians, a cold start is noisy
+        for name, samples in stages.items():
+            self.stdout.write("{:<40} {:>8.1f}ms".format(
+                name, statistics.median(samples)))
+        total = statistics.median(totals)
+        self.stdout.write("{:<40} {:>8.1f}ms (budget {:.0f}ms)".format(
+            "process", total, budget))
+
+        eager = sorted(name for name in LAZY_MODULES if name in loaded)
+        if eager:
+            raise CommandError("Loaded at startup: {}".format(
+                ", ".join(eager)))
+        if total > budget:
+            raise CommandError("Startup took {:.1f}ms, over the {:.0f}ms "
+                               "budget".format(total, budget))
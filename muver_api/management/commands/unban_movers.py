@@ -1,19 +1,49 @@
 import datetime
-from django.utils import timezone
+import time
+from django.contrib.auth.models import User
 from django.core.management import BaseCommand
-from muver_api.models import Strike, UserProfile
+from django.db import transaction
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+from muver_api.models import UserProfile
 
 
 class Command(BaseCommand):
+    help = "Unbans movers whose ban ran out: 2 days after their only " \
+           "strike, 10 days after their second. Three strikes is permanent."
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--dry-run', action='store_true', default=False)
+
     def handle(self, *args, **options):
+        start = time.perf_counter()
         two_days = timezone.now() - datetime.timedelta(days=2)
         ten_days = timezone.now() - datetime.timedelta(days=10)
-        for profile in UserProfile.objects.all().filter(strikes__gt=0).filter(strikes__lt=3):
-            if len(profile.strikes) == 1:
-                for strike in profile.strikes:
-                    if strike.created_at > two_days:
-                        profile.unban_user()
-            elif len(profile.strikes) == 2:
-                for strike in profile.strikes:
-                    if strike.created_at > ten_days:
-                        profile.unban_user()
\ No newline at end of file
+
+        served = UserProfile.objects.filter(banned=True).annotate(
+            strike_count=Count('strikes'),
+            last_strike=Max('strikes__created_at')).filter(
+            Q(strike_count=1, last_strike__lt=two_days) |
+            Q(strike_count=2, last_strike__lt=ten_days))
+
+        if options['dry_run']:
+            counts = dict(served.values_list('id', 'strike_count'))
+            self.stdout.write("Would unban {} movers ({} with one strike, "
+                              "{} with two)".format(
+                                  len(counts),
+                                  list(counts.values()).count(1),
+                                  list(counts.values()).count(2)))
+            return
+
+        ids = list(served.values_list('id', flat=True))
+        batch_size = options['batch_size']
+        for i in range(0, len(ids), batch_size):
+            batch = ids[i:i + batch_size]
+            with transaction.atomic():
+                UserProfile.objects.filter(id__in=batch).update(banned=False)
+                User.objects.filter(profile__id__in=batch)\
+                    .update(is_active=True)
+        self.stdout.write("Unbanned {} movers in {:.2f}s".format(
+            len(ids), time.perf_counter() - start))
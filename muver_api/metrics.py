@@ -0,0 +1,72 @@
+import threading
+import time
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+
+
+def incr(name, amount=1):
+    """
+    increments an in-process counter
+    """
+    with _lock:
+        _counters[name] += amount
+
+
+def get(name):
+    return _counters.get(name, 0)
+
+
+def snapshot(prefix=''):
+    """
+    returns a copy of every counter starting with prefix
+    """
+    with _lock:
+        return dict((name, value) for name, value in _counters.items()
+                    if name.startswith(prefix))
+
+
+def ratio(hits, misses):
+    """
+    returns hits / (hits + misses) of two counters, 0 when both are empty
+    """
+    total = get(hits) + get(misses)
+    if not total:
+        return 0.0
+    return get(hits) / float(total)
+
+
+def reset(prefix=''):
+    with _lock:
+        for name in [name for name in _counters if name.startswith(prefix)]:
+            del _counters[name]
+
+
+def observe(name, milliseconds):
+    """
+    records a timing as <name>.count, <name>.total_ms and <name>.max_ms
+    """
+    with _lock:
+        _counters[name + '.count'] += 1
+        _counters[name + '.total_ms'] += milliseconds
+        _counters[name + '.max_ms'] = max(_counters[name + '.max_ms'],
+                                          milliseconds)
+
+
+class timer(object):
+    """
+    context manager that observes how long its block took
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.milliseconds = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.milliseconds = (time.perf_counter() - self.start) * 1000
+        observe(self.name, self.milliseconds)
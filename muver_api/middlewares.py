@@ -1,9 +1,122 @@
+import logging
+import random
+from django.conf import settings
 from django.contrib.auth import logout
+from django.db import connections
+from muver_api import instrumentation, metrics, resilience, routers
+
+logger = logging.getLogger('muver_api.performance')
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
 
 
 class ActiveUserMiddleware(object):
     def process_request(self, request):
+        if request.META.get('HTTP_AUTHORIZATION', '').startswith('Token '):
+            # ProfileTokenAuthentication rejects inactive users itself,
+            # skip loading the session user for token requests
+            return
         if not request.user.is_authenticated():
             return
         elif not request.user.is_active:
-           logout(request)
\ No newline at end of file
+           logout(request)
+
+
+class PerformanceMiddleware(object):
+    """
+    times a sample of requests (settings.PERFORMANCE_SAMPLE_RATE):
+    wall time, SQL queries and their time, serializer time and
+    external calls. The numbers are logged as structured fields and
+    sent back in a Server-Timing header. Unsampled requests only pay
+    for one random() call.
+    """
+
+    def process_request(self, request):
+        if random.random() >= settings.PERFORMANCE_SAMPLE_RATE:
+            return
+        request._timings = instrumentation.start()
+        request._query_marks = {}
+        for connection in connections.all():
+            # the debug cursor records every query with its time
+            request._query_marks[connection.alias] = (
+                connection.force_debug_cursor, len(connection.queries_log))
+            connection.force_debug_cursor = True
+
+    def process_response(self, request, response):
+        timings = getattr(request, '_timings', None)
+        if timings is None:
+            return response
+        instrumentation.finish()
+        total = timings.elapsed()
+        queries, db_ms = 0, 0.0
+        for connection in connections.all():
+            forced, mark = request._query_marks.get(connection.alias,
+                                                    (False, 0))
+            connection.force_debug_cursor = forced
+            logged = list(connection.queries_log)[mark:]
+            queries += len(logged)
+            db_ms += sum(float(query['time']) for query in logged) * 1000
+
+        fields = {'method': request.method,
+                  'path': request.path,
+                  'status': response.status_code,
+                  'total_ms': round(total, 2),
+                  'db_queries': queries,
+                  'db_ms': round(db_ms, 2)}
+        timing = ['total;dur={:.2f}'.format(total),
+                  'db;dur={:.2f};desc="{} queries"'.format(db_ms, queries)]
+        for name, (count, milliseconds) in sorted(timings.spans.items()):
+            fields[name + '_ms'] = round(milliseconds, 2)
+            fields[name + '_calls'] = count
+            timing.append('{};dur={:.2f}'.format(name, milliseconds))
+
+        metrics.observe('request.total', total)
+        metrics.observe('request.db', db_ms)
+        logger.info("{method} {path} {status} {total_ms}ms {db_queries} "
+                    "queries".format(**fields), extra={'timings': fields})
+        if settings.PERFORMANCE_SERVER_TIMING:
+            response['Server-Timing'] = ', '.join(timing)
+        return response
+
+
+class ReplicaRoutingMiddleware(object):
+    """
+    sends the reads of GET/HEAD/OPTIONS requests to a replica no more
+    than settings.REPLICA_MAX_LAG seconds behind. A client that wrote
+    in the last settings.REPLICA_STICKY_SECONDS keeps reading from the
+    primary so it sees its own writes.
+    """
+
+    def process_request(self, request):
+        routers.use_primary()
+        if not settings.REPLICA_DATABASES or \
+                request.method not in SAFE_METHODS or \
+                routers.is_pinned(request):
+            return
+        alias = routers.choose_replica()
+        if alias is not None:
+            routers.use_replica(alias)
+
+    def process_response(self, request, response):
+        if settings.REPLICA_DATABASES and \
+                request.method not in SAFE_METHODS and \
+                response.status_code < 400:
+            routers.pin(request)
+        routers.use_primary()
+        return response
+
+
+class DeadlineMiddleware(object):
+    """
+    gives each request settings.REQUEST_DEADLINE seconds for its calls
+    to stripe, twilio and the geocoder. Client timeouts are cut to what
+    is left, and once it runs out the calls fail with a 503 instead of
+    holding the worker.
+    """
+
+    def process_request(self, request):
+        resilience.start_deadline(settings.REQUEST_DEADLINE)
+
+    def process_response(self, request, response):
+        resilience.clear_deadline()
+        return response
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+OPEN_JOB = ("mover_profile_id IS NULL AND complete = false "
+            "AND conflict = false")
+
+
+class Migration(migrations.Migration):
+    """
+    point_a/point_b were altered from CharFields into PointFields,
+    which never created their GiST indexes.
+    The partial indexes only cover open jobs so the feed stays small
+    no matter how many finished jobs pile up.
+    """
+
+    dependencies = [
+        ('muver_api', '0030_userprofile__demo_user_reset'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            "CREATE INDEX IF NOT EXISTS muver_api_job_point_a_id "
+            "ON muver_api_job USING GIST (point_a);",
+            "DROP INDEX IF EXISTS muver_api_job_point_a_id;"),
+        migrations.RunSQL(
+            "CREATE INDEX IF NOT EXISTS muver_api_job_point_b_id "
+            "ON muver_api_job USING GIST (point_b);",
+            "DROP INDEX IF EXISTS muver_api_job_point_b_id;"),
+        migrations.RunSQL(
+            "CREATE INDEX muver_api_job_open_point_a ON muver_api_job "
+            "USING GIST (point_a) WHERE " + OPEN_JOB + ";",
+            "DROP INDEX IF EXISTS muver_api_job_open_point_a;"),
+        migrations.RunSQL(
+            "CREATE INDEX muver_api_job_open_created_at ON muver_api_job "
+            "(created_at DESC) WHERE " + OPEN_JOB + ";",
+            "DROP INDEX IF EXISTS muver_api_job_open_created_at;"),
+    ]
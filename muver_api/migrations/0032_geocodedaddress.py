@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('muver_api', '0031_job_spatial_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeocodedAddress',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('address', models.CharField(max_length=80, unique=True)),
+                ('point', django.contrib.gis.db.models.fields.PointField(srid=4326)),
+                ('modified_at', models.DateTimeField(auto_now=True, db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('muver_api', '0033_textmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='payment_status',
+            field=models.CharField(blank=True, max_length=30, null=True),
+        ),
+        migrations.CreateModel(
+            name='PaymentTask',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('operation', models.CharField(choices=[('charge', 'Charge'), ('capture', 'Capture'), ('refund', 'Refund')], max_length=10)),
+                ('charge_id', models.CharField(blank=True, max_length=60, null=True)),
+                ('customer_id', models.CharField(blank=True, max_length=24, null=True)),
+                ('destination', models.CharField(blank=True, max_length=24, null=True)),
+                ('amount', models.IntegerField(blank=True, null=True)),
+                ('application_fee', models.IntegerField(blank=True, null=True)),
+                ('idempotency_key', models.CharField(max_length=40, unique=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('last_error', models.CharField(blank=True, max_length=200, null=True)),
+                ('duration_ms', models.FloatField(blank=True, null=True)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('charge_task', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='muver_api.PaymentTask')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payment_tasks', to='muver_api.Job')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='paymenttask',
+            index_together=set([('completed_at', 'next_attempt_at')]),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+GEOCODING, OPEN, ACCEPTED, USER_CONFIRMED, MOVER_CONFIRMED, COMPLETE, \
+    CONFLICT, NOT_FOUND = range(8)
+
+OPEN_JOB = ("mover_profile_id IS NULL AND complete = false "
+            "AND conflict = false")
+
+
+def set_job_states(apps, schema_editor):
+    """
+    derives the state of existing jobs from the boolean flags,
+    most specific flag last so it wins
+    """
+    Job = apps.get_model('muver_api', 'Job')
+    Job.objects.filter(mover_profile=None, point_a=None)\
+        .update(state=GEOCODING)
+    Job.objects.filter(status="Address could not be found.")\
+        .update(state=NOT_FOUND)
+    Job.objects.exclude(mover_profile=None).update(state=ACCEPTED)
+    Job.objects.exclude(mover_profile=None).filter(confirmation_user=True)\
+        .update(state=USER_CONFIRMED)
+    Job.objects.exclude(mover_profile=None).filter(confirmation_mover=True)\
+        .update(state=MOVER_CONFIRMED)
+    Job.objects.filter(confirmation_user=True, confirmation_mover=True)\
+        .update(state=COMPLETE)
+    Job.objects.filter(complete=True).update(state=COMPLETE)
+    Job.objects.filter(conflict=True).update(state=CONFLICT)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('muver_api', '0035_auto_job_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='state',
+            field=models.IntegerField(choices=[(0, 'Geocoding'), (1, 'Open'), (2, 'Accepted'), (3, 'User confirmed'), (4, 'Mover confirmed'), (5, 'Complete'), (6, 'Conflict'), (7, 'Address not found')], db_index=True, default=1),
+        ),
+        migrations.RunPython(set_job_states, migrations.RunPython.noop),
+        migrations.AlterIndexTogether(
+            name='job',
+            index_together=set([('user', 'modified_at'), ('mover_profile', 'modified_at'), ('state', 'created_at')]),
+        ),
+        migrations.RunSQL(
+            "DROP INDEX IF EXISTS muver_api_job_open_point_a;"
+            "DROP INDEX IF EXISTS muver_api_job_open_created_at;"
+            "CREATE INDEX muver_api_job_open_point_a ON muver_api_job "
+            "USING GIST (point_a) WHERE state = 1;",
+            "DROP INDEX IF EXISTS muver_api_job_open_point_a;"
+            "CREATE INDEX muver_api_job_open_point_a ON muver_api_job "
+            "USING GIST (point_a) WHERE " + OPEN_JOB + ";"
+            "CREATE INDEX muver_api_job_open_created_at ON muver_api_job "
+            "(created_at DESC) WHERE " + OPEN_JOB + ";"),
+    ]
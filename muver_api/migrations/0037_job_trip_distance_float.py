@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('muver_api', '0036_job_state'),
+    ]
+
+    operations = [
+        # blanks and junk would fail the cast, the backfill command
+        # computes them from the points
+        migrations.RunSQL(
+            "UPDATE muver_api_job SET trip_distance = NULL "
+            "WHERE trip_distance !~ '^[0-9]+(\\.[0-9]+)?$';",
+            migrations.RunSQL.noop),
+        migrations.AlterField(
+            model_name='job',
+            name='trip_distance',
+            field=models.FloatField(blank=True, db_index=True, null=True),
+        ),
+        # dist-low/dist-high feed sorts of open jobs
+        migrations.RunSQL(
+            "CREATE INDEX muver_api_job_open_trip_distance ON muver_api_job "
+            "(trip_distance, id) WHERE state = 1;",
+            "DROP INDEX IF EXISTS muver_api_job_open_trip_distance;"),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('muver_api', '0037_job_trip_distance_float'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='geocodedaddress',
+            name='address',
+            field=models.CharField(max_length=160, unique=True),
+        ),
+    ]
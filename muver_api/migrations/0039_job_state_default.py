@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('muver_api', '0038_geocodedaddress_address_length'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='state',
+            field=models.IntegerField(choices=[(0, 'Geocoding'), (1, 'Open'), (2, 'Accepted'), (3, 'User confirmed'), (4, 'Mover confirmed'), (5, 'Complete'), (6, 'Conflict'), (7, 'Address not found')], db_index=True, default=0),
+        ),
+    ]
@@ -1,15 +1,16 @@
 import datetime
-import os
-import stripe
 from django.contrib.gis.db import models
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.utils import timezone
+from muver_api.broker import publish_job
+from muver_api.caching import feed_cache
+from muver_api.geo import trip_miles
+from muver_api.payments import queue_capture
 from rest_framework.authtoken.models import Token
-from twilio import TwilioRestException
-from twilio.rest import TwilioRestClient
 
 
 class UserProfile(models.Model):
@@ -63,7 +64,65 @@ class UserProfile(models.Model):
         return self.user.username
 
 
+class JobQuerySet(models.QuerySet):
+
+    def open(self):
+        """
+        jobs in the feed waiting on a mover
+        """
+        return self.filter(state=Job.OPEN)
+
+    def active_for(self, user):
+        """
+        jobs the user still has to confirm, as poster or as mover
+        """
+        if user.profile.mover:
+            return self.filter(mover_profile=user.profile,
+                               state__in=Job.MOVER_ACTIVE)
+        return self.filter(user=user, state__in=Job.POSTER_ACTIVE)
+
+    def completed_for(self, user):
+        """
+        jobs the user confirmed as complete, as poster or as mover
+        """
+        if user.profile.mover:
+            return self.filter(mover_profile=user.profile,
+                               state__in=Job.MOVER_COMPLETED)
+        return self.filter(user=user, state__in=Job.POSTER_COMPLETED)
+
+    def with_related(self):
+        """
+        joins the rows JobSerializer nests (poster, mover and their
+        profiles) so a page of jobs renders without a query per row
+        """
+        return self.select_related('user__profile',
+                                   'mover_profile__user__profile')
+
+
 class Job(models.Model):
+    GEOCODING = 0
+    OPEN = 1
+    ACCEPTED = 2
+    USER_CONFIRMED = 3
+    MOVER_CONFIRMED = 4
+    COMPLETE = 5
+    CONFLICT = 6
+    NOT_FOUND = 7
+    STATES = (
+        (GEOCODING, 'Geocoding'),
+        (OPEN, 'Open'),
+        (ACCEPTED, 'Accepted'),
+        (USER_CONFIRMED, 'User confirmed'),
+        (MOVER_CONFIRMED, 'Mover confirmed'),
+        (COMPLETE, 'Complete'),
+        (CONFLICT, 'Conflict'),
+        (NOT_FOUND, 'Address not found'),
+    )
+    POSTER_ACTIVE = (GEOCODING, OPEN, ACCEPTED, MOVER_CONFIRMED, NOT_FOUND)
+    POSTER_COMPLETED = (USER_CONFIRMED, COMPLETE)
+    MOVER_ACTIVE = (ACCEPTED, USER_CONFIRMED)
+    MOVER_COMPLETED = (MOVER_CONFIRMED, COMPLETE)
+
     title = models.CharField(max_length=65)
     pickup_for = models.CharField(max_length=30, null=True, blank=True)
     description = models.CharField(max_length=300, null=True, blank=True)
@@ -79,7 +138,7 @@ class Job(models.Model):
     destination_b = models.CharField(max_length=80)
     point_a = models.PointField(null=True, blank=True)
     point_b = models.PointField(null=True, blank=True)
-    trip_distance = models.CharField(max_length=10, null=True, blank=True)
+    trip_distance = models.FloatField(null=True, blank=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     modified_at = models.DateTimeField(auto_now=True)
     confirmation_user = models.BooleanField(default=False)
@@ -89,6 +148,26 @@ class Job(models.Model):
     repost = models.BooleanField(default=False)
     status = models.CharField(max_length=80, null=True, blank=True)
     time_accepted = models.DateTimeField(null=True, blank=True)
+    payment_status = models.CharField(max_length=30, null=True, blank=True)
+    # a job only reaches the feed once geocoded() has run
+    state = models.IntegerField(choices=STATES, default=GEOCODING,
+                                db_index=True)
+
+    objects = JobQuerySet.as_manager()
+
+    class Meta:
+        index_together = [('user', 'modified_at'),
+                          ('mover_profile', 'modified_at'),
+                          ('state', 'created_at')]
+
+    # the state the movers' feed last heard about, see publish_job_saved
+    _announced_state = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        job = super().from_db(db, field_names, values)
+        job._announced_state = job.__dict__.get('state')
+        return job
 
     def job_posted(self):
         """
@@ -97,37 +176,93 @@ class Job(models.Model):
         and user who posted job to in_progress
         """
         self.status = "Job needs a mover."
+        self.state = Job.OPEN
         self.user.profile.in_progress = True
-        self.user.profile.save()
+        self.user.profile.save(update_fields=['in_progress'])
         self.save()
 
+    def geocode_pending(self):
+        """
+        Called when a job is posted before its addresses are geocoded.
+        The job stays out of the feed until geocoded() is called.
+        """
+        self.status = "Geocoding pending."
+        self.state = Job.GEOCODING
+        self.user.profile.in_progress = True
+        self.user.profile.save(update_fields=['in_progress'])
+        self.save()
+
+    def geocoded(self, point_a, point_b):
+        """
+        Called by the geocoding workers once both addresses resolved.
+        Only the geocoded fields are saved so edits made while
+        the job was pending are kept. A pending job is opened to
+        movers, any other job keeps its status.
+        """
+        self.point_a = point_a
+        self.point_b = point_b
+        self.trip_distance = trip_miles(point_a, point_b)
+        fields = ['point_a', 'point_b', 'trip_distance', 'modified_at']
+        if self.state == Job.GEOCODING:
+            self.status = "Job needs a mover."
+            self.state = Job.OPEN
+            fields += ['status', 'state']
+        self.save(update_fields=fields)
+
+    def geocode_failed(self):
+        """
+        Called when an address could not be geocoded.
+        The user who posted the job is free to post again.
+        """
+        self.status = "Address could not be found."
+        self.state = Job.NOT_FOUND
+        self.user.profile.in_progress = False
+        self.user.profile.save(update_fields=['in_progress'])
+        self.save(update_fields=['status', 'state', 'modified_at'])
+
+    def claim(self, mover):
+        """
+        Takes an open job for a mover with a conditional update, so
+        only one of several movers racing for the job gets it.
+        Returns False for the others. Called before anything is
+        charged or texted.
+        """
+        now = timezone.now()
+        claimed = Job.objects.filter(pk=self.pk, state=Job.OPEN,
+                                     mover_profile=None, charge_id=None)\
+            .update(mover_profile=mover, state=Job.ACCEPTED,
+                    modified_at=now)
+        if claimed:
+            self.mover_profile = mover
+            self.state = Job.ACCEPTED
+            self.modified_at = now
+            # the update sends no post_save
+            feed_cache.invalidate(self)
+            publish_job(self)
+            self._announced_state = self.state
+        return bool(claimed)
+
     def in_progress(self):
         """
         Called when mover accepts job.
         Changes the job status and mover to in_progress.
-        A twilio message is also sent to the user who posted the job.
+        A twilio message to the user who posted the job is queued
+        in the same transaction, the deliver_sms worker sends it.
         The mover profile is set to that job.
         """
         self.status = "Mover accepted job."
+        self.state = Job.ACCEPTED
         self.mover_profile.in_progress = True
         time = timezone.now()
         self.time_accepted = time
-        account_sid = os.environ['TWILIO_ACCOUNT_SID']
-        auth_token = os.environ['TWILIO_AUTH_TOKEN']
-
-        client = TwilioRestClient(account_sid, auth_token)
-
-        try:
-            message = client.messages.create(body="A mover accepted your job. "
-                                                  "{}: {}"
-                                             .format(self.mover_profile.display_name,
-                                                     self.mover_profile.phone_number),
-                                             to="+18056376389", # self.phone_number
-                                             from_="+17024661420")
-        except TwilioRestException as e:
-            print(e)
-        self.mover_profile.save()
-        self.save()
+        with transaction.atomic():
+            TextMessage.objects.create(
+                body="A mover accepted your job. {}: {}".format(
+                    self.mover_profile.display_name,
+                    self.mover_profile.phone_number),
+                to="+18056376389")  # self.phone_number
+            self.mover_profile.save()
+            self.save()
 
     def time_check(self):
         """
@@ -157,6 +292,7 @@ class Job(models.Model):
         Job status changes, user and mover taken off being in_progress.
         """
         self.status = "A conflict occurred with user/mover."
+        self.state = Job.CONFLICT
         self.conflict = True
         self.user.profile.in_progress = False
         self.user.profile.save()
@@ -169,19 +305,19 @@ class Job(models.Model):
         Used when the mover says the job is complete.
         Changes the job status depending if the user
         has already confirmed. If user who posted already
-        confirmed job is set to complete and stripe charge
-        is captured/processed and sent to the mover's account
-        id.
+        confirmed job is set to complete and a capture of the
+        stripe charge is queued, the payment worker sends it
+        to the mover's account id.
         Mover is no longer in_progress and can look for more jobs.
         """
         if not self.confirmation_user:
             self.status = "Mover set the job to complete. " \
                           "Waiting for user confirmation."
+            self.state = Job.MOVER_CONFIRMED
         else:
             self.status = "Job complete."
-            charge = stripe.Charge.retrieve(self.charge_id)
-            fee = int(charge.amount * 0.20)
-            charge.capture(application_fee=fee)
+            self.state = Job.COMPLETE
+            queue_capture(self, application_fee=int(self.price * 100 * 0.20))
             self.complete = True
             self.save()
         self.confirmation_mover = True
@@ -193,18 +329,18 @@ class Job(models.Model):
         """
         Called when user who posted job hits job complete.
         If Mover already said the job is complete,
-        Stripe charge processed and job set to complete.
+        a capture of the Stripe charge is queued
+        and job set to complete.
         """
         if not self.confirmation_mover:
             self.status = "User set the job to complete. " \
                           "Waiting for mover confirmation."
+            self.state = Job.USER_CONFIRMED
         else:
             self.status = "Job complete."
+            self.state = Job.COMPLETE
             self.complete = True
-            charge = stripe.Charge.retrieve(self.charge_id)
-            fee = int(charge.amount * 0.20)
-            charge.capture(application_fee=fee)
-            self.complete = True
+            queue_capture(self, application_fee=int(self.price * 100 * 0.20))
             self.save()
         self.confirmation_user = True
         self.user.profile.in_progress = False
@@ -217,6 +353,7 @@ class Job(models.Model):
     def job_complete(self):
 
         self.status = "Job complete."
+        self.state = Job.COMPLETE
         self.complete = True
         self.save()
     # def capture_charge(self):
@@ -241,9 +378,100 @@ class Strike(models.Model):
         return "Strike on {} from {}".format(self.profile, self.user)
 
 
+class PaymentTask(models.Model):
+    """
+    a stripe charge, capture or refund waiting on the
+    process_payments worker. The idempotency key is sent to stripe
+    so a task retried after a crash is never applied twice.
+    """
+    CHARGE = 'charge'
+    CAPTURE = 'capture'
+    REFUND = 'refund'
+    OPERATIONS = (
+        (CHARGE, 'Charge'),
+        (CAPTURE, 'Capture'),
+        (REFUND, 'Refund'),
+    )
+
+    job = models.ForeignKey(Job, related_name="payment_tasks")
+    operation = models.CharField(max_length=10, choices=OPERATIONS)
+    charge_task = models.ForeignKey('self', null=True, blank=True)
+    charge_id = models.CharField(max_length=60, null=True, blank=True)
+    customer_id = models.CharField(max_length=24, null=True, blank=True)
+    destination = models.CharField(max_length=24, null=True, blank=True)
+    amount = models.IntegerField(null=True, blank=True)
+    application_fee = models.IntegerField(null=True, blank=True)
+    idempotency_key = models.CharField(max_length=40, unique=True)
+    attempts = models.IntegerField(default=0)
+    last_error = models.CharField(max_length=200, null=True, blank=True)
+    duration_ms = models.FloatField(null=True, blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        index_together = [('completed_at', 'next_attempt_at')]
+
+    def __str__(self):
+        return "{} for {}".format(self.operation, self.job)
+
+
+class TextMessage(models.Model):
+    """
+    outbox of text messages waiting on the deliver_sms worker
+    """
+    to = models.CharField(max_length=15)
+    body = models.CharField(max_length=320)
+    sid = models.CharField(max_length=40, null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    last_error = models.CharField(max_length=200, null=True, blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        index_together = [('sent_at', 'next_attempt_at')]
+
+    def __str__(self):
+        return "Text to {}".format(self.to)
+
+
+class GeocodedAddress(models.Model):
+    """
+    geocoder results keyed by normalized address,
+    rows older than settings.GEOCODE_CACHE_TTL are refreshed on lookup.
+    """
+    # normalizing an 80 character destination can lengthen it,
+    # "a,b" becomes "a, b"
+    address = models.CharField(max_length=160, unique=True)
+    point = models.PointField()
+    modified_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return self.address
+
+
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_auth_token(sender, instance=None, created=False, **kwargs):
     if created:
         Token.objects.create(user=instance)
         UserProfile.objects.create(user=instance)
 
+
+@receiver(post_save, sender=Job)
+@receiver(post_delete, sender=Job)
+def invalidate_job_feed(sender, instance=None, **kwargs):
+    feed_cache.invalidate(instance)
+
+
+@receiver(post_save, sender=Job)
+def publish_job_saved(sender, instance=None, **kwargs):
+    # waiters on the job hear every save, the feed only state changes
+    announce = instance.state != instance._announced_state
+    instance._announced_state = instance.state
+    publish_job(instance, announce=announce)
+
+
+@receiver(post_delete, sender=Job)
+def publish_job_deleted(sender, instance=None, **kwargs):
+    publish_job(instance, 'removed')
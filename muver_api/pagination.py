@@ -0,0 +1,182 @@
+import base64
+import json
+from collections import OrderedDict
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    keyset ("seek") pagination. The cursor holds the ordering values of
+    the last row on the page and the next page starts right after them,
+    so deep pages are an index range scan instead of a growing OFFSET.
+
+    The queryset's order_by must end with a unique column (e.g. id),
+    names of .extra() selects can be used as ordering terms. A term
+    that is an expression, like the feed's distance from the mover,
+    has no index to seek on: postgres walks the KNN index from the
+    nearest row and drops everything up to the cursor, so deep pages
+    of the location feed still cost like an OFFSET.
+
+    The total count is included unless ?count=false is passed.
+    """
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.terms = self.get_terms(queryset)
+        self.count = None
+        if request.query_params.get(self.count_query_param) != 'false':
+            self.count = queryset.count()
+
+        cursor = self.decode_cursor(request)
+        self.reverse = cursor is not None and 'before' in cursor
+        if cursor is not None:
+            values = cursor['before'] if self.reverse else cursor['after']
+            queryset = self.seek(queryset, values, self.reverse)
+        if self.reverse:
+            queryset = queryset.reverse()
+
+        rows = list(queryset[:self.page_size + 1])
+        more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, more
+        else:
+            self.has_next, self.has_previous = more, cursor is not None
+        self.first = rows[0] if rows else None
+        self.last = rows[-1] if rows else None
+        return rows
+
+    def get_paginated_response(self, data):
+        body = OrderedDict()
+        if self.count is not None:
+            body['count'] = self.count
+        body['next'] = self.get_next_link()
+        body['previous'] = self.get_previous_link()
+        body['results'] = data
+        return Response(body)
+
+    def get_terms(self, queryset):
+        """
+        returns (sql, params, descending, attribute, field) for every
+        ordering term of the queryset
+        """
+        if not queryset.query.order_by:
+            raise ImproperlyConfigured("KeysetPagination needs an ordered "
+                                       "queryset.")
+        model = queryset.model
+        terms = []
+        for name in queryset.query.order_by:
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            if name in queryset.query.extra:
+                sql, params = queryset.query.extra[name]
+                terms.append(('(' + sql + ')', tuple(params), descending,
+                              name, None))
+                continue
+            if name == 'pk':
+                field = model._meta.pk
+            else:
+                field = model._meta.get_field(name)
+            sql = '"{}"."{}"'.format(model._meta.db_table, field.column)
+            terms.append((sql, (), descending, field.attname, field))
+        return terms
+
+    def seek(self, queryset, values, reverse=False):
+        """
+        filters rows that come after `values` in the ordering, or
+        before them with `reverse`. (a, b) > (x, y) is spelled
+        a > x OR (a = x AND b > y) so mixed directions work too
+        """
+        if not isinstance(values, list) or len(values) != len(self.terms):
+            raise NotFound(self.invalid_cursor_message)
+        sql = None
+        params = []
+        for term, value in reversed(list(zip(self.terms, values))):
+            column, column_params, descending, _, field = term
+            value = self.load_value(field, value)
+            operator = '<' if descending != reverse else '>'
+            if sql is None:
+                sql = '{} {} %s'.format(column, operator)
+                params = list(column_params) + [value]
+            else:
+                sql = '({0} {1} %s OR ({0} = %s AND {2}))'.format(
+                    column, operator, sql)
+                params = list(column_params) + [value] + \
+                    list(column_params) + [value] + params
+        return queryset.extra(where=[sql], params=params)
+
+    def load_value(self, field, value):
+        if value is None:
+            raise NotFound(self.invalid_cursor_message)
+        if isinstance(field, models.DateTimeField):
+            value = parse_datetime(value)
+            if value is None:
+                raise NotFound(self.invalid_cursor_message)
+        return value
+
+    def dump_value(self, value):
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return value
+
+    def decode_cursor(self, request):
+        """
+        returns {'after': values} or {'before': values}, None on the
+        first page
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(
+                encoded.encode('ascii')).decode('utf-8'))
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(cursor, dict) or len(cursor) != 1 or \
+                not ('after' in cursor or 'before' in cursor):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def encode_cursor(self, row, position):
+        values = [self.dump_value(getattr(row, term[3]))
+                  for term in self.terms]
+        return base64.urlsafe_b64encode(
+            json.dumps({position: values}).encode('utf-8')).decode('ascii')
+
+    def get_next_cursor(self):
+        if not self.has_next or self.last is None:
+            return None
+        return self.encode_cursor(self.last, 'after')
+
+    def get_previous_cursor(self):
+        if not self.has_previous or self.first is None:
+            return None
+        return self.encode_cursor(self.first, 'before')
+
+    def get_link(self, request, cursor):
+        """
+        returns the url of the page at `cursor`, built from the query
+        params of `request`
+        """
+        if cursor is None:
+            return None
+        url = request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        return self.get_link(self.request, self.get_next_cursor())
+
+    def get_previous_link(self):
+        return self.get_link(self.request, self.get_previous_cursor())
@@ -0,0 +1,25 @@
+import csv
+import io
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class CSVParser(BaseParser):
+    """
+    parses a CSV body with a header row into a list of dicts.
+    empty cells are left out so optional fields fall back to
+    their defaults.
+    """
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            text = stream.read().decode(encoding)
+            return [dict((key.strip(), value) for key, value in row.items()
+                         if key and value not in ('', None))
+                    for row in csv.DictReader(io.StringIO(text))]
+        except (csv.Error, UnicodeDecodeError) as e:
+            raise ParseError('CSV parse error - {}'.format(e))
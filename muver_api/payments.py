@@ -0,0 +1,320 @@
+import datetime
+import logging
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection, transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from muver_api import metrics
+from muver_api.broker import publish_job
+from muver_api.caching import feed_cache
+from muver_api.clients import get_stripe
+from muver_api.instrumentation import track
+
+logger = logging.getLogger(__name__)
+
+PENDING = "Payment pending."
+AUTHORIZED = "Payment authorized."
+SETTLED = "Payment settled."
+REFUNDED = "Payment refunded."
+FAILED = "Payment failed."
+
+_backend = None
+
+
+class StripeBackend(object):
+    """
+    runs payment operations against stripe
+    """
+
+    def __init__(self):
+        self.stripe = get_stripe()
+
+    def create_charge(self, amount, customer, destination, idempotency_key):
+        charge = self.stripe.Charge.create(amount=amount,
+                                           currency="usd",
+                                           customer=customer,
+                                           destination=destination,
+                                           capture=False,
+                                           idempotency_key=idempotency_key)
+        return charge['id']
+
+    def capture(self, charge_id, idempotency_key, amount=None,
+                application_fee=None):
+        charge = self.stripe.Charge.retrieve(charge_id)
+        params = {}
+        if amount is not None:
+            params['amount'] = amount
+        if application_fee is not None:
+            params['application_fee'] = application_fee
+        charge.capture(idempotency_key=idempotency_key, **params)
+
+    def refund(self, charge_id, idempotency_key):
+        self.stripe.Refund.create(charge=charge_id,
+                                  idempotency_key=idempotency_key)
+
+
+class LocalStripeBackend(object):
+    """
+    in-memory stand in for stripe used by tests.
+    repeated idempotency keys return the first result like stripe does.
+    """
+    charges = {}
+    requests = {}
+
+    def _once(self, idempotency_key, operation):
+        if idempotency_key not in self.requests:
+            self.requests[idempotency_key] = operation()
+        return self.requests[idempotency_key]
+
+    def create_charge(self, amount, customer, destination, idempotency_key):
+        def charge():
+            charge_id = "ch_local_{}".format(len(self.charges) + 1)
+            self.charges[charge_id] = {'amount': amount,
+                                       'customer': customer,
+                                       'destination': destination,
+                                       'captured': None,
+                                       'refunded': False}
+            return charge_id
+        return self._once(idempotency_key, charge)
+
+    def capture(self, charge_id, idempotency_key, amount=None,
+                application_fee=None):
+        def capture():
+            charge = self.charges[charge_id]
+            charge['captured'] = amount or charge['amount']
+            charge['application_fee'] = application_fee
+        return self._once(idempotency_key, capture)
+
+    def refund(self, charge_id, idempotency_key):
+        def refund():
+            self.charges[charge_id]['refunded'] = True
+        return self._once(idempotency_key, refund)
+
+
+def get_backend():
+    """
+    returns the backend configured by settings.STRIPE_BACKEND
+    """
+    global _backend
+    if _backend is None:
+        _backend = import_string(settings.STRIPE_BACKEND)()
+    return _backend
+
+
+@receiver(setting_changed)
+def reset_backend(**kwargs):
+    global _backend
+    if kwargs.get('setting', 'STRIPE_BACKEND') == 'STRIPE_BACKEND':
+        _backend = None
+
+
+def _queue(job, operation, **fields):
+    from muver_api.models import PaymentTask
+    job.payment_status = PENDING
+    return PaymentTask.objects.create(job=job, operation=operation,
+                                      idempotency_key=uuid.uuid4().hex,
+                                      **fields)
+
+
+def _latest_charge(job):
+    return job.payment_tasks.filter(operation='charge').order_by('-id')\
+        .first()
+
+
+def queue_charge(job):
+    """
+    queues an uncaptured charge of the job price from the poster
+    to the job's mover. The caller saves the job.
+    """
+    return _queue(job, 'charge', amount=job.price * 100,
+                  customer_id=job.user.profile.customer_id,
+                  destination=job.mover_profile.stripe_account_id)
+
+
+def queue_capture(job, amount=None, application_fee=None):
+    """
+    queues a capture of the job's charge, once it exists.
+    The caller saves the job.
+    """
+    return _queue(job, 'capture', charge_task=_latest_charge(job),
+                  charge_id=job.charge_id, amount=amount,
+                  application_fee=application_fee)
+
+
+def queue_refund(job):
+    """
+    queues a refund of the job's charge, once it exists.
+    The caller saves the job.
+    """
+    return _queue(job, 'refund', charge_task=_latest_charge(job),
+                  charge_id=job.charge_id)
+
+
+def retry_delay(attempts):
+    seconds = settings.PAYMENT_RETRY_DELAY * 2 ** (attempts - 1)
+    return datetime.timedelta(seconds=min(seconds, 60 * 60))
+
+
+def _job_updated(job, **fields):
+    """
+    the update sends no post_save, so the job's feed regions are
+    invalidated and its long polls woken here
+    """
+    for name, value in fields.items():
+        setattr(job, name, value)
+    feed_cache.invalidate(job)
+    publish_job(job, announce=False)
+
+
+def _set_job_status(task, payment_status, **fields):
+    from muver_api.models import Job
+    fields.update(payment_status=payment_status, modified_at=timezone.now())
+    Job.objects.filter(pk=task.job_id).update(**fields)
+    _job_updated(task.job, **fields)
+
+
+def _authorize(task, charge_id):
+    """
+    records a completed charge on its job unless the job has been
+    reposted since it was queued: the strike cleared the mover, or the
+    next mover's accept queued a newer charge. The checks are part of
+    the update so a repost racing the worker can't slip between them.
+    """
+    from muver_api.models import Job, PaymentTask
+    newer = PaymentTask.objects.filter(operation='charge', id__gt=task.id)
+    fields = {'payment_status': AUTHORIZED, 'charge_id': charge_id,
+              'modified_at': timezone.now()}
+    authorized = Job.objects.filter(pk=task.job_id, charge_id=None,
+                                    mover_profile__isnull=False)\
+        .exclude(pk__in=newer.values('job_id')).update(**fields)
+    if authorized:
+        _job_updated(task.job, **fields)
+    return bool(authorized)
+
+
+def run_task(task):
+    """
+    runs one payment task against the backend and records the outcome
+    """
+    from muver_api.models import PaymentTask
+    backend = get_backend()
+    charge_id = task.charge_id
+    if task.operation != 'charge' and not charge_id:
+        charge_id, charge_attempts = PaymentTask.objects.filter(
+            pk=task.charge_task_id).values_list('charge_id', 'attempts')\
+            .first() or (None, settings.PAYMENT_MAX_ATTEMPTS)
+        if not charge_id and \
+                charge_attempts >= settings.PAYMENT_MAX_ATTEMPTS:
+            # the charge it depends on failed for good, so does this
+            task.attempts = settings.PAYMENT_MAX_ATTEMPTS
+            task.last_error = "Charge task failed."
+            task.save(update_fields=['attempts', 'last_error'])
+            return False
+        if not charge_id:
+            # the charge it depends on hasn't gone through yet
+            task.next_attempt_at = timezone.now() + retry_delay(1)
+            task.save(update_fields=['next_attempt_at'])
+            return False
+
+    task.attempts += 1
+    try:
+        with metrics.timer('payments.' + task.operation) as timer, \
+                track('stripe'):
+            if task.operation == 'charge':
+                charge_id = backend.create_charge(task.amount,
+                                                  task.customer_id,
+                                                  task.destination,
+                                                  task.idempotency_key)
+            elif task.operation == 'capture':
+                backend.capture(charge_id, task.idempotency_key,
+                                amount=task.amount,
+                                application_fee=task.application_fee)
+            else:
+                backend.refund(charge_id, task.idempotency_key)
+    except Exception as e:
+        logger.warning("Payment task {} failed: {}".format(task.id, e))
+        metrics.incr('payments.failed')
+        task.last_error = str(e)[:200]
+        task.next_attempt_at = timezone.now() + retry_delay(task.attempts)
+        task.save()
+        if task.attempts >= settings.PAYMENT_MAX_ATTEMPTS:
+            _set_job_status(task, FAILED)
+        return False
+
+    task.charge_id = charge_id
+    task.duration_ms = timer.milliseconds
+    task.completed_at = timezone.now()
+    task.save()
+    if task.operation == 'charge':
+        _authorize(task, charge_id)
+    elif task.operation == 'capture':
+        _set_job_status(task, SETTLED)
+    else:
+        _set_job_status(task, REFUNDED)
+    return True
+
+
+def claim_tasks(batch_size):
+    """
+    leases a batch of due tasks so other workers skip them
+    until settings.PAYMENT_LEASE seconds pass
+    """
+    from muver_api.models import PaymentTask
+    now = timezone.now()
+    with transaction.atomic():
+        due = PaymentTask.objects.select_for_update().filter(
+            completed_at=None, next_attempt_at__lte=now,
+            attempts__lt=settings.PAYMENT_MAX_ATTEMPTS).order_by('id')
+        tasks = list(due.select_related('job')[:batch_size])
+        PaymentTask.objects.filter(pk__in=[task.id for task in tasks]).update(
+            next_attempt_at=now + datetime.timedelta(
+                seconds=settings.PAYMENT_LEASE))
+    return tasks
+
+
+def _run_job_tasks(tasks):
+    try:
+        return sum(1 for task in tasks if run_task(task))
+    finally:
+        connection.close()
+
+
+def process_pending(batch_size=None, workers=None):
+    """
+    runs a batch of due payment tasks on a thread pool.
+    tasks of the same job run in order on one thread so a capture
+    never overtakes its charge. returns the number of tasks completed.
+    """
+    batch_size = batch_size or settings.PAYMENT_BATCH_SIZE
+    tasks = claim_tasks(batch_size)
+    if not tasks:
+        return 0
+    by_job = defaultdict(list)
+    for task in tasks:
+        by_job[task.job_id].append(task)
+    if workers == 1:
+        return sum(sum(1 for task in job_tasks if run_task(task))
+                   for job_tasks in by_job.values())
+    with ThreadPoolExecutor(workers or settings.PAYMENT_WORKERS) as pool:
+        return sum(pool.map(_run_job_tasks, by_job.values()))
+
+
+def latency_stats():
+    """
+    returns count/avg/max latency in ms per payment operation
+    """
+    stats = {}
+    for operation in ('charge', 'capture', 'refund'):
+        name = 'payments.' + operation
+        count = metrics.get(name + '.count')
+        stats[operation] = {
+            'count': count,
+            'avg_ms': metrics.get(name + '.total_ms') / count if count else 0,
+            'max_ms': metrics.get(name + '.max_ms'),
+        }
+    return stats
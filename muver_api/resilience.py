@@ -0,0 +1,148 @@
+import threading
+import time
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from muver_api import metrics
+from muver_api.exceptions import ServiceUnavailable
+
+DEFAULTS = {
+    'failures': 5,
+    'reset_after': 30,
+}
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+_state = threading.local()
+
+
+class CircuitBreaker(object):
+    """
+    stops calling a provider after `failures` failed calls in a row.
+    While open, calls fail at once. After `reset_after` seconds one
+    trial call goes through, its outcome closes or reopens the breaker.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name, failures=5, reset_after=30):
+        self.name = name
+        self.failures = failures
+        self.reset_after = reset_after
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failed = 0
+        self.opened_at = None
+
+    def metric(self, event):
+        return 'breaker.{}.{}'.format(self.name, event)
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and \
+                    time.monotonic() - self.opened_at >= self.reset_after:
+                self.state = self.HALF_OPEN
+                return True
+        metrics.incr(self.metric('rejected'))
+        return False
+
+    def check(self):
+        """
+        raises ServiceUnavailable while the breaker is open
+        """
+        if not self.allow():
+            raise ServiceUnavailable("{} is unavailable, try again "
+                                     "shortly.".format(self.name.title()))
+
+    def record_success(self):
+        with self.lock:
+            if self.state != self.CLOSED:
+                metrics.incr(self.metric('recoveries'))
+            self.state = self.CLOSED
+            self.failed = 0
+
+    def record_failure(self):
+        metrics.incr(self.metric('failures'))
+        with self.lock:
+            self.failed += 1
+            if self.state == self.HALF_OPEN or \
+                    (self.state == self.CLOSED and
+                     self.failed >= self.failures):
+                metrics.incr(self.metric('trips'))
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+def get_breaker(name):
+    """
+    returns the process-wide breaker of a provider,
+    tuned by settings.CIRCUIT_BREAKERS[name]
+    """
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            config = dict(DEFAULTS)
+            config.update(settings.CIRCUIT_BREAKERS.get(name, {}))
+            breaker = _breakers[name] = CircuitBreaker(name, **config)
+        return breaker
+
+
+@receiver(setting_changed)
+def reset_breakers(**kwargs):
+    if kwargs.get('setting', 'CIRCUIT_BREAKERS') == 'CIRCUIT_BREAKERS':
+        with _breakers_lock:
+            _breakers.clear()
+
+
+def start_deadline(seconds):
+    """
+    gives the current request `seconds` for all of its external calls
+    """
+    set_deadline(time.monotonic() + seconds)
+
+
+def clear_deadline():
+    set_deadline(None)
+
+
+def get_deadline():
+    """
+    returns the current thread's deadline as a time.monotonic() value,
+    None outside a request. Work handed to a pool thread takes it along
+    with set_deadline, threadlocals don't cross threads.
+    """
+    return getattr(_state, 'deadline', None)
+
+
+def set_deadline(deadline):
+    _state.deadline = deadline
+
+
+def remaining():
+    """
+    returns the seconds left before the request's deadline,
+    None outside a request
+    """
+    deadline = getattr(_state, 'deadline', None)
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def bounded_timeout(timeout):
+    """
+    caps a (connect, read) timeout to what is left of the deadline,
+    raises ServiceUnavailable once it has passed
+    """
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        metrics.incr('deadline.exceeded')
+        raise ServiceUnavailable("The request ran out of time.")
+    if isinstance(timeout, tuple):
+        return tuple(min(part, left) for part in timeout)
+    return min(timeout, left)
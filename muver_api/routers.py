@@ -0,0 +1,182 @@
+import hashlib
+import logging
+import random
+import threading
+import time
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import DatabaseError, connections
+from django.dispatch import receiver
+from muver_api import metrics
+
+logger = logging.getLogger(__name__)
+
+# seconds the replica is behind the primary, 0 on a primary or when
+# it has replayed everything it received
+LAG_SQL = ("SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0 "
+           "WHEN pg_last_{0}_receive_{1}() = pg_last_{0}_replay_{1}() THEN 0 "
+           "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) "
+           "END")
+
+# pins must be seen by every process, or a client's next read can land
+# on a process that never heard about its write
+LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache',
+                'django.core.cache.backends.dummy.DummyCache')
+
+_state = threading.local()
+_lag = {}
+_lag_lock = threading.Lock()
+
+
+class ReplicaRouter(object):
+    """
+    reads go to the replica picked for the current request, writes
+    and everything outside a routed request go to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = getattr(_state, 'alias', None)
+        if alias is None or connections['default'].in_atomic_block:
+            return None
+        return alias
+
+    def db_for_write(self, model, **hints):
+        # reads later in the request must see this write
+        use_primary()
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+def use_replica(alias):
+    _state.alias = alias
+
+
+def use_primary():
+    _state.alias = None
+
+
+def current_database():
+    return getattr(_state, 'alias', None) or 'default'
+
+
+def lag_sql(pg_version):
+    """
+    returns LAG_SQL for a server version, postgres 10 renamed the
+    xlog location functions to wal lsn
+    """
+    if pg_version >= 100000:
+        return LAG_SQL.format('wal', 'lsn')
+    return LAG_SQL.format('xlog', 'location')
+
+
+def replica_lag(alias):
+    """
+    returns how many seconds a replica is behind, None when it can't
+    be reached
+    """
+    try:
+        replica = connections[alias]
+        with replica.cursor() as cursor:
+            cursor.execute(lag_sql(replica.pg_version))
+            return float(cursor.fetchone()[0] or 0)
+    except DatabaseError as e:
+        logger.warning("Replica {} is unreachable: {}".format(alias, e))
+        return None
+
+
+def healthy_replicas():
+    """
+    returns the replicas no more than settings.REPLICA_MAX_LAG seconds
+    behind, the lag is measured every settings.REPLICA_LAG_CHECK_INTERVAL
+    seconds per process
+    """
+    now = time.monotonic()
+    healthy = []
+    for alias in settings.REPLICA_DATABASES:
+        with _lag_lock:
+            lag, checked_at = _lag.get(alias, (None, None))
+        if checked_at is None or \
+                now - checked_at >= settings.REPLICA_LAG_CHECK_INTERVAL:
+            lag = replica_lag(alias)
+            with _lag_lock:
+                _lag[alias] = (lag, now)
+        if lag is not None and lag <= settings.REPLICA_MAX_LAG:
+            healthy.append(alias)
+        else:
+            metrics.incr('replicas.lagging')
+    return healthy
+
+
+def choose_replica():
+    """
+    returns a random healthy replica, None when they are all behind
+    """
+    healthy = healthy_replicas()
+    if not healthy:
+        metrics.incr('replicas.fallback')
+        return None
+    return random.choice(healthy)
+
+
+def client_key(request):
+    """
+    identifies the client by its token or session,
+    None for anonymous requests
+    """
+    credentials = request.META.get('HTTP_AUTHORIZATION') or \
+        request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not credentials:
+        return None
+    return 'replicas.pin.' + hashlib.sha1(
+        credentials.encode('utf-8')).hexdigest()
+
+
+def pin(request):
+    """
+    keeps the client's reads on the primary for
+    settings.REPLICA_STICKY_SECONDS so it reads its own writes
+    """
+    key = client_key(request)
+    if key is not None:
+        caches[settings.REPLICA_PIN_CACHE].set(
+            key, True, settings.REPLICA_STICKY_SECONDS)
+
+
+def is_pinned(request):
+    key = client_key(request)
+    return key is not None and \
+        caches[settings.REPLICA_PIN_CACHE].get(key, False)
+
+
+@checks.register()
+def check_pin_cache(app_configs, **kwargs):
+    """
+    replica routing needs settings.REPLICA_PIN_CACHE shared by every
+    process
+    """
+    if not settings.REPLICA_DATABASES:
+        return []
+    backend = settings.CACHES.get(settings.REPLICA_PIN_CACHE, {})\
+        .get('BACKEND')
+    if backend in LOCAL_CACHES:
+        return [checks.Error(
+            "REPLICA_PIN_CACHE '{}' is local to each process.".format(
+                settings.REPLICA_PIN_CACHE),
+            hint="Point it at a shared cache such as redis or memcached "
+                 "before setting REPLICA_DATABASES.",
+            id='muver_api.E001')]
+    return []
+
+
+@receiver(setting_changed)
+def reset_lag(**kwargs):
+    if kwargs.get('setting', 'REPLICA_DATABASES') == 'REPLICA_DATABASES':
+        with _lag_lock:
+            _lag.clear()
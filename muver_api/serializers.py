@@ -1,16 +1,64 @@
 import time
-import geocoder
-import stripe
-from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.exceptions import FieldDoesNotExist
+from django.db import transaction
 # from django.contrib.gis.db.models.functions import Distance
-from django.contrib.gis.geos import GEOSGeometry
+from muver_api import metrics
+from muver_api.clients import get_stripe
+from muver_api.exceptions import JobAlreadyTaken
+from muver_api.geocoding import schedule_geocode
+from muver_api.instrumentation import TimedSerializerMixin
 from muver_api.models import UserProfile, Job, Strike
+from muver_api.payments import queue_capture, queue_charge, queue_refund
 # from requests import Response
 from rest_framework import serializers
 
 
-class UserSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin(object):
+    """
+    takes a `fields` list and drops every other field, and works out
+    which columns and relations the remaining fields read
+    """
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is None:
+            return
+        unknown = set(fields) - set(self.fields)
+        if unknown:
+            raise serializers.ValidationError(
+                {'fields': 'Unknown fields: {}'.format(
+                    ', '.join(sorted(unknown)))})
+        for name in set(self.fields) - set(fields):
+            self.fields.pop(name)
+
+    def get_columns(self):
+        """
+        returns (columns, related): the model fields to load with only()
+        and the select_related paths the nested serializers need
+        """
+        model = self.Meta.model
+        paths = getattr(self.Meta, 'select_related', {})
+        columns = {model._meta.pk.name}
+        related = []
+        for name, field in self.fields.items():
+            if field.write_only or field.source == '*':
+                continue
+            try:
+                model_field = model._meta.get_field(field.source_attrs[0])
+            except FieldDoesNotExist:
+                # annotations like distance
+                continue
+            if not model_field.concrete:
+                continue
+            columns.add(model_field.name)
+            if isinstance(field, serializers.BaseSerializer):
+                related.append(paths.get(name, model_field.name))
+        return columns, related
+
+
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
 
     profile = serializers.PrimaryKeyRelatedField(read_only=True)
     password = serializers.CharField(max_length=128, write_only=True)
@@ -24,7 +72,8 @@ class UserSerializer(serializers.ModelSerializer):
         return user
 
 
-class UserProfileSerializer(serializers.ModelSerializer):
+class UserProfileSerializer(SparseFieldsMixin, TimedSerializerMixin,
+                            serializers.ModelSerializer):
 
     user = UserSerializer(read_only=True)
     _demo_user_reset = serializers.BooleanField(default=False)
@@ -32,6 +81,7 @@ class UserProfileSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserProfile
         fields = "__all__"
+        select_related = {'user': 'user__profile'}
 
     def update(self, instance, validated_data):
         if validated_data.get('_demo_user_reset', instance._demo_user_reset):
@@ -40,7 +90,8 @@ class UserProfileSerializer(serializers.ModelSerializer):
         return super().update(instance, validated_data)
 
 
-class JobSerializer(serializers.ModelSerializer):
+class JobSerializer(SparseFieldsMixin, TimedSerializerMixin,
+                    serializers.ModelSerializer):
 
     user = UserSerializer(read_only=True)
     mover_profile = UserProfileSerializer(read_only=True)
@@ -60,8 +111,7 @@ class JobSerializer(serializers.ModelSerializer):
                                     read_only=True)
     point_b = serializers.CharField(max_length=60, required=False,
                                     read_only=True)
-    trip_distance = serializers.CharField(max_length=20, required=False,
-                                     read_only=True)
+    trip_distance = serializers.FloatField(required=False, read_only=True)
     phone_number = serializers.CharField(max_length=10)
     image_url = serializers.URLField(required=False,
                                      default=None,
@@ -70,6 +120,8 @@ class JobSerializer(serializers.ModelSerializer):
     report_user = serializers.BooleanField(default=False)
     strike_mover = serializers.BooleanField(default=False)
     repost = serializers.BooleanField(default=False)
+    payment_status = serializers.CharField(read_only=True)
+    state = serializers.IntegerField(read_only=True)
     # status = serializers.CharField(max_length=30, allow_blank=True,
     #                                allow_null=True, required=False)
 
@@ -85,19 +137,6 @@ class JobSerializer(serializers.ModelSerializer):
         destination_b = validated_data['destination_b']
         image_url = validated_data['image_url']
 
-        ga = geocoder.google(destination_a)
-        gb = geocoder.google(destination_b)
-        a_lat = ga.latlng[0]
-        a_lng = ga.latlng[1]
-        b_lat = gb.latlng[0]
-        b_lng = gb.latlng[1]
-        point_a = GEOSGeometry('POINT(' + str(a_lng) + ' ' + str(a_lat) + ')',
-                               srid=4326)
-        point_b = GEOSGeometry('POINT(' + str(b_lng) + ' ' + str(b_lat) + ')',
-                               srid=4326)
-
-        trip_distance = int(point_a.distance(point_b) * 100 * 0.62137)
-
         job = Job.objects.create(user=user,
                                  price=price,
                                  title=title,
@@ -107,47 +146,50 @@ class JobSerializer(serializers.ModelSerializer):
                                  phone_number=phone_number,
                                  destination_a=destination_a,
                                  destination_b=destination_b,
-                                 point_a=point_a,
-                                 point_b=point_b,
-                                 trip_distance=trip_distance
                                  )
         if not user.profile.phone_number:
             user.profile.phone_number = phone_number
-            user.profile.save()
+            user.profile.save(update_fields=['phone_number'])
         if not user.profile.display_name:
             user.profile.display_name = pickup_for
-            user.profile.save()
-        job.job_posted()
+            user.profile.save(update_fields=['display_name'])
+        job.geocode_pending()
+        schedule_geocode(job)
         return job
 
     def update(self, instance, validated_data):
-        stripe.api_key = settings.STRIPE_SECRET_KEY
         user = instance.user
+        requested = self.initial_data.get('mover_profile')
+        if requested and instance.mover_profile_id and \
+                str(requested) != str(instance.mover_profile_id):
+            metrics.incr('jobs.claim_conflicts')
+            raise JobAlreadyTaken()
         instance.mover_profile = validated_data.get(
             'mover_profile', instance.mover_profile)
 
-        if not instance.mover_profile and not instance.charge_id:
-            customer = instance.user.profile.customer_id
-            mover_id = self.initial_data['mover_profile']
-            mover = UserProfile.objects.get(pk=mover_id)
-            charge = stripe.Charge.create(
-                amount=instance.price * 100,
-                currency="usd",
-                customer=customer,
-                destination=mover.stripe_account_id,
-                capture=False,
-            )
-            instance.mover_profile = mover
-            instance.charge_id = charge['id']
-            instance.in_progress()
+        if not instance.mover_profile:
+            if 'mover_profile' not in self.initial_data or \
+                    instance.charge_id:
+                # the poster editing a job nobody has taken
+                return super().update(instance, validated_data)
+            mover = UserProfile.objects.get(
+                pk=self.initial_data['mover_profile'])
+            with transaction.atomic():
+                # the claim goes first, losers leave before
+                # any charge or text is queued
+                if not instance.claim(mover):
+                    metrics.incr('jobs.claim_conflicts')
+                    raise JobAlreadyTaken()
+                queue_charge(instance)
+                instance.in_progress()
+            metrics.incr('jobs.claimed')
             return instance
 
         mover = UserProfile.objects.get(pk=instance.mover_profile.id)
         # if instance.mover_profile and instance.time_check():
         if validated_data.get('report_user', instance.report_user):
-            charge = stripe.Charge.retrieve(instance.charge_id)
-            gas_money = int(charge.amount * 0.15)
-            charge.capture(amount=gas_money)
+            gas_money = int(instance.price * 100 * 0.15)
+            queue_capture(instance, amount=gas_money)
             instance.job_conflict()
 
         elif validated_data.get('strike_mover', instance.strike_mover):
@@ -155,7 +197,7 @@ class JobSerializer(serializers.ModelSerializer):
             Strike.objects.create(user=user, profile=mover, job=instance,
                                   comment=comment)
             mover.ban_user()
-            stripe.Refund.create(charge=instance.charge_id)
+            queue_refund(instance)
             if validated_data.get('repost', instance.repost):
                 instance.charge_id = None
                 instance.mover_profile = None
@@ -190,6 +232,46 @@ class JobSerializer(serializers.ModelSerializer):
     class Meta:
         model = Job
         fields = "__all__"
+        select_related = {'user': 'user__profile',
+                          'mover_profile': 'mover_profile__user__profile'}
+
+
+class JobCardSerializer(SparseFieldsMixin, TimedSerializerMixin,
+                        serializers.ModelSerializer):
+    """
+    the handful of fields a feed card shows, without the nested
+    poster and mover
+    """
+    distance = serializers.DecimalField(
+        source='distance.mi', max_digits=10, decimal_places=1,
+        required=False, read_only=True)
+    narrow_query = True
+
+    class Meta:
+        model = Job
+        fields = ('id', 'title', 'price', 'pickup_for', 'destination_a',
+                  'destination_b', 'trip_distance', 'distance', 'image_url',
+                  'status', 'state', 'created_at')
+
+
+class JobImportSerializer(serializers.Serializer):
+    """
+    validates one row of a bulk job import,
+    with the same rules as JobSerializer
+    """
+    price = serializers.IntegerField()
+    title = serializers.CharField(max_length=65)
+    pickup_for = serializers.CharField(max_length=30)
+    description = serializers.CharField(max_length=300,
+                                        required=False,
+                                        default=None)
+    destination_a = serializers.CharField(max_length=80)
+    destination_b = serializers.CharField(max_length=80)
+    phone_number = serializers.CharField(max_length=10)
+    image_url = serializers.URLField(required=False,
+                                     default=None,
+                                     allow_blank=True,
+                                     allow_null=True)
 
 
 class CustomerSerializer(serializers.Serializer):
@@ -197,7 +279,7 @@ class CustomerSerializer(serializers.Serializer):
     token = serializers.CharField(max_length=60)
 
     def create(self, validated_data):
-        stripe.api_key = settings.STRIPE_SECRET_KEY
+        stripe = get_stripe()
         user = validated_data['user']
         token = validated_data['token']
 
@@ -207,7 +289,7 @@ class CustomerSerializer(serializers.Serializer):
                 description="mUver customer"
             )
             user.profile.customer_id = customer['id']
-            user.profile.save()
+            user.profile.save(update_fields=['customer_id'])
             return user.profile.customer_id
 
         except stripe.error.CardError as e:
@@ -263,7 +345,7 @@ class StripeAccountSerializer(serializers.Serializer):
 
     def create(self, validated_data):
 
-        stripe.api_key = settings.STRIPE_SECRET_KEY
+        stripe = get_stripe()
         country = validated_data['country']
         currency = validated_data['currency']
         account_number = validated_data['account_number']
@@ -315,7 +397,7 @@ class StripeAccountSerializer(serializers.Serializer):
             user = validated_data['user']
             user.profile.stripe_account_id = account['id']
             user.profile.mover = True
-            user.profile.save()
+            user.profile.save(update_fields=['stripe_account_id', 'mover'])
 
             return account
 
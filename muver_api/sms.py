@@ -0,0 +1,116 @@
+import datetime
+import logging
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from muver_api import clients, metrics
+from muver_api.instrumentation import track
+
+logger = logging.getLogger(__name__)
+
+_backend = None
+
+
+class TwilioBackend(object):
+    """
+    sends texts through the twilio rest api on the pooled 'twilio'
+    session, TwilioRestClient opens a new connection per message
+    """
+    url = "https://api.twilio.com/2010-04-01/Accounts/{}/Messages.json"
+
+    def send(self, to, body):
+        response = clients.request(
+            'twilio', 'POST', self.url.format(settings.TWILIO_ACCOUNT_SID),
+            auth=(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN),
+            data={'To': to, 'From': settings.TWILIO_FROM_NUMBER,
+                  'Body': body})
+        response.raise_for_status()
+        return response.json()['sid']
+
+
+class LocalMemoryBackend(object):
+    """
+    keeps sent texts in LocalMemoryBackend.outbox, used by tests
+    """
+    outbox = []
+
+    def send(self, to, body):
+        self.outbox.append({'to': to, 'body': body})
+        return "local-{}".format(len(self.outbox))
+
+
+def get_backend():
+    """
+    returns the backend configured by settings.SMS_BACKEND
+    """
+    global _backend
+    if _backend is None:
+        _backend = import_string(settings.SMS_BACKEND)()
+    return _backend
+
+
+@receiver(setting_changed)
+def reset_backend(**kwargs):
+    global _backend
+    if kwargs.get('setting', 'SMS_BACKEND') == 'SMS_BACKEND':
+        _backend = None
+
+
+def retry_delay(attempts):
+    """
+    returns the exponential backoff before the next attempt
+    """
+    seconds = settings.SMS_RETRY_DELAY * 2 ** (attempts - 1)
+    return datetime.timedelta(seconds=min(seconds, 60 * 60))
+
+
+def claim_messages(batch_size):
+    """
+    leases a batch of due texts so other workers skip them
+    until settings.SMS_LEASE seconds pass
+    """
+    from muver_api.models import TextMessage
+    now = timezone.now()
+    with transaction.atomic():
+        due = TextMessage.objects.select_for_update().filter(
+            sent_at=None, next_attempt_at__lte=now,
+            attempts__lt=settings.SMS_MAX_ATTEMPTS).order_by('id')
+        messages = list(due[:batch_size])
+        TextMessage.objects.filter(
+            pk__in=[message.id for message in messages]).update(
+                next_attempt_at=now + datetime.timedelta(
+                    seconds=settings.SMS_LEASE))
+    return messages
+
+
+def deliver_pending(batch_size=None):
+    """
+    sends a batch of due texts from the TextMessage outbox.
+    every text is saved as soon as twilio answers, so a crash
+    resends at most the one in flight. failed sends are retried
+    with backoff until SMS_MAX_ATTEMPTS.
+    returns the number of texts sent.
+    """
+    batch_size = batch_size or settings.SMS_BATCH_SIZE
+    backend = get_backend()
+    sent = 0
+    for message in claim_messages(batch_size):
+        message.attempts += 1
+        try:
+            with track('twilio'):
+                message.sid = backend.send(message.to, message.body)
+        except Exception as e:
+            logger.warning("Text {} failed: {}".format(message.id, e))
+            metrics.incr('sms.failed')
+            message.last_error = str(e)[:200]
+            message.next_attempt_at = timezone.now() + \
+                retry_delay(message.attempts)
+        else:
+            metrics.incr('sms.sent')
+            message.sent_at = timezone.now()
+            sent += 1
+        message.save()
+    return sent
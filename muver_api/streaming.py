@@ -0,0 +1,62 @@
+import json
+import time
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from muver_api.geo import haversine_miles
+from rest_framework.renderers import BaseRenderer
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    lets text/event-stream clients through content negotiation,
+    error responses are sent as a single `error` event
+    """
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return format_event('error', data).encode(self.charset)
+
+
+def format_event(event, data):
+    return 'event: {}\ndata: {}\n\n'.format(
+        event, json.dumps(data, cls=DjangoJSONEncoder))
+
+
+def release_connections():
+    """
+    closes the request's database connections before it waits on the
+    broker, they are reopened on the next query. Connections inside a
+    transaction are left alone.
+    """
+    for conn in connections.all():
+        if not conn.in_atomic_block:
+            conn.close()
+
+
+def job_feed_stream(subscription, latitude, longitude, radius, timeout,
+                    heartbeat):
+    """
+    yields server-sent events for jobs published within `radius` miles
+    of a point until `timeout` seconds pass. A comment line is sent
+    every `heartbeat` seconds so proxies keep the connection open.
+    """
+    deadline = time.monotonic() + timeout
+    try:
+        # nothing below reads the database, a postgres connection
+        # shouldn't be held for the whole stream
+        release_connections()
+        yield 'retry: 3000\n\n'
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            message = subscription.get(timeout=min(heartbeat, remaining))
+            if message is None:
+                yield ': keepalive\n\n'
+            elif haversine_miles(latitude, longitude, message['lat'],
+                                 message['lng']) <= radius:
+                yield format_event(message['event'], message)
+    finally:
+        subscription.close()
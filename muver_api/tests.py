@@ -1,15 +1,41 @@
+import threading
 import time
 import datetime
+import io
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
 from django.utils import timezone
 import stripe
 from django.conf import settings
-from django.test import TestCase
+from django.db import connection, connections, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
 from django.core.urlresolvers import reverse
-from muver_api.models import Job, UserProfile
+from muver_api.geo import make_point, trip_miles
+from muver_api import clients, geocoding, metrics, resilience, routers
+from muver_api.log import BoundedQueueHandler, JSONFormatter, \
+    SamplingFilter
+from muver_api.broker import get_broker
+from muver_api.caching import feed_cache
+from muver_api.exceptions import ServiceUnavailable
+from muver_api.geocoding import geocode, geocode_job, geocode_many, \
+    get_memory_cache, normalize_address
+from muver_api.models import GeocodedAddress, Job, PaymentTask, Strike, \
+    TextMessage, UserProfile
+from muver_api.payments import LocalStripeBackend, claim_tasks, \
+    process_pending, run_task
+from muver_api.sms import LocalMemoryBackend, claim_messages, deliver_pending
 from rest_framework import status
 from rest_framework.authtoken.models import Token
-from rest_framework.test import APITestCase
+from rest_framework.test import APIClient, APITestCase, \
+    APITransactionTestCase
 
 
 class TestListCreateJob(APITestCase):
@@ -30,6 +56,7 @@ class TestListCreateJob(APITestCase):
                                       phone_number="8056376389",
                                       destination_a="las vegas, nv",
                                       destination_b="henderson, nv",
+                                      state=Job.OPEN,
                                       )
 
     def test_create_job(self):
@@ -157,3 +184,1467 @@ class TestListCreateJob(APITestCase):
         self.assertTrue(self.user.is_active, True)
         self.assertFalse(self.user.profile.banned, False)
 
+
+
+class TestNearbyJobFeed(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="test",
+                                             email="",
+                                             password="pass_word")
+        self.near = Job.objects.create(user=self.user, price=80,
+                                       title="near", pickup_for="tester",
+                                       destination_a="las vegas, nv",
+                                       destination_b="henderson, nv",
+                                       point_a=make_point(36.17, -115.14),
+                                       point_b=make_point(36.04, -114.98),
+                                       state=Job.OPEN)
+        self.far = Job.objects.create(user=self.user, price=80,
+                                      title="far", pickup_for="tester",
+                                      destination_a="reno, nv",
+                                      destination_b="sparks, nv",
+                                      point_a=make_point(39.53, -119.81),
+                                      point_b=make_point(39.53, -119.75),
+                                      state=Job.OPEN)
+
+    def test_radius_feed(self):
+        url = reverse('list_create_job')
+        response = self.client.get(url, {'lat': 36.16, 'lng': -115.15,
+                                          'radius': 25})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        titles = [job['title'] for job in response.data['results']]
+        self.assertEqual(titles, ["near"])
+
+    def test_unbounded_feed_nearest_first(self):
+        url = reverse('list_create_job')
+        response = self.client.get(url, {'lat': 39.5, 'lng': -119.8})
+        titles = [job['title'] for job in response.data['results']]
+        self.assertEqual(titles, ["far", "near"])
+
+    def test_invalid_radius(self):
+        url = reverse('list_create_job')
+        response = self.client.get(url, {'lat': 36.16, 'lng': -115.15,
+                                          'radius': 'wide'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(GEOCODER_BACKEND='muver_api.geocoding.StubGeocoder',
+                   GEOCODE_ASYNC=True)
+class TestAsyncGeocoding(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="test",
+                                             email="",
+                                             password="pass_word")
+        token = Token.objects.get(user_id=self.user.id)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+    def test_job_geocoded_in_background(self):
+        url = reverse('list_create_job')
+        data = {"title": "couch", "price": 80, "pickup_for": "tester",
+                "phone_number": "8056376389", "destination_a": "las vegas, nv",
+                "destination_b": "henderson, nv"}
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        job = Job.objects.get(title="couch")
+        self.assertEqual(job.status, "Geocoding pending.")
+        self.assertIsNone(job.point_a)
+        feed = self.client.get(url, {'lat': 36.16, 'lng': -115.15})
+        self.assertEqual(feed.data['count'], 0)
+
+        job = geocode_job(job.id)
+        self.assertEqual(job.status, "Job needs a mover.")
+        self.assertIsNotNone(job.point_b)
+        self.assertTrue(int(job.trip_distance) > 0)
+        feed = self.client.get(url, {'lat': 36.16, 'lng': -115.15})
+        self.assertEqual(feed.data['count'], 1)
+
+    def test_command_geocodes_pending_jobs(self):
+        self.client.post(reverse('list_create_job'), {
+            "title": "couch", "price": 80, "pickup_for": "tester",
+            "phone_number": "8056376389", "destination_a": "las vegas, nv",
+            "destination_b": "henderson, nv"}, format='json')
+        out = io.StringIO()
+        call_command('geocode_jobs', stdout=out)
+        job = Job.objects.get(title="couch")
+        self.assertEqual(job.state, Job.OPEN)
+        self.assertIn("Geocoded job {}".format(job.id), out.getvalue())
+
+
+class DeadlineRecordingGeocoder(object):
+    remaining = []
+
+    def geocode(self, address):
+        DeadlineRecordingGeocoder.remaining.append(resilience.remaining())
+        return (36.17, -115.14)
+
+
+@override_settings(GEOCODER_BACKEND='muver_api.geocoding.StubGeocoder')
+class TestGeocodeCache(TestCase):
+
+    def setUp(self):
+        get_memory_cache().clear()
+        metrics.reset('geocode.')
+
+    def test_normalize_address(self):
+        self.assertEqual(normalize_address(" Las  Vegas,NV. "),
+                         "las vegas, nv")
+
+    def test_longest_destination_is_cached(self):
+        address = ",".join(["a"] * 40)
+        self.assertEqual(len(address), 79)
+        self.assertEqual(len(normalize_address(address)), 118)
+        self.assertIsNotNone(geocode(address))
+        self.assertTrue(GeocodedAddress.objects.filter(
+            address=normalize_address(address)).exists())
+
+    @override_settings(
+        GEOCODER_BACKEND='muver_api.tests.DeadlineRecordingGeocoder')
+    def test_batch_lookups_keep_the_deadline(self):
+        DeadlineRecordingGeocoder.remaining = []
+        resilience.start_deadline(5)
+        try:
+            geocode_many(["elko, nv", "ely, nv", "tonopah, nv"])
+        finally:
+            resilience.clear_deadline()
+        self.assertEqual(len(DeadlineRecordingGeocoder.remaining), 3)
+        for left in DeadlineRecordingGeocoder.remaining:
+            self.assertTrue(0 < left <= 5)
+
+    def test_batch_waits_on_lookup_in_flight(self):
+        point = make_point(40.83, -115.76)
+        future = Future()
+        geocoding._inflight["elko, nv"] = future
+        timer = threading.Timer(0.05, future.set_result, [point])
+        timer.start()
+        try:
+            points = geocode_many(["Elko, NV", "reno, nv"])
+        finally:
+            timer.join()
+            del geocoding._inflight["elko, nv"]
+        self.assertEqual(points["Elko, NV"], point)
+        self.assertIsNotNone(points["reno, nv"])
+        self.assertEqual(metrics.get('geocode.external_calls'), 1)
+        self.assertEqual(metrics.get('geocode.coalesced'), 1)
+
+    def test_repeat_address_is_cached(self):
+        point = geocode("Las Vegas, NV")
+        self.assertEqual(geocode("las vegas,nv"), point)
+        self.assertEqual(metrics.get('geocode.external_calls'), 1)
+        self.assertEqual(metrics.get('geocode.memory_hits'), 1)
+
+        get_memory_cache().clear()
+        self.assertEqual(geocode("las vegas, nv"), point)
+        self.assertEqual(metrics.get('geocode.db_hits'), 1)
+        self.assertEqual(metrics.get('geocode.external_calls'), 1)
+        self.assertEqual(GeocodedAddress.objects.count(), 1)
+
+
+class TestJobListQueryCount(APITestCase):
+    """
+    a page of jobs should cost the same number of queries
+    no matter how many jobs are on it
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="poster",
+                                             email="",
+                                             password="pass_word")
+        self.mover_user = User.objects.create_user(username="mover",
+                                                   email="",
+                                                   password="pass_word")
+        self.mover_user.profile.mover = True
+        self.mover_user.profile.save()
+
+    def create_jobs(self, count, state=Job.ACCEPTED, **fields):
+        fields.setdefault('mover_profile', self.mover_user.profile)
+        for i in range(count):
+            Job.objects.create(user=self.user, price=80,
+                               title="job {}".format(i), pickup_for="tester",
+                               destination_a="las vegas, nv",
+                               destination_b="henderson, nv",
+                               point_a=make_point(36.17, -115.14),
+                               point_b=make_point(36.04, -114.98),
+                               state=state, **fields)
+
+    def count_queries(self, url, user):
+        token = Token.objects.get(user_id=user.id)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries)
+
+    def assertConstantQueries(self, url, user, **fields):
+        self.create_jobs(2, **fields)
+        small_page = self.count_queries(url, user)
+        self.create_jobs(10, **fields)
+        full_page = self.count_queries(url, user)
+        self.assertEqual(small_page, full_page)
+
+    def test_jobs_by_mover(self):
+        self.assertConstantQueries(reverse('user_jobs'), self.mover_user)
+
+    def test_job_feed(self):
+        # open jobs have no mover, accepted ones do
+        for url in (reverse('list_create_job'),
+                    reverse('list_create_job') + '?lat=36.16&lng=-115.15'):
+            Job.objects.all().delete()
+            self.create_jobs(1, state=Job.OPEN, mover_profile=None)
+            self.create_jobs(1)
+            small_page = self.count_queries(url, self.user)
+            self.create_jobs(5, state=Job.OPEN, mover_profile=None)
+            self.create_jobs(5)
+            self.assertEqual(small_page, self.count_queries(url, self.user))
+
+    def test_jobs_by_poster_mixed(self):
+        url = reverse('user_jobs')
+        self.create_jobs(1, state=Job.OPEN, mover_profile=None)
+        self.create_jobs(1)
+        small_page = self.count_queries(url, self.user)
+        self.create_jobs(5, state=Job.OPEN, mover_profile=None)
+        self.create_jobs(5)
+        self.assertEqual(small_page, self.count_queries(url, self.user))
+
+    def test_jobs_by_poster(self):
+        self.assertConstantQueries(reverse('user_jobs'), self.user)
+
+    def test_completed_jobs(self):
+        self.assertConstantQueries(reverse('completed_user_jobs'), self.user,
+                                   state=Job.USER_CONFIRMED,
+                                   confirmation_user=True)
+
+    def test_profile_list(self):
+        url = reverse('list_profile')
+        small_page = self.count_queries(url, self.user)
+        for i in range(10):
+            User.objects.create_user(username="user {}".format(i), email="",
+                                     password="pass_word")
+        self.assertEqual(small_page, self.count_queries(url, self.user))
+
+
+class FailingSMSBackend(object):
+
+    def send(self, to, body):
+        raise IOError("twilio is down")
+
+
+@override_settings(SMS_BACKEND='muver_api.sms.LocalMemoryBackend')
+class TestTextMessageOutbox(TestCase):
+
+    def setUp(self):
+        LocalMemoryBackend.outbox = []
+        self.user = User.objects.create_user(username="poster",
+                                             email="",
+                                             password="pass_word")
+        self.mover_user = User.objects.create_user(username="mover",
+                                                   email="",
+                                                   password="pass_word")
+        self.job = Job.objects.create(user=self.user, price=80,
+                                      title="test title",
+                                      pickup_for="tester",
+                                      destination_a="las vegas, nv",
+                                      destination_b="henderson, nv",
+                                      mover_profile=self.mover_user.profile)
+
+    def test_accepting_job_queues_text(self):
+        self.job.in_progress()
+        self.assertEqual(TextMessage.objects.filter(sent_at=None).count(), 1)
+        self.assertEqual(LocalMemoryBackend.outbox, [])
+
+        self.assertEqual(deliver_pending(), 1)
+        self.assertEqual(len(LocalMemoryBackend.outbox), 1)
+        self.assertEqual(TextMessage.objects.filter(sent_at=None).count(), 0)
+
+    @override_settings(SMS_BACKEND='muver_api.tests.FailingSMSBackend')
+    def test_failed_text_is_retried_later(self):
+        self.job.in_progress()
+        self.assertEqual(deliver_pending(), 0)
+        message = TextMessage.objects.get()
+        self.assertEqual(message.attempts, 1)
+        self.assertIsNone(message.sent_at)
+        self.assertTrue(message.next_attempt_at > timezone.now())
+        self.assertEqual(deliver_pending(), 0)
+        self.assertEqual(TextMessage.objects.get().attempts, 1)
+
+    def test_leased_text_is_skipped(self):
+        self.job.in_progress()
+        # another worker holds the text while it talks to twilio
+        self.assertEqual(len(claim_messages(50)), 1)
+        self.assertEqual(deliver_pending(), 0)
+        self.assertEqual(LocalMemoryBackend.outbox, [])
+
+
+@override_settings(SMS_BACKEND='muver_api.sms.LocalMemoryBackend')
+class TestJobStates(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="poster",
+                                             email="",
+                                             password="pass_word")
+        self.mover_user = User.objects.create_user(username="mover",
+                                                   email="",
+                                                   password="pass_word")
+        self.job = Job.objects.create(user=self.user, price=80,
+                                      title="couch", pickup_for="tester",
+                                      destination_a="las vegas, nv",
+                                      destination_b="henderson, nv")
+
+    def assertState(self, state):
+        self.assertEqual(self.job.state, state)
+        self.assertEqual(Job.objects.get(pk=self.job.id).state, state)
+
+    def accept(self):
+        self.job.geocoded(make_point(36.17, -115.14),
+                          make_point(36.04, -114.98))
+        self.assertTrue(self.job.claim(self.mover_user.profile))
+        self.job.in_progress()
+
+    def test_new_job_stays_out_of_the_feed(self):
+        self.assertState(Job.GEOCODING)
+        self.assertFalse(Job.objects.open().exists())
+
+    def test_post(self):
+        self.job.geocode_pending()
+        self.assertState(Job.GEOCODING)
+
+    def test_geocoded(self):
+        self.job.geocode_pending()
+        self.job.geocoded(make_point(36.17, -115.14),
+                          make_point(36.04, -114.98))
+        self.assertState(Job.OPEN)
+
+    def test_geocode_failed(self):
+        self.job.geocode_pending()
+        self.job.geocode_failed()
+        self.assertState(Job.NOT_FOUND)
+        self.user.profile.refresh_from_db()
+        self.assertFalse(self.user.profile.in_progress)
+
+    def test_geocoded_keeps_status_of_taken_job(self):
+        self.accept()
+        self.job.geocoded(make_point(36.17, -115.14),
+                          make_point(36.04, -114.98))
+        self.assertState(Job.ACCEPTED)
+        self.assertEqual(Job.objects.get(pk=self.job.id).status,
+                         "Mover accepted job.")
+
+    def test_accept(self):
+        self.accept()
+        self.assertState(Job.ACCEPTED)
+
+    def test_complete(self):
+        self.accept()
+        self.job.user_finished()
+        self.assertState(Job.USER_CONFIRMED)
+        self.job.mover_finished()
+        self.assertState(Job.COMPLETE)
+
+    def test_conflict(self):
+        self.accept()
+        self.job.job_conflict()
+        self.assertState(Job.CONFLICT)
+
+    def test_strike_and_repost(self):
+        self.accept()
+        self.job.mover_profile = None
+        self.job.job_posted()
+        self.assertState(Job.OPEN)
+
+
+@override_settings(STRIPE_BACKEND='muver_api.payments.LocalStripeBackend',
+                   SMS_BACKEND='muver_api.sms.LocalMemoryBackend')
+class TestPaymentWorker(APITestCase):
+
+    def setUp(self):
+        LocalStripeBackend.charges = {}
+        LocalStripeBackend.requests = {}
+        self.user = User.objects.create_user(username="poster",
+                                             email="",
+                                             password="pass_word")
+        self.user.profile.customer_id = "cus_local"
+        self.user.profile.save()
+        self.mover_user = User.objects.create_user(username="mover",
+                                                   email="",
+                                                   password="pass_word")
+        self.mover_user.profile.mover = True
+        self.mover_user.profile.stripe_account_id = "acct_local"
+        self.mover_user.profile.save()
+        self.job = Job.objects.create(user=self.user, price=80,
+                                      title="test title",
+                                      pickup_for="tester",
+                                      destination_a="las vegas, nv",
+                                      destination_b="henderson, nv",
+                                      state=Job.OPEN)
+        token = Token.objects.get(user_id=self.mover_user.id)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        self.url = reverse('detail_update_delete_job',
+                           kwargs={'pk': self.job.id})
+
+    def test_accept_queues_charge(self):
+        response = self.client.patch(
+            self.url, {'mover_profile': self.mover_user.profile.id},
+            format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(LocalStripeBackend.charges, {})
+        job = Job.objects.get(pk=self.job.id)
+        self.assertEqual(job.payment_status, "Payment pending.")
+        self.assertIsNone(job.charge_id)
+
+        self.assertEqual(process_pending(workers=1), 1)
+        job = Job.objects.get(pk=self.job.id)
+        self.assertEqual(job.payment_status, "Payment authorized.")
+        charge = LocalStripeBackend.charges[job.charge_id]
+        self.assertEqual(charge['amount'], 8000)
+        self.assertEqual(charge['destination'], "acct_local")
+
+    def test_capture_waits_for_charge(self):
+        self.client.patch(self.url,
+                          {'mover_profile': self.mover_user.profile.id},
+                          format='json')
+        self.client.patch(self.url, {'report_user': True}, format='json')
+        self.assertEqual(process_pending(workers=1), 2)
+        job = Job.objects.get(pk=self.job.id)
+        self.assertEqual(job.payment_status, "Payment settled.")
+        self.assertEqual(LocalStripeBackend.charges[job.charge_id]['captured'],
+                         1200)
+
+    def test_capture_fails_with_its_charge(self):
+        self.client.patch(self.url,
+                          {'mover_profile': self.mover_user.profile.id},
+                          format='json')
+        self.client.patch(self.url, {'report_user': True}, format='json')
+        PaymentTask.objects.filter(operation='charge').update(
+            attempts=settings.PAYMENT_MAX_ATTEMPTS)
+        self.assertEqual(process_pending(workers=1), 0)
+        capture = PaymentTask.objects.get(operation='capture')
+        self.assertEqual(capture.attempts, settings.PAYMENT_MAX_ATTEMPTS)
+        self.assertIsNone(capture.completed_at)
+        self.assertEqual(claim_tasks(10), [])
+
+    def test_retried_task_charges_once(self):
+        self.client.patch(self.url,
+                          {'mover_profile': self.mover_user.profile.id},
+                          format='json')
+        task = PaymentTask.objects.get()
+        run_task(task)
+        run_task(PaymentTask.objects.get())
+        self.assertEqual(len(LocalStripeBackend.charges), 1)
+
+    def test_poster_edits_open_job(self):
+        token = Token.objects.get(user_id=self.user.id)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = self.client.patch(self.url, {'title': "sofa"},
+                                     format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        job = Job.objects.get(pk=self.job.id)
+        self.assertEqual(job.title, "sofa")
+        self.assertEqual(job.state, Job.OPEN)
+        self.assertIsNone(job.mover_profile)
+        self.assertFalse(PaymentTask.objects.exists())
+
+    def test_charge_after_repost_stays_off_the_job(self):
+        self.client.patch(self.url,
+                          {'mover_profile': self.mover_user.profile.id},
+                          format='json')
+        # the poster strikes the mover and reposts before the worker
+        # gets to the charge
+        token = Token.objects.get(user_id=self.user.id)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = self.client.patch(self.url, {'strike_mover': True,
+                                                'comment': "no show",
+                                                'repost': True},
+                                     format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        process_pending(workers=1)
+        job = Job.objects.get(pk=self.job.id)
+        self.assertIsNone(job.charge_id)
+        self.assertIsNone(job.mover_profile)
+
+        other = User.objects.create_user(username="other", email="",
+                                         password="pass_word")
+        other.profile.mover = True
+        other.profile.stripe_account_id = "acct_other"
+        other.profile.save()
+        token = Token.objects.get(user_id=other.id)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = self.client.patch(self.url,
+                                     {'mover_profile': other.profile.id},
+                                     format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        process_pending(workers=1)
+        job = Job.objects.get(pk=self.job.id)
+        self.assertEqual(job.payment_status, "Payment authorized.")
+        self.assertEqual(
+            LocalStripeBackend.charges[job.charge_id]['destination'],
+            "acct_other")
+
+
+class TestKeysetPagination(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="poster",
+                                             email="",
+                                             password="pass_word")
+        for i in range(40):
+            Job.objects.create(user=self.user, price=20 + i % 7,
+                               title="job {}".format(i), pickup_for="tester",
+                               destination_a="las vegas, nv",
+                               destination_b="henderson, nv",
+                               point_a=make_point(36 + i / 100.0, -115.1),
+                               point_b=make_point(36.04, -114.98),
+                               trip_distance="5",
+                               state=Job.OPEN)
+
+    def walk(self, params):
+        url = reverse('list_create_job')
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.data['previous'])
+        ids = [job['id'] for job in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            ids.extend(job['id'] for job in response.data['results'])
+        return ids, response
+
+    def test_walks_every_job_once(self):
+        for params in ({}, {'sort': 'price-high'},
+                       {'lat': 36.2, 'lng': -115.1},
+                       {'lat': 36.2, 'lng': -115.1, 'radius': 50,
+                        'sort': 'price-low'}):
+            ids, _ = self.walk(params)
+            self.assertEqual(len(ids), 40)
+            self.assertEqual(len(set(ids)), 40)
+
+    def test_nearest_first_across_pages(self):
+        ids, _ = self.walk({'lat': 36.0, 'lng': -115.1})
+        titles = [Job.objects.get(pk=job_id).title for job_id in ids]
+        self.assertEqual(titles, ["job {}".format(i) for i in range(40)])
+
+    def test_walks_back_with_previous(self):
+        for params in ({}, {'lat': 36.2, 'lng': -115.1,
+                            'sort': 'price-high'}):
+            ids, response = self.walk(params)
+            back = []
+            while response.data['previous']:
+                response = self.client.get(response.data['previous'])
+                self.assertIsNotNone(response.data['next'])
+                back = [job['id'] for job in response.data['results']] + \
+                    back
+            # 15 a page, the last page has 10
+            self.assertEqual(back, ids[:30])
+
+    def test_count_unless_skipped(self):
+        url = reverse('list_create_job')
+        self.assertEqual(self.client.get(url).data['count'], 40)
+        response = self.client.get(url, {'count': 'false'})
+        self.assertNotIn('count', response.data)
+        self.assertEqual(len(response.data['results']), 15)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('list_create_job'),
+                                   {'cursor': 'not a cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class TestStrikeCommands(TestCase):
+
+    def setUp(self):
+        self.poster = User.objects.create_user(username="poster",
+                                               email="",
+                                               password="pass_word")
+        self.job = Job.objects.create(user=self.poster, price=80,
+                                      title="test title",
+                                      pickup_for="tester",
+                                      destination_a="las vegas, nv",
+                                      destination_b="henderson, nv")
+
+    def banned_mover(self, username, *strike_ages):
+        user = User.objects.create_user(username=username, email="",
+                                        password="pass_word")
+        for days in strike_ages:
+            strike = Strike.objects.create(user=self.poster,
+                                           profile=user.profile,
+                                           job=self.job, comment="late")
+            Strike.objects.filter(pk=strike.pk).update(
+                created_at=timezone.now() - datetime.timedelta(days=days))
+        user.profile.ban_user()
+        return user
+
+    def test_unban_movers(self):
+        served = self.banned_mover("served", 3)
+        recent = self.banned_mover("recent", 1)
+        second = self.banned_mover("second", 3, 5)
+        third = self.banned_mover("third", 30, 40, 50)
+
+        out = io.StringIO()
+        call_command('unban_movers', dry_run=True, stdout=out)
+        self.assertIn("Would unban 1 movers (1 with one strike, 0 with two)",
+                      out.getvalue())
+        self.assertFalse(User.objects.get(pk=served.pk).is_active)
+
+        call_command('unban_movers', stdout=out)
+        self.assertIn("Unbanned 1 movers", out.getvalue())
+        self.assertTrue(User.objects.get(pk=served.pk).is_active)
+        self.assertFalse(UserProfile.objects.get(user=served).banned)
+        for user in (recent, second, third):
+            self.assertFalse(User.objects.get(pk=user.pk).is_active)
+
+    def test_delete_strikes(self):
+        self.banned_mover("mover", 1, 61, 90)
+        out = io.StringIO()
+        call_command('delete_strikes', dry_run=True, stdout=out)
+        self.assertIn("Would delete 2 strikes", out.getvalue())
+        self.assertEqual(Strike.objects.count(), 3)
+        call_command('delete_strikes', batch_size=1, stdout=out)
+        self.assertIn("Deleted 2 strikes", out.getvalue())
+        self.assertEqual(Strike.objects.count(), 1)
+
+
+@override_settings(FEED_CACHE_TIMEOUT=30)
+class TestFeedCache(APITransactionTestCase):
+    """
+    runs outside a test transaction so the on_commit bumps fire
+    """
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset('feed_cache.')
+        self.user = User.objects.create_user(username="poster",
+                                             email="",
+                                             password="pass_word")
+        self.create_job("vegas", 36.17, -115.14)
+        self.url = reverse('list_create_job')
+        self.vegas = {'lat': 36.16, 'lng': -115.15, 'radius': 25}
+
+    def create_job(self, title, latitude, longitude):
+        return Job.objects.create(user=self.user, price=80, title=title,
+                                  pickup_for="tester",
+                                  destination_a="somewhere",
+                                  destination_b="somewhere else",
+                                  point_a=make_point(latitude, longitude),
+                                  point_b=make_point(latitude, longitude),
+                                  trip_distance="1",
+                                  state=Job.OPEN)
+
+    def get_titles(self, params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [job['title'] for job in response.data['results']]
+
+    def test_repeat_poll_is_served_from_cache(self):
+        self.assertEqual(self.get_titles(self.vegas), ["vegas"])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get_titles(self.vegas), ["vegas"])
+        self.assertEqual(len(queries), 0)
+        stats = feed_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_job_in_region_invalidates(self):
+        self.get_titles(self.vegas)
+        self.create_job("henderson", 36.04, -114.98)
+        self.assertEqual(sorted(self.get_titles(self.vegas)),
+                         ["henderson", "vegas"])
+
+    def test_job_elsewhere_keeps_regional_pages(self):
+        self.get_titles(self.vegas)
+        self.get_titles({})
+        self.create_job("reno", 39.53, -119.81)
+        with CaptureQueriesContext(connection) as queries:
+            self.get_titles(self.vegas)
+        self.assertEqual(len(queries), 0)
+        self.assertIn("reno", self.get_titles({}))
+
+    def test_claim_invalidates(self):
+        mover = User.objects.create_user(username="mover", email="",
+                                         password="pass_word")
+        self.get_titles(self.vegas)
+        # a conditional update, no post_save is sent
+        self.assertTrue(Job.objects.get().claim(mover.profile))
+        self.assertEqual(self.get_titles(self.vegas), [])
+
+    def test_cached_links_keep_the_requesters_location(self):
+        for i in range(15):
+            self.create_job("job {}".format(i), 36.17, -115.14)
+        self.client.get(self.url, {'lat': 36.1601, 'lng': -115.1501})
+        response = self.client.get(self.url, {'lat': 36.1602,
+                                              'lng': -115.1502})
+        self.assertEqual(feed_cache.stats()['hits'], 1)
+        self.assertIn('lat=36.1602', response.data['next'])
+        self.assertNotIn('36.1601', response.data['next'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIn('lat=36.1602', response.data['previous'])
+
+    def test_bump_waits_for_commit(self):
+        before = feed_cache.versions(['all'])
+        with transaction.atomic():
+            self.create_job("henderson", 36.04, -114.98)
+            # a reader outside the transaction can't see the job yet,
+            # a page it caches now must stay under the old version
+            self.assertEqual(feed_cache.versions(['all']), before)
+        self.assertNotEqual(feed_cache.versions(['all']), before)
+
+
+class TestProfileTokenAuthentication(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="poster",
+                                             email="",
+                                             password="pass_word")
+        self.token = Token.objects.get(user_id=self.user.id)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.url = reverse('detail_logged_in_profile')
+
+    def get(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        return response, len(queries)
+
+    def test_token_user_and_profile_in_one_query(self):
+        response, queries = self.get()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(queries, 1)
+
+    def test_token_sees_fresh_profile(self):
+        self.get()
+        UserProfile.objects.filter(user=self.user).update(
+            display_name="renamed")
+        response, _ = self.get()
+        self.assertEqual(response.data['display_name'], "renamed")
+        # posting a job saves request.user.profile, it must not write
+        # back values read before the update
+        UserProfile.objects.filter(user=self.user).update(
+            customer_id="cus_newer")
+        response = self.client.post(reverse('list_create_job'), {
+            "title": "couch", "price": 80, "pickup_for": "tester",
+            "destination_a": "las vegas, nv",
+            "destination_b": "henderson, nv",
+            "phone_number": "5555555555"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.customer_id, "cus_newer")
+
+    def test_ban_takes_effect_at_once(self):
+        self.get()
+        self.user.profile.ban_user()
+        response, _ = self.get()
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.user.profile.unban_user()
+        response, _ = self.get()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_deleted_token_is_rejected(self):
+        self.get()
+        self.token.delete()
+        response, _ = self.get()
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@override_settings(STREAM_TIMEOUT=0.5, STREAM_HEARTBEAT=0.1)
+class TestJobStream(APITransactionTestCase):
+    """
+    runs outside a test transaction so on_commit publishing fires
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="mover",
+                                             email="",
+                                             password="pass_word")
+        token = Token.objects.get(user_id=self.user.id)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        self.url = reverse('job_stream')
+        self.vegas = {'lat': 36.16, 'lng': -115.15, 'radius': 25}
+
+    def create_job(self, title, latitude, longitude):
+        return Job.objects.create(user=self.user, price=80, title=title,
+                                  pickup_for="tester",
+                                  destination_a="somewhere",
+                                  destination_b="somewhere else",
+                                  point_a=make_point(latitude, longitude),
+                                  point_b=make_point(latitude, longitude),
+                                  trip_distance="1",
+                                  state=Job.OPEN)
+
+    def read(self, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_nearby_jobs_are_pushed(self):
+        response = self.client.get(self.url, self.vegas)
+        self.create_job("henderson", 36.04, -114.98)
+        self.create_job("reno", 39.53, -119.81)
+        body = self.read(response)
+        self.assertIn("event: posted", body)
+        self.assertIn("henderson", body)
+        self.assertNotIn("reno", body)
+
+    def test_taken_job_is_pushed(self):
+        job = self.create_job("henderson", 36.04, -114.98)
+        response = self.client.get(self.url, self.vegas)
+        job.state = Job.ACCEPTED
+        job.save()
+        body = self.read(response)
+        self.assertIn("event: taken", body)
+        self.assertNotIn("event: posted", body)
+
+    def test_edited_job_is_not_announced_again(self):
+        job = self.create_job("henderson", 36.04, -114.98)
+        response = self.client.get(self.url, self.vegas)
+        job.title = "henderson couch"
+        job.save()
+        self.assertNotIn("event: posted", self.read(response))
+
+    def test_unread_stream_unsubscribes(self):
+        response = self.client.get(self.url, self.vegas)
+        self.assertIn('jobs', get_broker().subscribers)
+        response.close()
+        self.assertNotIn('jobs', get_broker().subscribers)
+
+    def test_location_is_required(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(REPLICA_DATABASES=['replica'])
+class TestReplicaRouting(APITransactionTestCase):
+    """
+    'replica' mirrors the test database, committed rows are visible
+    on both connections
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="poster",
+                                             email="",
+                                             password="pass_word")
+        token = Token.objects.get(user_id=self.user.id)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        self.job = Job.objects.create(user=self.user, price=80,
+                                      title="couch", pickup_for="tester",
+                                      destination_a="las vegas, nv",
+                                      destination_b="henderson, nv",
+                                      point_a=make_point(36.17, -115.14),
+                                      point_b=make_point(36.04, -114.98),
+                                      trip_distance=12.6,
+                                      state=Job.OPEN)
+        self.url = reverse('detail_update_delete_job',
+                           kwargs={'pk': self.job.id})
+
+    def get(self, url):
+        with CaptureQueriesContext(connections['replica']) as replica, \
+                CaptureQueriesContext(connection) as primary:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(replica), len(primary)
+
+    def test_reads_go_to_replica(self):
+        replica, primary = self.get(reverse('list_create_job'))
+        self.assertGreater(replica, 0)
+        self.assertEqual(primary, 0)
+
+    def test_client_reads_its_writes_from_primary(self):
+        response = self.client.patch(self.url, {'title': "sofa"},
+                                     format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        replica, primary = self.get(self.url)
+        self.assertEqual(replica, 0)
+        self.assertGreater(primary, 0)
+
+        self.client.credentials()
+        replica, primary = self.get(self.url)
+        self.assertGreater(replica, 0)
+
+    @override_settings(REPLICA_MAX_LAG=-1)
+    def test_lagging_replica_is_skipped(self):
+        metrics.reset('replicas.')
+        replica, primary = self.get(reverse('list_create_job'))
+        self.assertGreater(primary, 0)
+        self.assertEqual(metrics.get('replicas.fallback'), 1)
+
+    def test_writes_go_to_primary(self):
+        with CaptureQueriesContext(connections['replica']) as replica:
+            response = self.client.post(reverse('list_create_job'), {
+                "title": "table", "price": 40, "pickup_for": "tester",
+                "destination_a": "las vegas, nv",
+                "destination_b": "henderson, nv",
+                "phone_number": "5555555555"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(replica), 0)
+
+    def test_lag_sql_follows_server_version(self):
+        self.assertIn("pg_last_xlog_replay_location()",
+                      routers.lag_sql(90605))
+        self.assertIn("pg_last_wal_replay_lsn()", routers.lag_sql(100004))
+        # the test database's own version
+        self.assertIsNotNone(routers.replica_lag('replica'))
+
+    def test_pin_cache_must_be_shared(self):
+        errors = routers.check_pin_cache(None)
+        self.assertEqual([error.id for error in errors], ['muver_api.E001'])
+        with override_settings(REPLICA_DATABASES=[]):
+            self.assertEqual(routers.check_pin_cache(None), [])
+
+
+@override_settings(LONG_POLL_TIMEOUT=0.3)
+class TestJobLongPoll(APITransactionTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="poster",
+                                             email="",
+                                             password="pass_word")
+        token = Token.objects.get(user_id=self.user.id)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        self.job = Job.objects.create(user=self.user, price=80,
+                                      title="couch", pickup_for="tester",
+                                      destination_a="somewhere",
+                                      destination_b="somewhere else",
+                                      point_a=make_point(36.17, -115.14),
+                                      point_b=make_point(36.04, -114.98),
+                                      trip_distance="1",
+                                      state=Job.OPEN)
+        self.url = reverse('detail_update_delete_job',
+                           kwargs={'pk': self.job.id})
+        self.since = self.client.get(self.url).data['modified_at']
+
+    def wait(self):
+        return self.client.get(self.url,
+                               {'wait_for_change_since': self.since})
+
+    def accept_later(self):
+        def accept():
+            try:
+                job = Job.objects.get(pk=self.job.id)
+                job.status = "Mover accepted job."
+                job.state = Job.ACCEPTED
+                job.save()
+            finally:
+                connection.close()
+        timer = threading.Timer(0.05, accept)
+        timer.start()
+        return timer
+
+    def test_unchanged_job_times_out(self):
+        response = self.wait()
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_change_releases_waiter(self):
+        with CaptureQueriesContext(connection) as single_read:
+            self.client.get(self.url)
+        timer = self.accept_later()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.wait()
+        timer.join()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], "Mover accepted job.")
+        # one read up front and one for the change, none while waiting
+        self.assertEqual(len(queries), 2 * len(single_read))
+
+    def test_claim_releases_waiter(self):
+        mover = User.objects.create_user(username="mover", email="",
+                                         password="pass_word")
+
+        def claim():
+            try:
+                # a conditional update, no post_save is sent
+                Job.objects.get(pk=self.job.id).claim(mover.profile)
+            finally:
+                connection.close()
+        timer = threading.Timer(0.05, claim)
+        timer.start()
+        response = self.wait()
+        timer.join()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['mover_profile'], mover.profile.id)
+
+    def test_older_version_returns_at_once(self):
+        self.since = (self.job.modified_at -
+                      datetime.timedelta(seconds=1)).isoformat()
+        response = self.wait()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['id'], self.job.id)
+
+    def test_invalid_since(self):
+        self.since = "yesterday"
+        response = self.wait()
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestBulkJobImport(APITestCase):
+
+    def setUp(self):
+        get_memory_cache().clear()
+        metrics.reset('geocode.')
+        self.user = User.objects.create_user(username="dispatch",
+                                             email="",
+                                             password="pass_word")
+        token = Token.objects.get(user_id=self.user.id)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        self.url = reverse('bulk_create_job')
+
+    def row(self, title, destination_a="las vegas, nv",
+            destination_b="henderson, nv"):
+        return {'title': title, 'price': 80, 'pickup_for': "dispatch",
+                'phone_number': "5555555555",
+                'destination_a': destination_a,
+                'destination_b': destination_b}
+
+    def test_json_import(self):
+        rows = [self.row("couch"), self.row("bed"),
+                self.row("desk", destination_b="Reno,  NV"),
+                {'title': "no price"}]
+        response = self.client.post(self.url, rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((response.data['created'], response.data['failed']),
+                         (3, 1))
+        results = response.data['results']
+        self.assertIn('price', results[3]['errors'])
+        jobs = Job.objects.filter(user=self.user).order_by('id')
+        self.assertEqual([job.id for job in jobs],
+                         [result['id'] for result in results[:3]])
+        self.assertTrue(all(job.state == Job.OPEN for job in jobs))
+        self.assertIsNotNone(jobs[0].point_a)
+        self.assertIsNotNone(jobs[0].created_at)
+        # three distinct addresses across the batch
+        self.assertEqual(metrics.get('geocode.external_calls'), 3)
+        self.user.profile.refresh_from_db()
+        self.assertTrue(self.user.profile.in_progress)
+
+    def test_csv_import(self):
+        body = ("title,price,pickup_for,phone_number,destination_a,"
+                "destination_b,description\n"
+                "couch,80,dispatch,5555555555,las vegas nv,henderson nv,\n"
+                "bed,90,dispatch,5555555555,las vegas nv,???,big\n")
+        response = self.client.post(self.url, body, content_type='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        couch, bed = Job.objects.filter(user=self.user).order_by('id')
+        self.assertEqual(couch.state, Job.OPEN)
+        self.assertEqual(bed.state, Job.NOT_FOUND)
+        self.assertEqual(bed.description, "big")
+
+    def test_rejects_non_list(self):
+        response = self.client.post(self.url, self.row("couch"),
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestLoadBenchmark(TestCase):
+
+    def test_seed_and_replay(self):
+        call_command('seed_data', users=20, jobs=200, mover_ratio=0.5,
+                     stdout=open(os.devnull, 'w'))
+        self.assertEqual(Job.objects.count(), 200)
+        self.assertEqual(Token.objects.filter(
+            user__username__startswith='seed-').count(), 20)
+        open_jobs = Job.objects.open().count()
+
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            call_command('benchmark_load', requests=30, output=output.name,
+                         stdout=open(os.devnull, 'w'))
+            report = json.load(open(output.name))
+
+        results = report['results']
+        self.assertEqual(set(results),
+                         {'feed', 'user_jobs', 'accept', 'all'})
+        self.assertEqual(results['all']['errors'], 0)
+        for key in ('p50', 'p95', 'p99', 'throughput_rps', 'queries_avg'):
+            self.assertIn(key, results['all'])
+        # the replay is rolled back
+        self.assertEqual(Job.objects.open().count(), open_jobs)
+
+
+class TestPerformanceMiddleware(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="poster",
+                                             email="",
+                                             password="pass_word")
+        token = Token.objects.get(user_id=self.user.id)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        self.url = reverse('detail_logged_in_profile')
+
+    @override_settings(PERFORMANCE_SAMPLE_RATE=1.0)
+    def test_sampled_request_gets_server_timing(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        timing = response['Server-Timing']
+        self.assertIn('total;dur=', timing)
+        self.assertIn('desc="{} queries"'.format(len(queries)), timing)
+        self.assertIn('serialize;dur=', timing)
+
+    @override_settings(PERFORMANCE_SAMPLE_RATE=0)
+    def test_unsampled_request(self):
+        response = self.client.get(self.url)
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+class BlockingHandler(logging.Handler):
+    """
+    a log target that waits until released
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+        self.records = []
+
+    def emit(self, record):
+        self.release.wait(5)
+        self.records.append(record)
+
+
+class TestQueueLogging(TestCase):
+
+    def setUp(self):
+        metrics.reset('logging.')
+
+    def record(self, name="muver_api.test", level=logging.INFO,
+               message="hello", **extra):
+        record = logging.LogRecord(name, level, __file__, 1, message, (),
+                                   None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        target = BlockingHandler()
+        handler = BoundedQueueHandler(targets=[target], capacity=1)
+        try:
+            start = time.perf_counter()
+            for _ in range(5):
+                handler.handle(self.record())
+            self.assertLess(time.perf_counter() - start, 1)
+            self.assertGreaterEqual(metrics.get('logging.dropped'), 3)
+        finally:
+            target.release.set()
+            handler.stop()
+        self.assertEqual(len(target.records) +
+                         metrics.get('logging.dropped'), 5)
+
+    def test_json_formatter_keeps_extra_fields(self):
+        entry = json.loads(JSONFormatter().format(
+            self.record(timings={'total_ms': 1.5})))
+        self.assertEqual(entry['message'], "hello")
+        self.assertEqual(entry['level'], "INFO")
+        self.assertEqual(entry['timings'], {'total_ms': 1.5})
+
+    def test_sampling_keeps_warnings(self):
+        sampling = SamplingFilter({'muver_api.performance': 0})
+        self.assertFalse(sampling.filter(
+            self.record("muver_api.performance")))
+        self.assertTrue(sampling.filter(
+            self.record("muver_api.performance", logging.WARNING)))
+        self.assertTrue(sampling.filter(self.record("muver_api.views")))
+        self.assertEqual(metrics.get('logging.sampled_out'), 1)
+
+    def test_records_reach_targets_through_the_listener(self):
+        stream = io.StringIO()
+        target = logging.StreamHandler(stream)
+        target.setFormatter(JSONFormatter())
+        handler = BoundedQueueHandler(targets=[target])
+        handler.handle(self.record(message="queued"))
+        handler.stop()
+        self.assertEqual(json.loads(stream.getvalue())['message'], "queued")
+
+
+class TestSparseFieldsets(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="poster",
+                                             email="",
+                                             password="pass_word")
+        token = Token.objects.get(user_id=self.user.id)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        self.job = Job.objects.create(user=self.user, price=80,
+                                      title="couch", pickup_for="tester",
+                                      description="a big couch",
+                                      destination_a="las vegas, nv",
+                                      destination_b="henderson, nv",
+                                      point_a=make_point(36.17, -115.14),
+                                      point_b=make_point(36.04, -114.98),
+                                      trip_distance="12",
+                                      state=Job.OPEN)
+        self.url = reverse('list_create_job')
+
+    def get(self, url, params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        sql = [query['sql'] for query in queries
+               if 'muver_api_job' in query['sql']]
+        return response.data, sql
+
+    def test_compact_feed(self):
+        data, sql = self.get(self.url, {'lat': 36.16, 'lng': -115.15,
+                                        'radius': 25, 'compact': 'true'})
+        card = data['results'][0]
+        self.assertEqual(card['title'], "couch")
+        self.assertIn('distance', card)
+        self.assertNotIn('user', card)
+        self.assertNotIn('description', sql[-1])
+        self.assertNotIn('auth_user', sql[-1])
+
+    def test_fields_projection(self):
+        data, sql = self.get(self.url, {'fields': 'id,title'})
+        self.assertEqual(data['results'], [{'id': self.job.id,
+                                            'title': "couch"}])
+        self.assertNotIn('description', sql[-1])
+
+    def test_nested_field_keeps_its_relation(self):
+        url = reverse('detail_update_delete_job', kwargs={'pk': self.job.id})
+        data, sql = self.get(url, {'fields': 'title,user'})
+        self.assertEqual(set(data), {'title', 'user'})
+        self.assertEqual(data['user']['username'], "poster")
+        self.assertEqual(len(sql), 1)
+
+    def test_profile_fields(self):
+        data, _ = self.get(reverse('detail_logged_in_profile'),
+                           {'fields': 'id,display_name'})
+        self.assertEqual(set(data), {'id', 'display_name'})
+
+    def test_unknown_field(self):
+        response = self.client.get(self.url, {'fields': 'id,secret'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestJobClaim(APITransactionTestCase):
+    """
+    runs outside a test transaction so the racing threads see the job
+    """
+
+    def setUp(self):
+        self.poster = User.objects.create_user(username="poster",
+                                               email="",
+                                               password="pass_word")
+        self.poster.profile.customer_id = "cus_test"
+        self.poster.profile.save()
+        self.movers = []
+        for i in range(5):
+            user = User.objects.create_user(username="mover {}".format(i),
+                                            email="",
+                                            password="pass_word")
+            user.profile.mover = True
+            user.profile.stripe_account_id = "acct_{}".format(i)
+            user.profile.save()
+            self.movers.append(user.profile)
+        self.job = Job.objects.create(user=self.poster, price=80,
+                                      title="couch", pickup_for="tester",
+                                      destination_a="las vegas, nv",
+                                      destination_b="henderson, nv",
+                                      point_a=make_point(36.17, -115.14),
+                                      point_b=make_point(36.04, -114.98),
+                                      trip_distance="12",
+                                      state=Job.OPEN)
+        self.url = reverse('detail_update_delete_job',
+                           kwargs={'pk': self.job.id})
+
+    def accept(self, mover, barrier=None):
+        try:
+            client = APIClient()
+            client.force_authenticate(mover.user)
+            if barrier is not None:
+                barrier.wait()
+            return client.patch(self.url, {'mover_profile': mover.id},
+                                format='json').status_code
+        finally:
+            if barrier is not None:
+                connection.close()
+
+    def test_late_mover_gets_conflict(self):
+        self.assertEqual(self.accept(self.movers[0]), status.HTTP_200_OK)
+        self.assertEqual(self.accept(self.movers[1]),
+                         status.HTTP_409_CONFLICT)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.mover_profile_id, self.movers[0].id)
+        self.assertEqual(self.job.payment_tasks.count(), 1)
+
+    def test_racing_movers_charge_once(self):
+        barrier = threading.Barrier(len(self.movers))
+        with ThreadPoolExecutor(len(self.movers)) as pool:
+            statuses = list(pool.map(lambda mover: self.accept(mover,
+                                                               barrier),
+                                     self.movers))
+        self.assertEqual(sorted(statuses),
+                         [status.HTTP_200_OK] +
+                         [status.HTTP_409_CONFLICT] * (len(self.movers) - 1))
+        self.assertEqual(self.job.payment_tasks.filter(
+            operation='charge').count(), 1)
+        self.assertEqual(TextMessage.objects.count(), 1)
+
+
+class TestTripDistance(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="poster",
+                                             email="",
+                                             password="pass_word")
+        self.client.force_authenticate(self.user)
+
+    def create_job(self, title, trip_distance=None):
+        return Job.objects.create(user=self.user, price=20, title=title,
+                                  pickup_for="tester",
+                                  destination_a="las vegas, nv",
+                                  destination_b="henderson, nv",
+                                  point_a=make_point(36.1699, -115.1398),
+                                  point_b=make_point(36.0395, -114.9817),
+                                  trip_distance=trip_distance,
+                                  state=Job.OPEN)
+
+    def test_trip_miles_is_geodesic(self):
+        miles = trip_miles(make_point(36.1699, -115.1398),
+                           make_point(36.0395, -114.9817))
+        self.assertAlmostEqual(miles, 12.5, delta=0.5)
+
+    def test_distance_sort_is_numeric(self):
+        self.create_job("far", 10)
+        self.create_job("near", 2)
+        response = self.client.get(reverse('list_create_job'),
+                                   {'sort': 'dist-low'})
+        self.assertEqual([job['title'] for job in response.data['results']],
+                         ["near", "far"])
+
+    def test_backfill_recomputes_distances(self):
+        stale = self.create_job("stale", 99)
+        missing = self.create_job("missing")
+        call_command('backfill_trip_distance', missing=True, chunk_size=1,
+                     stdout=io.StringIO())
+        stale.refresh_from_db()
+        missing.refresh_from_db()
+        self.assertEqual(stale.trip_distance, 99)
+        self.assertAlmostEqual(missing.trip_distance, 12.5, delta=0.5)
+
+        call_command('backfill_trip_distance', stdout=io.StringIO())
+        stale.refresh_from_db()
+        self.assertEqual(stale.trip_distance, missing.trip_distance)
+
+
+class TestStartupReport(TestCase):
+
+    def test_within_budget(self):
+        output = io.StringIO()
+        call_command('startup_report', runs=1, budget_ms=60000,
+                     stdout=output)
+        self.assertIn(settings.ROOT_URLCONF, output.getvalue())
+
+    def test_over_budget(self):
+        with self.assertRaises(CommandError):
+            call_command('startup_report', runs=1, budget_ms=1,
+                         stdout=io.StringIO())
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(500 if self.path == '/fail' else 200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHTTPClients(TestCase):
+
+    def setUp(self):
+        clients.close()
+        resilience.reset_breakers()
+        metrics.reset('clients.')
+        metrics.reset('breaker.')
+        self.server = HTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+
+    def tearDown(self):
+        clients.close()
+        resilience.reset_breakers()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_is_reused(self):
+        for _ in range(3):
+            response = clients.request('google', 'GET', self.url)
+            self.assertEqual(response.content, b'ok')
+        self.assertEqual(clients.connection_stats()['google'],
+                         {'requests': 3, 'connections': 1, 'reused': 2})
+
+    def test_one_session_per_provider_and_process(self):
+        session = clients.get_session('twilio')
+        self.assertIs(clients.get_session('twilio'), session)
+        self.assertIsNot(clients.get_session('stripe'), session)
+        # as seen from a forked child
+        clients._pid = -1
+        self.assertIsNot(clients.get_session('twilio'), session)
+
+    @override_settings(HTTP_CLIENTS={'google': {'pool_size': 3}})
+    def test_pool_size_from_settings(self):
+        adapter = clients.get_session('google').get_adapter(self.url)
+        self.assertEqual(adapter._pool_maxsize, 3)
+
+    @override_settings(CIRCUIT_BREAKERS={'google': {'failures': 2,
+                                                    'reset_after': 60}})
+    def test_failing_provider_fails_fast(self):
+        for _ in range(2):
+            response = clients.request('google', 'GET', self.url + 'fail')
+            self.assertEqual(response.status_code, 500)
+        with self.assertRaises(ServiceUnavailable):
+            clients.request('google', 'GET', self.url)
+        self.assertEqual(metrics.get('clients.google.requests'), 2)
+        self.assertEqual(metrics.get('breaker.google.trips'), 1)
+
+    def test_deadline_bounds_calls(self):
+        resilience.start_deadline(0)
+        try:
+            with self.assertRaises(ServiceUnavailable):
+                clients.request('google', 'GET', self.url)
+        finally:
+            resilience.clear_deadline()
+        self.assertEqual(metrics.get('clients.google.requests'), 0)
+
+
+class TestCircuitBreaker(APITestCase):
+
+    def setUp(self):
+        resilience.reset_breakers()
+        metrics.reset('breaker.')
+
+    def tearDown(self):
+        resilience.reset_breakers()
+
+    def test_trips_and_recovers(self):
+        breaker = resilience.CircuitBreaker('test', failures=2,
+                                            reset_after=0)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, breaker.OPEN)
+        # the trial call after reset_after
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, breaker.HALF_OPEN)
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, breaker.CLOSED)
+        self.assertEqual(metrics.get('breaker.test.trips'), 1)
+        self.assertEqual(metrics.get('breaker.test.recoveries'), 1)
+        self.assertEqual(metrics.get('breaker.test.rejected'), 1)
+
+    def test_failed_trial_reopens(self):
+        breaker = resilience.CircuitBreaker('test', failures=1,
+                                            reset_after=0)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, breaker.OPEN)
+        self.assertEqual(metrics.get('breaker.test.trips'), 2)
+
+    def test_open_stripe_breaker_answers_503(self):
+        user = User.objects.create_user(username="poster", email="",
+                                        password="pass_word")
+        self.client.force_authenticate(user)
+        breaker = resilience.get_breaker('stripe')
+        for _ in range(breaker.failures):
+            breaker.record_failure()
+        response = self.client.post(reverse('create_customer'),
+                                    {'token': 'tok_visa'}, format='json')
+        self.assertEqual(response.status_code,
+                         status.HTTP_503_SERVICE_UNAVAILABLE)
@@ -2,7 +2,8 @@ from django.conf.urls import url
 from muver_api.views import CreateUser, DetailUser, ListCreateJob, \
     RetrieveUpdateUserProfile, RetrieveUpdateDestroyJob,\
     CreateStripeAccount, ListUserProfile, DetailUserProfile, \
-    JobsByUser, CompletedJobsByUser, CreateCustomer, CreateStrike
+    JobsByUser, CompletedJobsByUser, CreateCustomer, CreateStrike, JobStream, \
+    BulkCreateJob
 
 urlpatterns = [
     url(r'^user/$', CreateUser.as_view(), name="create_user"),
@@ -16,6 +17,8 @@ urlpatterns = [
     url(r'^profile/jobs/completed/$', CompletedJobsByUser.as_view(),
         name="completed_user_jobs"),
     url(r'^jobs/$', ListCreateJob.as_view(), name="list_create_job"),
+    url(r'^jobs/bulk/$', BulkCreateJob.as_view(), name="bulk_create_job"),
+    url(r'^jobs/stream/$', JobStream.as_view(), name="job_stream"),
     url(r'^jobs/(?P<pk>\d+)/$', RetrieveUpdateDestroyJob.as_view(),
         name="detail_update_delete_job"),
     url(r'^customer/$', CreateCustomer.as_view(), name="create_customer"),
@@ -1,21 +1,40 @@
 import logging
+from collections import OrderedDict
+from django.conf import settings
 # from django.conf.global_settings import LOGGING
 from django.contrib.auth.models import User
 from django.contrib.gis.db.models.functions import Distance
-from django.contrib.gis.geos import GEOSGeometry
+from django.contrib.gis.measure import D
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 # from django.core import serializers
 # from django.http import HttpResponse
 # from django.shortcuts import render
+from muver_api.broker import get_broker, job_channel
+from muver_api.bulk import import_jobs
+from muver_api.caching import feed_cache
+from muver_api.geo import geohash, geohash_center, geohashes_covering, \
+    make_point, radius_degrees
+from muver_api.instrumentation import track
 from muver_api.models import UserProfile, Job
+from muver_api.pagination import KeysetPagination
+from muver_api.parsers import CSVParser
 from muver_api.permissions import IsOwnerOrReadOnly, IsOwnerOrMoverOrReadOnly
+from muver_api.routers import use_primary
 from muver_api.serializers import UserSerializer, UserProfileSerializer, \
     JobSerializer, StripeAccountSerializer, \
-    CustomerSerializer, StrikeSerializer
+    CustomerSerializer, StrikeSerializer, JobCardSerializer
+from muver_api.streaming import EventStreamRenderer, job_feed_stream, \
+    release_connections
 from rest_framework import generics, status
 from rest_framework import permissions
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import JSONParser
 # from rest_framework.authtoken.models import Token
 # from rest_framework.authtoken.views import ObtainAuthToken
-from rest_framework.permissions import IsAuthenticatedOrReadOnly
+from rest_framework.permissions import SAFE_METHODS, IsAuthenticated, \
+    IsAuthenticatedOrReadOnly
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
@@ -38,9 +57,48 @@ logger.info("muver_api.views logger")
 #                         'profile_id': profile_id})
 
 
+def get_fields_param(request):
+    """
+    returns the names in ?fields=a,b or None
+    """
+    value = request.query_params.get('fields')
+    if not value:
+        return None
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+class SparseQuerysetMixin(object):
+    """
+    ?fields=a,b limits the serializer of safe requests to those fields
+    and their query to the columns and relations the fields read.
+    serializers with narrow_query set are always narrowed.
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        fields = get_fields_param(self.request)
+        if fields is not None and self.request.method in SAFE_METHODS:
+            kwargs.setdefault('fields', fields)
+        return super().get_serializer(*args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        narrow = getattr(self.get_serializer_class(), 'narrow_query', False)
+        if self.request.method not in SAFE_METHODS or \
+                not (narrow or get_fields_param(self.request)):
+            return queryset
+        columns, related = self.get_serializer().get_columns()
+        # keyset pagination reads the ordering columns of the last row
+        for name in queryset.query.order_by:
+            name = name.lstrip('-')
+            if name not in queryset.query.extra and name != 'pk':
+                columns.add(name)
+        return queryset.select_related(None).select_related(*related)\
+            .only(*columns)
+
+
 class DetailUser(generics.RetrieveAPIView):
 
-    queryset = User.objects.all()
+    queryset = User.objects.select_related('profile')
     serializer_class = UserSerializer
 
 
@@ -56,112 +114,296 @@ class CreateUser(generics.CreateAPIView):
 class DetailUserProfile(APIView):
 
     def get(self, request):
-        serializer = UserProfileSerializer(request.user.profile)
+        serializer = UserProfileSerializer(request.user.profile,
+                                           fields=get_fields_param(request))
         return Response(serializer.data)
 
 
-class ListUserProfile(generics.ListAPIView):
+class ListUserProfile(SparseQuerysetMixin, generics.ListAPIView):
 
-    queryset = UserProfile.objects.all()
+    queryset = UserProfile.objects.select_related('user__profile')\
+        .order_by('id')
     serializer_class = UserProfileSerializer
+    pagination_class = KeysetPagination
 
 
-class RetrieveUpdateUserProfile(generics.RetrieveUpdateAPIView):
-    queryset = UserProfile.objects.all()
+class RetrieveUpdateUserProfile(SparseQuerysetMixin,
+                                generics.RetrieveUpdateAPIView):
+    queryset = UserProfile.objects.select_related('user__profile')
     serializer_class = UserProfileSerializer
     # permission_classes = (IsOwnerOrReadOnly,)
 
 
-class ListCreateJob(generics.ListCreateAPIView):
+class ListCreateJob(SparseQuerysetMixin, generics.ListCreateAPIView):
 
     queryset = Job.objects.all()
     serializer_class = JobSerializer
     permission_classes = (IsAuthenticatedOrReadOnly,)
+    pagination_class = KeysetPagination
+    max_radius = 100
+
+    def get_serializer_class(self):
+        """
+        ?compact=true renders the feed as small cards
+        """
+        if self.request.method in SAFE_METHODS and \
+                self.request.query_params.get('compact') == 'true':
+            return JobCardSerializer
+        return self.serializer_class
 
     def perform_create(self, serializer):
-
-        logger.error(serializer.errors)
-
         serializer.save(user=self.request.user)
 
-    def get_queryset(self):
-
+    def get_radius(self):
+        """
+        returns the `radius` query param in miles or None
+        """
+        radius = self.request.query_params.get('radius', None)
+        if not radius:
+            return None
+        try:
+            radius = float(radius)
+        except ValueError:
+            raise ValidationError({'radius': 'Radius must be a number.'})
+        if not 0 < radius <= self.max_radius:
+            raise ValidationError({'radius': 'Radius must be between 0 and '
+                                             '{} miles.'.format(self.max_radius)})
+        return radius
+
+    def get_location(self):
+        """
+        returns the lat/lng query params. With the feed cache on they
+        are snapped to the center of their geohash cell, so everyone
+        in the cell shares the same cached pages.
+        """
         latitude = self.request.query_params.get('lat', None)
         longitude = self.request.query_params.get('lng', None)
+        if latitude and longitude and feed_cache.enabled:
+            try:
+                return geohash_center(latitude, longitude,
+                                      settings.FEED_CACHE_PRECISION)
+            except ValueError:
+                raise ValidationError('lat and lng must be numbers.')
+        return latitude, longitude
+
+    def get_cache_key(self):
+        params = dict(self.request.query_params.items())
+        latitude, longitude = self.get_location()
+        params.pop('lat', None)
+        params.pop('lng', None)
+        regions = ['all']
+        if latitude and longitude:
+            params['cell'] = geohash(latitude, longitude,
+                                     settings.FEED_CACHE_PRECISION)
+            radius = self.get_radius()
+            if radius:
+                regions = geohashes_covering(latitude, longitude, radius,
+                                             settings.FEED_REGION_PRECISION)
+        return feed_cache.key(params, regions)
+
+    def list(self, request, *args, **kwargs):
+        if not feed_cache.enabled:
+            return super().list(request, *args, **kwargs)
+        key = self.get_cache_key()
+        data = feed_cache.get(key)
+        if data is None:
+            # a page read from a lagging replica would be cached under
+            # the version that was meant to orphan it
+            use_primary()
+            response = super().list(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            # the links carry the first requester's lat/lng, only the
+            # cursors are shared with the rest of the cell
+            data = OrderedDict(response.data)
+            data['next'] = self.paginator.get_next_cursor()
+            data['previous'] = self.paginator.get_previous_cursor()
+            feed_cache.set(key, data)
+        data = OrderedDict(data)
+        data['next'] = self.paginator.get_link(request, data['next'])
+        data['previous'] = self.paginator.get_link(request,
+                                                   data['previous'])
+        return Response(data)
+
+    def get_queryset(self):
+
+        latitude, longitude = self.get_location()
         sort = self.request.query_params.get('sort', None)
 
         if latitude and longitude:
-            # qs = super().get_queryset()
-            pnt = GEOSGeometry(
-                'POINT(' + str(longitude) + ' ' + str(latitude) + ')',
-                srid=4326)
-            new_query = Job.objects.filter(mover_profile=None).annotate(
-                distance=Distance('point_a', pnt)).filter(complete=False)\
-                .exclude(conflict=True)
+            pnt = make_point(latitude, longitude)
+            radius = self.get_radius()
+            new_query = Job.objects.with_related().open()\
+                .annotate(distance=Distance('point_a', pnt))
+            if radius:
+                # dwithin on degrees hits the GiST index on point_a,
+                # distance_lte trims the corners to the real radius
+                new_query = new_query.filter(
+                    point_a__dwithin=(pnt, radius_degrees(latitude, radius)))\
+                    .filter(point_a__distance_lte=(pnt, D(mi=radius)))
+                nearest = 'ST_Distance_Sphere(point_a, ST_GeomFromEWKT(%s))'
+            else:
+                # unbounded feed, KNN ordering lets postgres walk the
+                # GiST index instead of sorting every open job
+                nearest = 'point_a <-> ST_GeomFromEWKT(%s)'
+            new_query = new_query.extra(select={'nearest': nearest},
+                                        select_params=(pnt.ewkt,))
             if sort == "price-low":
-                return new_query.order_by('distance', 'price')
+                return new_query.order_by('nearest', 'price', 'id')
             elif sort == "price-high":
-                return new_query.order_by('distance', '-price')
+                return new_query.order_by('nearest', '-price', 'id')
             elif sort == "dist-low":
-                return new_query.order_by('distance', 'trip_distance')
+                return new_query.order_by('nearest', 'trip_distance', 'id')
             elif sort == "dist-high":
-                return new_query.order_by('distance', '-trip_distance')
+                return new_query.order_by('nearest', '-trip_distance', 'id')
             else:
-                return new_query.order_by('distance')
+                return new_query.order_by('nearest', 'id')
 
         else:
-            without_location = Job.objects.filter(mover_profile=None).filter(
-                complete=False).exclude(conflict=True)
+            without_location = Job.objects.with_related().open()
             sort = self.request.GET.get('sort', '')
 
             if sort == "price-low":
-                return without_location.order_by('price')
+                return without_location.order_by('price', 'id')
             elif sort == "price-high":
-                return without_location.order_by('-price')
+                return without_location.order_by('-price', '-id')
             elif sort == "dist-low":
-                return without_location.order_by('trip_distance')
+                return without_location.order_by('trip_distance', 'id')
             elif sort == "dist-high":
-                return without_location.order_by('-trip_distance')
+                return without_location.order_by('-trip_distance', '-id')
             else:
-                return without_location.order_by('-created_at')
+                return without_location.order_by('-created_at', '-id')
 
 
-class JobsByUser(generics.ListAPIView):
+class BulkCreateJob(APIView):
+    """
+    creates up to settings.BULK_IMPORT_MAX_ROWS jobs from a JSON array
+    or a CSV file with a header row. Returns a result per row, with
+    the new job id or the row's validation errors.
+    """
+    permission_classes = (IsAuthenticated,)
+    parser_classes = (JSONParser, CSVParser)
+
+    def post(self, request):
+        rows = request.data
+        if not isinstance(rows, list):
+            raise ValidationError('Expected a list of jobs.')
+        limit = settings.BULK_IMPORT_MAX_ROWS
+        if len(rows) > limit:
+            raise ValidationError('At most {} jobs can be imported at '
+                                  'once.'.format(limit))
+        results = import_jobs(request.user, rows)
+        created = sum(1 for result in results if 'id' in result)
+        return Response({'created': created,
+                         'failed': len(results) - created,
+                         'results': results},
+                        status=status.HTTP_201_CREATED if created
+                        else status.HTTP_400_BAD_REQUEST)
+
+
+class JobStream(APIView):
+    """
+    server-sent events of jobs posted or taken within `radius` miles
+    of lat/lng, so movers don't have to poll the feed
+    """
+    permission_classes = (IsAuthenticated,)
+    renderer_classes = (EventStreamRenderer,)
+    default_radius = 25
+    max_radius = 100
+
+    def get(self, request):
+        try:
+            latitude = float(request.query_params['lat'])
+            longitude = float(request.query_params['lng'])
+            radius = float(request.query_params.get('radius',
+                                                    self.default_radius))
+        except (KeyError, ValueError):
+            raise ValidationError('lat, lng and radius must be numbers.')
+        if not 0 < radius <= self.max_radius:
+            raise ValidationError({'radius': 'Radius must be between 0 and {} '
+                                             'miles.'.format(self.max_radius)})
+        subscription = get_broker().subscribe('jobs')
+        response = StreamingHttpResponse(
+            job_feed_stream(subscription, latitude, longitude, radius,
+                            settings.STREAM_TIMEOUT,
+                            settings.STREAM_HEARTBEAT),
+            content_type='text/event-stream')
+        # the generator only unsubscribes once it has started, a client
+        # that goes away before the first read is cleaned up on close
+        response._closable_objects.append(subscription)
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class JobsByUser(SparseQuerysetMixin, generics.ListAPIView):
     serializer_class = JobSerializer
     permission_classes = (IsOwnerOrReadOnly,)
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
-        user = self.request.user
-        if not user.profile.mover:
-            return Job.objects.filter(user=user).filter(confirmation_user=False) \
-                .exclude(conflict=True).order_by("-modified_at")
-        else:
-            profile = user.profile
-            return Job.objects.filter(mover_profile=profile.id)\
-                .filter(confirmation_mover=False).exclude(conflict=True)\
-                .order_by("-modified_at")
+        return Job.objects.with_related().active_for(self.request.user)\
+            .order_by("-modified_at", "-id")
 
 
-class CompletedJobsByUser(generics.ListAPIView):
+class CompletedJobsByUser(SparseQuerysetMixin, generics.ListAPIView):
     serializer_class = JobSerializer
     permission_classes = (IsOwnerOrReadOnly,)
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
-        user = self.request.user
-        if not user.profile.mover:
-            return Job.objects.filter(user=user).filter(confirmation_user=True) \
-                .exclude(conflict=True).order_by("-modified_at")
-        else:
-            return Job.objects.filter(mover_profile=user.profile.id) \
-                .exclude(conflict=True).filter(confirmation_mover=True)\
-                .order_by("-modified_at")
+        return Job.objects.with_related().completed_for(self.request.user)\
+            .order_by("-modified_at", "-id")
 
 
-class RetrieveUpdateDestroyJob(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Job.objects.all()
+class RetrieveUpdateDestroyJob(SparseQuerysetMixin,
+                               generics.RetrieveUpdateDestroyAPIView):
+    queryset = Job.objects.with_related()
     serializer_class = JobSerializer
     permission_classes = (IsOwnerOrMoverOrReadOnly,)
 
+    def get_wait_since(self):
+        """
+        returns the `wait_for_change_since` query param as an aware
+        datetime or None
+        """
+        since = self.request.query_params.get('wait_for_change_since')
+        if not since:
+            return None
+        # an unencoded + in the utc offset arrives as a space
+        since = parse_datetime(since.replace(' ', '+'))
+        if since is None:
+            raise ValidationError({'wait_for_change_since':
+                                   'Must be an ISO 8601 datetime.'})
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        return since
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        with ?wait_for_change_since=<modified_at> the request is held
+        until the job is saved after that time, or answered with 304
+        after settings.LONG_POLL_TIMEOUT seconds
+        """
+        since = self.get_wait_since()
+        if since is None:
+            return super().retrieve(request, *args, **kwargs)
+        # the change is announced by the primary, a replica may not
+        # have it yet
+        use_primary()
+        # subscribe before reading so a change in between isn't missed
+        subscription = get_broker().subscribe(job_channel(kwargs['pk']))
+        try:
+            job = self.get_object()
+            if job.modified_at <= since:
+                release_connections()
+                if subscription.get(settings.LONG_POLL_TIMEOUT) is None:
+                    return Response(status=status.HTTP_304_NOT_MODIFIED)
+                job = self.get_object()
+        finally:
+            subscription.close()
+        return Response(self.get_serializer(job).data)
+
 
 class CreateCustomer(APIView):
 
@@ -170,7 +412,8 @@ class CreateCustomer(APIView):
     def post(self, request):
         serializer = CustomerSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save(user=request.user)
+            with track('stripe'):
+                serializer.save(user=request.user)
             return Response(None, status=status.HTTP_201_CREATED)
 
         logger.error("ERROR: Customer stripe account creation failed with:\n"
@@ -186,7 +429,8 @@ class CreateStripeAccount(APIView):
     def post(self, request):
         serializer = StripeAccountSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save(user=request.user)
+            with track('stripe'):
+                serializer.save(user=request.user)
             return Response(None, status=status.HTTP_201_CREATED)
 
         logger.error("ERROR: Stripe managed account creation failed with:\n"